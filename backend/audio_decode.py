@@ -0,0 +1,172 @@
+"""In-process decoding of the uploads to the input of Whisper, 16 kHz mono float32.
+
+whisper.load_audio runs an ffmpeg subprocess per file, reads its whole output as bytes and converts them to
+int16 and then float32, so the audio is held about three times over. With PyAV (the FFmpeg libraries in the
+process), the decoded frames are resampled and written straight into one preallocated float32 array. Without
+PyAV, whisper.load_audio is used.
+
+iter_audio decodes the file block by block instead, for the long files that are transcribed in bounded memory.
+decode_head tells the short files from the long ones when the header doesn't have the duration.
+"""
+import logging
+import tempfile
+import itertools
+import subprocess
+
+import numpy as np
+import whisper
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+
+try:
+    import av
+except ImportError:
+    av = None
+    logger.info("PyAV is not installed, the uploads are decoded with the ffmpeg command")
+
+
+def load_audio(path):
+    """Decodes the file to a 16 kHz mono float32 array. Raises RuntimeError if it can't be decoded."""
+    if av is None:
+        return whisper.load_audio(path)
+    try:
+        return _load_audio_av(path)
+    except av.error.FFmpegError as e:
+        raise RuntimeError(f"Failed to load audio: {e}") from e
+
+
+def _load_audio_av(path):
+    with av.open(path) as container:
+        if not container.streams.audio:
+            raise RuntimeError("Failed to load audio: no audio stream")
+        stream = container.streams.audio[0]
+        stream.thread_type = "AUTO"
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+
+        # the duration in the header is an estimate, the buffer grows if it's short
+        duration = None
+        if stream.duration is not None and stream.time_base is not None:
+            duration = float(stream.duration * stream.time_base)
+        elif container.duration is not None:
+            duration = container.duration / av.time_base
+        audio = np.empty(int((duration or 60) * SAMPLE_RATE) + SAMPLE_RATE, dtype=np.float32)
+        n = 0
+
+        def append(frames):
+            nonlocal audio, n
+            for frame in frames:
+                samples = frame.to_ndarray().reshape(-1)
+                if n + len(samples) > len(audio):
+                    audio = np.resize(audio, max(2*len(audio), n + len(samples)))
+                audio[n:n + len(samples)] = samples
+                n += len(samples)
+
+        for frame in container.decode(stream):
+            append(resampler.resample(frame))
+        # the samples buffered in the resampler
+        append(resampler.resample(None))
+
+    if len(audio) - n > SAMPLE_RATE:
+        return audio[:n].copy()
+    return audio[:n]
+
+
+def probe_duration(path):
+    """Duration of the audio in seconds from the container header, or None if it's not known"""
+    if av is None:
+        return None
+    try:
+        with av.open(path) as container:
+            if not container.streams.audio:
+                return None
+            stream = container.streams.audio[0]
+            if stream.duration is not None and stream.time_base is not None:
+                return float(stream.duration * stream.time_base)
+            if container.duration is not None:
+                return container.duration / av.time_base
+    except av.error.FFmpegError:
+        pass
+    return None
+
+
+def iter_audio(path, block_seconds=10):
+    """Yields the audio as 16 kHz mono float32 blocks of block_seconds (the last one is shorter). Only one block is
+    held at a time. Raises RuntimeError if the file can't be decoded."""
+    block = int(block_seconds * SAMPLE_RATE)
+    if av is None:
+        yield from _iter_audio_ffmpeg(path, block)
+        return
+    try:
+        yield from _iter_audio_av(path, block)
+    except av.error.FFmpegError as e:
+        raise RuntimeError(f"Failed to load audio: {e}") from e
+
+
+def decode_head(path, max_seconds):
+    """Decodes the file block by block up to max_seconds. Returns (audio, None) if the file ends before, or
+    (None, blocks) where blocks yields the whole audio like iter_audio, the decoded beginning first. Raises
+    RuntimeError if the file can't be decoded."""
+    blocks = iter_audio(path)
+    head = []
+    n = 0
+    for block in blocks:
+        head.append(block)
+        n += len(block)
+        if n >= max_seconds * SAMPLE_RATE:
+            return None, itertools.chain(head, blocks)
+    return (np.concatenate(head) if head else np.zeros(0, dtype=np.float32)), None
+
+
+def _iter_audio_av(path, block):
+    with av.open(path) as container:
+        if not container.streams.audio:
+            raise RuntimeError("Failed to load audio: no audio stream")
+        stream = container.streams.audio[0]
+        stream.thread_type = "AUTO"
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+        buf = np.empty(block, dtype=np.float32)
+        n = 0
+
+        def frames():
+            for frame in container.decode(stream):
+                yield from resampler.resample(frame)
+            yield from resampler.resample(None)
+
+        for frame in frames():
+            samples = frame.to_ndarray().reshape(-1)
+            while len(samples):
+                k = min(len(samples), block - n)
+                buf[n:n + k] = samples[:k]
+                n += k
+                samples = samples[k:]
+                if n == block:
+                    yield buf
+                    buf = np.empty(block, dtype=np.float32)
+                    n = 0
+        if n:
+            yield buf[:n]
+
+
+def _iter_audio_ffmpeg(path, block):
+    # the same conversion as whisper.load_audio, but read from the pipe block by block
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0", "-i", path, "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le",
+           "-ar", str(SAMPLE_RATE), "-"]
+    # stderr goes to a file, a pipe that nobody reads would block ffmpeg when it's full
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            while True:
+                data = proc.stdout.read(block * 2)
+                if not data:
+                    break
+                yield np.frombuffer(data, np.int16).astype(np.float32) / 32768.0
+            if proc.wait() != 0:
+                stderr.seek(0)
+                raise RuntimeError(f"Failed to load audio: {stderr.read().decode(errors='replace')}")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
@@ -0,0 +1,101 @@
+"""Bounded pool of inference workers for the API.
+
+The model runs in a dedicated thread pool with a fixed number of workers, so the event loop keeps serving
+/health and the other requests during a transcription. The requests that find all workers busy wait in a
+bounded FIFO queue; when the queue is full, InferencePool.run raises QueueFull with an estimate of when a
+slot frees up, and the endpoint answers 429 with Retry-After instead of piling up requests.
+
+The bookkeeping (running, waiting) is only touched from the event loop, so it needs no locks.
+"""
+import math
+import time
+import asyncio
+import logging
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """All workers are busy and the wait queue is full."""
+
+    def __init__(self, retry_after, queued):
+        super().__init__(f"inference queue is full ({queued} waiting)")
+        self.retry_after = retry_after
+        self.queued = queued
+
+
+class InferencePool:
+    """Runs blocking functions (the model) in `workers` threads, with at most `max_queue` calls waiting."""
+
+    def __init__(self, workers=1, max_queue=8, name="inference"):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self.running = 0
+        self.waiting = collections.deque()  # futures of the waiting calls, resolved when they get a worker
+        self.avg_seconds = None  # moving average of the job duration, for Retry-After
+
+    @property
+    def queued(self):
+        return len(self.waiting)
+
+    def full(self):
+        return self.running >= self.workers and len(self.waiting) >= self.max_queue
+
+    def retry_after(self):
+        """seconds until a queue slot is likely free, at least 1"""
+        job = self.avg_seconds if self.avg_seconds is not None else 10.0
+        return max(1, math.ceil(job * (len(self.waiting) + 1) / self.workers))
+
+    def status(self):
+        return {"workers": self.workers, "running": self.running, "queued": len(self.waiting), "max_queue": self.max_queue}
+
+    async def run(self, fn, *args, on_position=None, **kwargs):
+        """Runs fn(*args, **kwargs) in a worker and returns its result. Raises QueueFull without waiting if the queue
+        is full. on_position(position) is called once with the position in the queue, 0 if a worker was free."""
+        loop = asyncio.get_running_loop()
+        if self.running < self.workers and not self.waiting:
+            self.running += 1
+            if on_position is not None:
+                on_position(0)
+        else:
+            if len(self.waiting) >= self.max_queue:
+                raise QueueFull(self.retry_after(), len(self.waiting))
+            ticket = loop.create_future()
+            self.waiting.append(ticket)
+            if on_position is not None:
+                on_position(len(self.waiting))
+            try:
+                # _release hands the worker slot over by resolving the ticket
+                await ticket
+            except asyncio.CancelledError:
+                if ticket in self.waiting:
+                    self.waiting.remove(ticket)
+                elif ticket.done() and not ticket.cancelled():
+                    self._release()
+                raise
+
+        t = time.perf_counter()
+        job = self.executor.submit(partial(fn, *args, **kwargs))
+        # the slot is freed when the function returns, even if the request is cancelled before, so that the
+        # number of the running calls never exceeds the workers
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._done, time.perf_counter() - t))
+        return await asyncio.wrap_future(job)
+
+    def _done(self, seconds):
+        self.avg_seconds = seconds if self.avg_seconds is None else 0.8*self.avg_seconds + 0.2*seconds
+        self._release()
+
+    def _release(self):
+        while self.waiting:
+            ticket = self.waiting.popleft()
+            if not ticket.done():
+                ticket.set_result(None)
+                return
+        self.running -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
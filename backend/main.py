@@ -1,11 +1,10 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
+from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 import whisper
-import tempfile
 import os
 import asyncio
 import uvicorn
@@ -13,8 +12,20 @@ from typing import Optional
 import logging
 import torch
 import socket
+import time
+import json
+import functools
 from pathlib import Path
 
+import metrics
+import inference
+import transcription
+import transcript_cache
+import audio_decode
+import parallel
+import models
+import uploads
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -83,9 +94,33 @@ CACHE_DIR = os.getenv("WHISPER_CACHE_DIR")  # optional cache dir; if None, defau
 LOCAL_MODELS_DIR = os.getenv("WHISPER_LOCAL_MODELS_DIR", os.path.join(os.path.dirname(__file__), "models"))
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", "5"))
+# Transcriptions that run at once; the Whisper model is not reentrant, so more workers need more memory-safe setups
+INFERENCE_WORKERS = int(os.getenv("WHISPER_INFERENCE_WORKERS", "1"))
+# Transcriptions that may wait for a worker; the others get 429 with Retry-After
+MAX_QUEUE = int(os.getenv("WHISPER_MAX_QUEUE", "8"))
+# Finished jobs are kept for this many seconds
+JOB_TTL = int(os.getenv("WHISPER_JOB_TTL", "3600"))
+# Transcripts of the uploads by their content; size 0 disables the cache
+TRANSCRIPT_CACHE_DIR = os.getenv("WHISPER_TRANSCRIPT_CACHE_DIR", os.path.join(os.path.dirname(__file__), "transcript_cache"))
+TRANSCRIPT_CACHE_MB = int(os.getenv("WHISPER_TRANSCRIPT_CACHE_MB", "256"))
+# Long files are split at the silences and transcribed by this many worker processes, each with its own model
+# (needs the silero-vad package); 0 disables it
+PARALLEL_WORKERS = int(os.getenv("WHISPER_PARALLEL_WORKERS", "0"))
+PARALLEL_MIN_SECONDS = float(os.getenv("WHISPER_PARALLEL_MIN_SECONDS", "120"))
+MAX_SEGMENT_SECONDS = float(os.getenv("WHISPER_MAX_SEGMENT_SECONDS", "30"))
+# Files longer than this, or of unknown length, are decoded block by block while they are transcribed, so they
+# take constant memory instead of the whole audio (230 MB per hour); 0 disables it
+STREAM_MIN_SECONDS = float(os.getenv("WHISPER_STREAM_MIN_SECONDS", "600"))
+# Models that the requests can choose with the `model` parameter; they are loaded on first use
+AVAILABLE_MODELS = [m.strip() for m in os.getenv("WHISPER_MODELS", "tiny,base,small,medium").split(",") if m.strip()]
+# The least recently used models are unloaded when the loaded ones take more memory (the default model stays); 0: no limit
+MODEL_MEMORY_MB = int(os.getenv("WHISPER_MODEL_MEMORY_MB", "4096"))
 
 app = FastAPI(title="Speech to Text API", version="1.0.0")
 
+# Count the requests and their duration for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Configure CORS for frontend access
 app.add_middleware(
     CORSMiddleware,
@@ -99,36 +134,72 @@ app.add_middleware(
 model = None
 model_loading = False
 model_source = None  # for diagnostics
+segmented = None  # parallel.SegmentedTranscriber for the long files, if enabled
+# The transcriptions run in a bounded worker pool, so the event loop keeps serving /health
+inference_pool = inference.InferencePool(workers=INFERENCE_WORKERS, max_queue=MAX_QUEUE)
+metrics.QUEUED.function = lambda: inference_pool.queued
+
+jobs = transcription.JobStore(ttl=JOB_TTL)
+
+transcripts = transcript_cache.TranscriptCache(TRANSCRIPT_CACHE_DIR, max_bytes=TRANSCRIPT_CACHE_MB * 1024**2)
+
+def model_load_spec(name, path=None):
+    """Returns the arguments of whisper.load_model for the model, and its source (for diagnostics and cache keys)"""
+    load_kwargs = {"device": DEVICE}
+    # Prefer an explicit local path if provided
+    if path:
+        resolved = path
+        if not os.path.isabs(resolved):
+            resolved = os.path.abspath(os.path.join(os.path.dirname(__file__), resolved))
+        logger.info(f"Loading Whisper model from local path: {resolved} (device={DEVICE})")
+        return (resolved,), load_kwargs, f"path:{resolved}"
+    # Next, check conventional local models dir (backend/models/<name>)
+    candidate = os.path.join(LOCAL_MODELS_DIR, name)
+    if os.path.isdir(candidate):
+        logger.info(f"Loading Whisper model from local models dir: {candidate} (device={DEVICE})")
+        return (candidate,), load_kwargs, f"local_dir:{candidate}"
+    # Finally, load by name (will use cache if already downloaded). Requires internet only if cache is missing.
+    logger.info(f"Loading Whisper model '{name}' (device={DEVICE})")
+    if CACHE_DIR:
+        load_kwargs["download_root"] = CACHE_DIR
+    return (name,), load_kwargs, f"name:{name}"
+
+def load_named_model(name):
+    """Loads a model for the registry, in a worker thread"""
+    load_args, load_kwargs, source = model_load_spec(name)
+    return whisper.load_model(*load_args, **load_kwargs), source
+
+# The default model is loaded at startup, the others on first use
+registry = models.ModelRegistry(load_named_model, AVAILABLE_MODELS, max_bytes=MODEL_MEMORY_MB * 1024**2)
+metrics.MODELS_RESIDENT_BYTES.function = lambda: registry.resident_bytes
 
 async def load_model_async():
     """Load Whisper model in background with offline-friendly behavior."""
-    global model, model_loading, model_source
+    global model, model_loading, model_source, segmented
     model_loading = True
+    t = time.perf_counter()
     try:
-        # Prefer an explicit local path if provided
-        if MODEL_PATH:
-            resolved = MODEL_PATH
-            if not os.path.isabs(resolved):
-                resolved = os.path.abspath(os.path.join(os.path.dirname(__file__), resolved))
-            logger.info(f"Loading Whisper model from local path: {resolved} (device={DEVICE})")
-            model = await asyncio.to_thread(whisper.load_model, resolved, device=DEVICE)
-            model_source = f"path:{resolved}"
-        else:
-            # Next, check conventional local models dir (backend/models/<MODEL_NAME>)
-            candidate = os.path.join(LOCAL_MODELS_DIR, MODEL_NAME)
-            if os.path.isdir(candidate):
-                logger.info(f"Loading Whisper model from local models dir: {candidate} (device={DEVICE})")
-                model = await asyncio.to_thread(whisper.load_model, candidate, device=DEVICE)
-                model_source = f"local_dir:{candidate}"
-            else:
-                # Finally, load by name (will use cache if already downloaded). Requires internet only if cache is missing.
-                logger.info(f"Loading Whisper model '{MODEL_NAME}' (device={DEVICE})")
-                if CACHE_DIR:
-                    model = await asyncio.to_thread(whisper.load_model, MODEL_NAME, device=DEVICE, download_root=CACHE_DIR)
-                else:
-                    model = await asyncio.to_thread(whisper.load_model, MODEL_NAME, device=DEVICE)
-                model_source = f"name:{MODEL_NAME}"
+        load_args, load_kwargs, source = model_load_spec(MODEL_NAME, MODEL_PATH)
+        model = await asyncio.to_thread(whisper.load_model, *load_args, **load_kwargs)
+        model_source = source
+        registry.add(MODEL_NAME, model, model_source, pinned=True)
+        metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - t)
+        metrics.MODEL_LOADED.set(1)
         logger.info("Whisper model loaded successfully")
+
+        if PARALLEL_WORKERS > 0:
+            if parallel.SegmentedTranscriber.available():
+                logger.info(f"Starting {PARALLEL_WORKERS} worker processes for the files over {PARALLEL_MIN_SECONDS:.0f} s")
+                segmented = parallel.SegmentedTranscriber(PARALLEL_WORKERS, load_args, load_kwargs, MAX_SEGMENT_SECONDS)
+                # each worker holds a copy of the model, they take from the memory budget too
+                registry.add(MODEL_NAME, model, model_source, pinned=True, copies=1 + segmented.workers)
+            else:
+                logger.warning("WHISPER_PARALLEL_WORKERS is set, but silero-vad is not installed. The files are transcribed in one process.")
+
+        unfit = registry.unfit()
+        if unfit:
+            logger.warning(f"The models {', '.join(unfit)} don't fit in WHISPER_MODEL_MEMORY_MB={MODEL_MEMORY_MB} next to the default model, "
+                           f"they'll be loaded again for each request. Raise the budget or remove them from WHISPER_MODELS.")
     except Exception as e:
         logger.error(f"Failed to load Whisper model: {e}")
     finally:
@@ -139,6 +210,12 @@ async def startup_event():
     """Start model loading in background"""
     asyncio.create_task(load_model_async())
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    inference_pool.shutdown()
+    if segmented is not None:
+        segmented.shutdown()
+
 # Mount static files (CSS, JS)
 app.mount("/css", StaticFiles(directory="../frontend/css"), name="css")
 app.mount("/js", StaticFiles(directory="../frontend/js"), name="js")
@@ -162,12 +239,124 @@ async def health():
         "model_loading": model_loading,
         "device": DEVICE,
         "model": MODEL_NAME if model_source is None or model_source.startswith("name:") else model_source,
+        "inference": inference_pool.status(),
+        "transcript_cache": transcripts.stats(),
+        "parallel_workers": segmented.workers if segmented is not None else 0,
+        "models": registry.status(),
+        "model_memory_budget_mb": MODEL_MEMORY_MB,
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics"""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+VALID_EXTENSIONS = ['.wav', '.mp3', '.m4a', '.ogg', '.flac', '.webm']
+
+def check_ready(model_name: str):
+    """Raises the HTTP errors of a transcription request that can't be accepted, before its upload is received"""
+    if model_name not in registry.allowed:
+        raise HTTPException(status_code=400, detail=f"Unknown model '{model_name}'. Available: {', '.join(sorted(registry.allowed))}")
+    if model is None:
+        if model_loading:
+            raise HTTPException(status_code=503, detail="Model is still loading, please wait a moment", headers={"Retry-After": "10"})
+        else:
+            raise HTTPException(status_code=503, detail="Model failed to load")
+
+    # Reject before receiving the upload when the queue is already full
+    if inference_pool.full():
+        metrics.REJECTED.inc()
+        raise HTTPException(status_code=429, detail="Too many transcriptions in progress, please retry later",
+                            headers={"Retry-After": str(inference_pool.retry_after())})
+
+# The upload is parsed by uploads.spool_upload instead of FastAPI, so its form is described here for the docs
+UPLOAD_BODY = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}}}}}}
+
+async def receive_upload(request: Request):
+    """Writes the uploaded file to a temporary file as it arrives, with its SHA-256, and validates its type"""
+    try:
+        upload = await uploads.spool_upload(request)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Validate file
+    if not upload.content_type or not upload.content_type.startswith('audio/'):
+        # Also accept common formats that might not have correct MIME
+        if not any(upload.filename.endswith(ext) for ext in VALID_EXTENSIONS):
+            remove_temp_file(upload.path)
+            raise HTTPException(
+                status_code=400, 
+                detail="Invalid file type. Please upload an audio file."
+            )
+    metrics.UPLOAD_BYTES.observe(upload.size)
+    return upload
+
+def remove_temp_file(path):
+    if path and os.path.exists(path):
+        try:
+            os.unlink(path)
+        except Exception as e:
+            logger.warning(f"Failed to delete temp file: {e}")
+
+def get_transcribe_options(language: Optional[str]):
+    options = {
+        # Use FP16 on GPU for speed, FP32 on CPU for compatibility
+        "fp16": DEVICE == "cuda",
+        # Improve accuracy (slower): beam search
+        "beam_size": BEAM_SIZE,
+        "temperature": 0.0,
     }
+    if language:
+        options["language"] = language
+    return options
+
+def decode_audio(path):
+    """Decodes the file to 16 kHz mono float32, in-process with PyAV if it's installed"""
+    t = time.perf_counter()
+    audio = audio_decode.load_audio(path)
+    metrics.DECODE_SECONDS.observe(time.perf_counter() - t)
+    return audio
 
-@app.post("/transcribe")
+def use_segmented(duration, model_name):
+    """whether the file is long enough to be transcribed in parallel segments, the workers have the default model"""
+    return segmented is not None and model_name == MODEL_NAME and duration is not None and duration >= PARALLEL_MIN_SECONDS
+
+def model_key(model_name):
+    """identity of the model's weights, without loading it"""
+    return model_source if model_name == MODEL_NAME else model_load_spec(model_name)[2]
+
+def prepare_audio(path, model_name):
+    """Returns (audio, duration, blocks), in the inference worker, so that the requests waiting in the queue don't
+    hold decoded audio. The long files (see WHISPER_STREAM_MIN_SECONDS) are not decoded here, audio is None and
+    blocks yields the audio to transcribe_stream; duration is the estimate from the header or None."""
+    if STREAM_MIN_SECONDS > 0:
+        duration = audio_decode.probe_duration(path)
+        if duration is None:
+            # not in the header (or no PyAV to read it): only a file that goes on after the threshold is streamed,
+            # the others are transcribed whole like the files of a known length
+            t = time.perf_counter()
+            audio, blocks = audio_decode.decode_head(path, STREAM_MIN_SECONDS)
+            if audio is None:
+                return None, None, blocks
+            metrics.DECODE_SECONDS.observe(time.perf_counter() - t)
+            return audio, len(audio) / transcription.SAMPLE_RATE, None
+        if duration >= STREAM_MIN_SECONDS and not use_segmented(duration, model_name):
+            return None, duration, audio_decode.iter_audio(path)
+    audio = decode_audio(path)
+    return audio, len(audio) / transcription.SAMPLE_RATE, None
+
+def observe_transcription(elapsed, duration):
+    metrics.TRANSCRIBE_SECONDS.observe(elapsed)
+    metrics.AUDIO_SECONDS.inc(duration)
+    if duration > 0:
+        metrics.REALTIME_FACTOR.observe(elapsed / duration)
+
+@app.post("/transcribe", openapi_extra=UPLOAD_BODY)
 async def transcribe_audio(
-    file: UploadFile = File(...),
-    language: Optional[str] = None
+    request: Request,
+    language: Optional[str] = None,
+    model_name: Optional[str] = Query(None, alias="model")
 ):
     """
     Transcribe audio file to text
@@ -175,69 +364,220 @@ async def transcribe_audio(
     Args:
         file: Audio file (wav, mp3, m4a, etc.)
         language: Optional language code (e.g., 'en', 'hi', 'kn')
+        model: Optional model name (e.g., 'tiny' for previews, 'small'); the default model if not set
     
     Returns:
         JSON with transcribed text
     """
-    if model is None:
-        if model_loading:
-            raise HTTPException(status_code=503, detail="Model is still loading, please wait a moment")
-        else:
-            raise HTTPException(status_code=503, detail="Model failed to load")
-    
-    # Validate file
-    if not file.content_type or not file.content_type.startswith('audio/'):
-        # Also accept common formats that might not have correct MIME
-        valid_extensions = ['.wav', '.mp3', '.m4a', '.ogg', '.flac', '.webm']
-        if not any(file.filename.endswith(ext) for ext in valid_extensions):
-            raise HTTPException(
-                status_code=400, 
-                detail="Invalid file type. Please upload an audio file."
-            )
+    model_name = model_name or MODEL_NAME
+    check_ready(model_name)
     
-    temp_file_path = None
+    # Save uploaded file to temp location
+    file = await receive_upload(request)
+    temp_file_path = file.path
     try:
-        # Save uploaded file to temp location
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-            temp_file_path = temp_file.name
-            content = await file.read()
-            temp_file.write(content)
-            temp_file.flush()
+        # Identical uploads with the same options get the cached transcript
+        key = transcript_cache.cache_key(file.sha256, model=model_key(model_name), language=language, beam_size=BEAM_SIZE, task="transcribe")
+        cached, tier = await transcripts.get(key)
+        if cached is not None:
+            metrics.TRANSCRIPT_CACHE.inc(result=tier)
+            logger.info(f"Cached transcript ({tier}) of file: {file.filename}")
+            return JSONResponse(content=dict(cached, success=True), headers={"X-Cache": "HIT"})
         
-        logger.info(f"Processing file: {file.filename}, language: {language}")
+        logger.info(f"Processing file: {file.filename}, language: {language}, model: {model_name}")
         
         # Transcribe with Whisper
-        transcribe_options = {
-            # Use FP16 on GPU for speed, FP32 on CPU for compatibility
-            "fp16": DEVICE == "cuda",
-            # Improve accuracy (slower): beam search
-            "beam_size": BEAM_SIZE,
-            "temperature": 0.0,
-        }
+        transcribe_options = get_transcribe_options(language)
+        position = {}
+        path = temp_file_path
         
-        if language:
-            transcribe_options["language"] = language
+        async def transcribe_file():
+            # Decode and transcribe in the inference pool, so that the event loop keeps serving the other requests
+            loop = asyncio.get_running_loop()
+
+            def timed_transcribe():
+                started = time.perf_counter()
+                audio, duration, blocks = prepare_audio(path, model_name)
+                if audio is not None:
+                    remove_temp_file(path)
+                # the model is held until the transcription ends, so it's not unloaded meanwhile
+                with registry.hold(model_name, loop) as (whisper_model, _):
+                    t = time.perf_counter()
+                    if audio is None:
+                        # bounded memory, the file is decoded window by window
+                        result = transcription.transcribe_stream(whisper_model, blocks, transcribe_options, duration)
+                    elif use_segmented(duration, model_name):
+                        result = segmented.transcribe(audio, transcribe_options)
+                    else:
+                        result = whisper_model.transcribe(audio, **transcribe_options)
+                    return result, duration, started, time.perf_counter() - t
+
+            try:
+                with metrics.IN_FLIGHT.track():
+                    t = time.perf_counter()
+                    result, duration, started, elapsed = await inference_pool.run(timed_transcribe, on_position=lambda p: position.update(position=p))
+                    metrics.QUEUE_WAIT_SECONDS.observe(started - t)
+            finally:
+                remove_temp_file(path)
+
+            observe_transcription(elapsed, result.get("duration", duration))
+            return {
+                "text": result.get("text", "").strip(),
+                "language": result.get("language", language or "auto"),
+                "model": model_name,
+                "segments": len(result.get("segments", []))
+            }
         
-        result = model.transcribe(temp_file_path, **transcribe_options)
+        # Concurrent identical requests wait for one transcription. If this request starts it, the transcription
+        # owns the temp file from now on, even if the client goes away.
+        if key not in transcripts.inflight:
+            temp_file_path = None
+        content, coalesced = await transcripts.compute(key, transcribe_file)
+        metrics.TRANSCRIPT_CACHE.inc(result="coalesced" if coalesced else "miss")
         
-        return JSONResponse(content={
-            "success": True,
-            "text": result.get("text", "").strip(),
-            "language": result.get("language", language or "auto"),
-            "segments": len(result.get("segments", []))
-        })
+        headers = {"X-Cache": "COALESCED" if coalesced else "MISS"}
+        if "position" in position:
+            headers["X-Queue-Position"] = str(position["position"])
+        return JSONResponse(content=dict(content, success=True), headers=headers)
     
+    except inference.QueueFull as e:
+        metrics.REJECTED.inc()
+        raise HTTPException(status_code=429, detail="Too many transcriptions in progress, please retry later",
+                            headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logger.error(f"Transcription error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
     
     finally:
         # Clean up temp file
-        if temp_file_path and os.path.exists(temp_file_path):
+        remove_temp_file(temp_file_path)
+
+# Background tasks of the jobs, referenced until they finish
+job_tasks = {}
+
+async def run_job(job: transcription.Job, temp_file_path: str):
+    """Decodes the file and transcribes it window by window in the inference pool, publishing the segments"""
+    loop = asyncio.get_running_loop()
+
+    def work():
+        loop.call_soon_threadsafe(functools.partial(job.update, status="running", queue_position=None))
+        audio, duration, blocks = prepare_audio(temp_file_path, job.model)
+        if audio is not None:
+            remove_temp_file(temp_file_path)
+        loop.call_soon_threadsafe(functools.partial(job.update, duration=round(duration, 3) if duration is not None else None))
+        with registry.hold(job.model, loop) as (whisper_model, _):
+            t = time.perf_counter()
+            # the long files in parallel segments or decoded block by block, the others window by window
+            if audio is None:
+                transcribe = functools.partial(transcription.transcribe_stream, whisper_model, blocks, duration=duration)
+            elif use_segmented(duration, job.model):
+                transcribe = functools.partial(segmented.transcribe, audio)
+            else:
+                transcribe = functools.partial(transcription.transcribe_windows, whisper_model, audio)
+            result = transcribe(
+                get_transcribe_options(job.language),
+                on_segment=lambda s: loop.call_soon_threadsafe(job.add_segment, s),
+                on_progress=lambda p: loop.call_soon_threadsafe(functools.partial(job.update, progress=p)),
+                should_stop=lambda: job.cancelled,
+            )
+            return result, duration, time.perf_counter() - t
+
+    try:
+        with metrics.IN_FLIGHT.track():
+            result, duration, elapsed = await inference_pool.run(work, on_position=lambda p: job.update(queue_position=p))
+        duration = result.get("duration", duration)
+        job.update(duration=round(duration, 3))
+        observe_transcription(elapsed, duration)
+        if job.cancelled:
+            job.finish("cancelled")
+        else:
+            job.finish("done", progress=1.0, text=result["text"], language=result["language"] or job.language)
+    except asyncio.CancelledError:
+        job.finish("cancelled")
+    except inference.QueueFull:
+        metrics.REJECTED.inc()
+        job.finish("failed", error="Too many transcriptions in progress, please retry later")
+    except Exception as e:
+        logger.error(f"Transcription error in job {job.id}: {str(e)}")
+        job.finish("failed", error=f"Transcription failed: {str(e)}")
+    finally:
+        remove_temp_file(temp_file_path)
+        job_tasks.pop(job.id, None)
+
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs", status_code=202, openapi_extra=UPLOAD_BODY)
+async def create_job(
+    request: Request,
+    language: Optional[str] = None,
+    model_name: Optional[str] = Query(None, alias="model")
+):
+    """
+    Submit an audio file for transcription in the background
+    
+    Returns:
+        JSON with the job id and the URLs of its status and of its segments stream
+    """
+    model_name = model_name or MODEL_NAME
+    check_ready(model_name)
+    file = await receive_upload(request)
+    job = jobs.add(transcription.Job(file.filename, language, model_name))
+    logger.info(f"Job {job.id}: {file.filename}, language: {language}, model: {model_name}")
+    job_tasks[job.id] = asyncio.create_task(run_job(job, file.path))
+    return dict(job.to_dict(), status_url=f"/jobs/{job.id}", stream_url=f"/jobs/{job.id}/segments")
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Status of a job, with the percentage of the audio processed, and the text when done"""
+    return get_job(job_id).to_dict()
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job. A running job stops after the current window."""
+    job = get_job(job_id)
+    if not job.finished:
+        job.cancelled = True
+        task = job_tasks.get(job.id)
+        if job.status == "queued" and task is not None:
+            task.cancel()
+    return job.to_dict()
+
+# A status line is sent when nothing else happened for this long, so that proxies don't close the stream
+STREAM_KEEPALIVE = 15
+
+@app.get("/jobs/{job_id}/segments")
+async def job_segments(job_id: str):
+    """
+    Stream the segments of a job as NDJSON, one {"type": "segment", ...} line as soon as each one is decoded.
+    The last line is {"type": "done", "text": ...} or {"type": "error", ...}.
+    """
+    job = get_job(job_id)
+
+    async def lines():
+        sent = 0
+        while True:
+            while sent < len(job.segments):
+                yield json.dumps(dict(job.segments[sent], type="segment", progress=round(job.progress * 100, 1))) + "\n"
+                sent += 1
+            if job.finished:
+                break
             try:
-                os.unlink(temp_file_path)
-            except Exception as e:
-                logger.warning(f"Failed to delete temp file: {e}")
+                await asyncio.wait_for(job.changed(), STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield json.dumps({"type": "status", "status": job.status, "progress": round(job.progress * 100, 1),
+                                  "queue_position": job.queue_position}) + "\n"
+        if job.status == "done":
+            yield json.dumps({"type": "done", "text": job.text, "language": job.language, "duration": job.duration}) + "\n"
+        else:
+            yield json.dumps({"type": "error", "status": job.status, "error": job.error}) + "\n"
+
+    # X-Accel-Buffering: the segments are not held back by nginx
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Optional: Add a test endpoint for text-based testing
 @app.get("/test")
@@ -0,0 +1,231 @@
+"""Prometheus metrics of the API, exposed by /metrics in the text format.
+
+A minimal implementation of counters, gauges and histograms, so the backend doesn't need prometheus_client.
+Each metric has its own lock that is held only for a dict update, so they can be updated from the event loop
+and from the worker threads without blocking.
+"""
+import os
+import sys
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(v):
+    if v != v:
+        return "NaN"
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames:
+            # the metrics without labels are reported from the start
+            self._values[()] = self._zero()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _zero(self):
+        return 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self):
+        """[(suffix, label values, extra labels, value)]"""
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *a, function=None, **kw):
+        """function: computes the value (without labels) when the metrics are rendered"""
+        super().__init__(*a, **kw)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """counts the code blocks in progress"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        if self.function is not None:
+            return [("", (), (), self.function())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, *a, buckets=DEFAULT_BUCKETS, **kw):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(*a, **kw)
+
+    def _zero(self):
+        return [[0]*(len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                h = self._values[key] = self._zero()
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(h[0]), h[1], h[2]) for key, h in self._values.items()]
+        out = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                out.append(("_bucket", key, (("le", _format_value(le)),), cumulative))
+            out.append(("_sum", key, (), total))
+            out.append(("_count", key, (), count))
+        return out
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        return "\n".join(m.render() for m in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def process_rss_bytes():
+    """current resident memory of the process, or the peak one where /proc is not available, NaN on Windows"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+        except ImportError:  # Windows
+            return float("nan")
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return r if sys.platform == "darwin" else r*1024
+
+
+class MetricsMiddleware:
+    """ASGI middleware that counts the HTTP requests by endpoint and status code, and measures their duration."""
+
+    def __init__(self, app, requests=None, duration=None):
+        self.app = app
+        self.requests = requests if requests is not None else HTTP_REQUESTS
+        self.duration = duration if duration is not None else HTTP_REQUEST_SECONDS
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+        t = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the endpoint function is known after routing. The other paths (e.g. 404) are not distinguished,
+            # so that the number of the label values is bounded.
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "other")
+            self.requests.inc(handler=handler, method=scope.get("method", ""), status=status["code"])
+            self.duration.observe(time.perf_counter() - t, handler=handler)
+
+
+HTTP_REQUESTS = Counter("stt_http_requests_total", "HTTP requests by endpoint and status code.", ("handler", "method", "status"))
+HTTP_REQUEST_SECONDS = Histogram("stt_http_request_duration_seconds", "Duration of the HTTP requests.", ("handler",))
+
+UPLOAD_BYTES = Histogram("stt_upload_bytes", "Size of the uploaded audio files in bytes.",
+                         buckets=(16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6, 1e9))
+DECODE_SECONDS = Histogram("stt_decode_seconds", "Time to decode the uploaded audio to 16 kHz PCM.")
+TRANSCRIBE_SECONDS = Histogram("stt_transcription_seconds", "Wall time of the Whisper transcription.")
+AUDIO_SECONDS = Counter("stt_audio_seconds_total", "Duration of the transcribed audio in seconds.")
+REALTIME_FACTOR = Histogram("stt_realtime_factor", "Transcription time divided by the audio duration.",
+                            buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+IN_FLIGHT = Gauge("stt_transcribe_in_flight", "Transcription requests being processed, including the queued ones.")
+QUEUED = Gauge("stt_transcribe_queued", "Transcription requests waiting for an inference worker.")
+QUEUE_WAIT_SECONDS = Histogram("stt_queue_wait_seconds", "Time the transcription requests waited for an inference worker.")
+REJECTED = Counter("stt_transcribe_rejected_total", "Transcription requests rejected with 429 because the queue was full.")
+TRANSCRIPT_CACHE = Counter("stt_transcript_cache_total", "Transcript cache lookups by result: memory, disk, coalesced or miss.", ("result",))
+MODEL_LOAD_SECONDS = Gauge("stt_model_load_seconds", "Time it took to load the Whisper model.")
+MODEL_LOADED = Gauge("stt_model_loaded", "1 if the Whisper model is loaded.")
+MODELS_RESIDENT_BYTES = Gauge("stt_models_resident_bytes", "Memory of the weights of the loaded Whisper models.")
+PROCESS_RSS = Gauge("process_resident_memory_bytes", "Resident memory size in bytes.", function=process_rss_bytes)
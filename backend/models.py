@@ -0,0 +1,174 @@
+"""Registry of the loaded Whisper models.
+
+The models are loaded on first use and shared by all the requests. The requests hold a model with `use(name)`, or
+`hold(name, loop)` from a worker thread, while they transcribe with it; when the loaded models take more than `max_bytes`, the least recently used ones
+that nobody holds are dropped. The pinned models (the default one) are never dropped. A model that is also loaded
+in other processes (the default one in the workers of parallel.SegmentedTranscriber) counts once per copy.
+"""
+import gc
+import time
+import asyncio
+import logging
+from contextlib import contextmanager, asynccontextmanager
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# parameters of the OpenAI Whisper models (the .en ones too), in millions, for their size before they're loaded
+MODEL_PARAMS = {"tiny": 39, "base": 74, "small": 244, "medium": 769, "large": 1550, "turbo": 809}
+
+
+def estimated_bytes(name):
+    """memory of the fp32 weights of the Whisper model `name`, None for the unknown ones (e.g. a local path)"""
+    family = name.split(".")[0]
+    if family.startswith("large"):
+        family = "turbo" if family.endswith("turbo") else "large"
+    params = MODEL_PARAMS.get(family)
+    return params * 10**6 * 4 if params is not None else None
+
+
+def model_bytes(model):
+    """memory of the weights and buffers of the model"""
+    return sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+
+
+class UnknownModel(ValueError):
+    pass
+
+
+class _Entry:
+
+    def __init__(self, name, model, source, pinned=False, copies=1):
+        self.name = name
+        self.model = model
+        self.source = source
+        self.size = model_bytes(model) * copies
+        self.copies = copies
+        self.pinned = pinned
+        self.users = 0
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    """loader(name) loads the model in a worker thread and returns (model, source), the source identifies the
+    weights (e.g. for the cache keys). allowed: the names that can be loaded. max_bytes=0: no limit."""
+
+    def __init__(self, loader, allowed, max_bytes=0):
+        self.loader = loader
+        self.allowed = set(allowed)
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.loading = {}
+        self.waiting = {}  # the requests that wait for each loading model
+
+    def add(self, name, model, source, pinned=False, copies=1):
+        """registers a model that is already loaded; copies: including the ones in other processes"""
+        self.allowed.add(name)
+        self.entries[name] = _Entry(name, model, source, pinned, copies)
+
+    def unfit(self, estimate=estimated_bytes):
+        """Returns the allowed models that can't be loaded next to the pinned ones within the budget: each use
+        would load them again. estimate(name): their size before they're loaded, None if unknown."""
+        if not self.max_bytes:
+            return []
+        pinned = sum(e.size for e in self.entries.values() if e.pinned)
+        unfit = []
+        for name in sorted(self.allowed):
+            entry = self.entries.get(name)
+            if entry is not None and entry.pinned:
+                continue
+            size = entry.size if entry is not None else estimate(name)
+            if size is not None and pinned + size > self.max_bytes:
+                unfit.append(name)
+        return unfit
+
+    @property
+    def resident_bytes(self):
+        return sum(e.size for e in self.entries.values())
+
+    async def _acquire(self, name):
+        """Returns the entry of the model, held by the caller"""
+        entry = self.entries.get(name)
+        if entry is not None:
+            entry.users += 1
+            return entry
+        if name not in self.allowed:
+            raise UnknownModel(f"Unknown model '{name}', available: {', '.join(sorted(self.allowed))}")
+        # concurrent requests for the same model wait for one load
+        task = self.loading.get(name)
+        if task is None:
+            self.waiting[name] = 0
+            task = self.loading[name] = asyncio.ensure_future(self._load(name))
+        self.waiting[name] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                self.waiting[name] -= 1
+            elif not task.cancelled() and task.exception() is None:
+                # loaded, and already held for this request
+                self._release(task.result())
+            raise
+
+    async def _load(self, name):
+        try:
+            t = time.perf_counter()
+            model, source = await asyncio.to_thread(self.loader, name)
+            entry = self.entries[name] = _Entry(name, model, source)
+            # held for the waiting requests at once, so it can't be dropped before they resume
+            entry.users += self.waiting.pop(name)
+            logger.info(f"Loaded model {name} ({entry.size / 1024**2:.0f} MB) in {time.perf_counter() - t:.1f} s")
+            # the others make room for it; it's dropped after its use if it doesn't fit alone
+            self._evict()
+            return entry
+        finally:
+            self.waiting.pop(name, None)
+            del self.loading[name]
+
+    def _release(self, entry):
+        entry.users -= 1
+        entry.last_used = time.time()
+        self._evict()
+
+    @asynccontextmanager
+    async def use(self, name):
+        """Holds the model while the block runs, yields (model, source). Raises UnknownModel."""
+        entry = await self._acquire(name)
+        try:
+            yield entry.model, entry.source
+        finally:
+            self._release(entry)
+
+    @contextmanager
+    def hold(self, name, loop):
+        """use() for the worker threads: waits for the model (and its load) in the thread, the bookkeeping stays in
+        the event loop `loop`. Raises UnknownModel."""
+        entry = asyncio.run_coroutine_threadsafe(self._acquire(name), loop).result()
+        try:
+            yield entry.model, entry.source
+        finally:
+            loop.call_soon_threadsafe(self._release, entry)
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        evicted = False
+        while self.resident_bytes > self.max_bytes:
+            idle = [e for e in self.entries.values() if not e.pinned and not e.users]
+            if not idle:
+                logger.warning(f"The models take {self.resident_bytes / 1024**2:.0f} MB, over the budget, but all are in use")
+                break
+            entry = min(idle, key=lambda e: e.last_used)
+            logger.info(f"Unloading model {entry.name} ({entry.size / 1024**2:.0f} MB)")
+            del self.entries[entry.name]
+            evicted = True
+        if evicted:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def status(self):
+        return [{"name": e.name, "source": e.source, "size_mb": round(e.size / 1024**2, 1), "copies": e.copies,
+                 "in_use": e.users, "pinned": e.pinned, "last_used": e.last_used}
+                for e in sorted(self.entries.values(), key=lambda e: e.name)]
@@ -0,0 +1,124 @@
+"""Parallel transcription of long uploads across worker processes.
+
+The audio is split at the silences found by Silero VAD into segments of at most `max_segment` seconds that contain
+only speech, and the segments are transcribed in parallel by a pool of processes that each hold their own Whisper
+model. The results are put back in order with the absolute timestamps, in the format of transcription.py.
+
+Silero VAD comes from the optional silero-vad package. Without it, SegmentedTranscriber.available() is False and
+the API transcribes the whole file in one process, as before.
+"""
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import whisper
+
+from speech_segments import pack_segments
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+
+try:
+    import torch
+    from silero_vad import load_silero_vad, get_speech_timestamps
+except ImportError:
+    load_silero_vad = None
+
+
+# the model of a worker process
+_model = None
+
+
+def _init_worker(load_args, load_kwargs, threads):
+    global _model
+    # the cores are shared by the workers instead of each one using all of them
+    torch.set_num_threads(threads)
+    _model = whisper.load_model(*load_args, **load_kwargs)
+
+
+def _ready():
+    return os.getpid()
+
+
+def _transcribe_segment(audio, options):
+    result = _model.transcribe(audio, **options)
+    return [(s["start"], s["end"], s["text"].strip()) for s in result.get("segments", [])], result.get("language")
+
+
+class SegmentedTranscriber:
+    """Pool of `workers` processes with the model loaded by whisper.load_model(*load_args, **load_kwargs)."""
+
+    def __init__(self, workers, load_args, load_kwargs, max_segment=30.0):
+        self.workers = workers
+        self.max_len = int(max_segment * SAMPLE_RATE)
+        threads = max(1, (os.cpu_count() or workers) // workers)
+        # spawn: the workers don't inherit the threads and the torch state of the server
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker, initargs=(load_args, load_kwargs, threads))
+        # the workers start and load the model now, not with the first long upload
+        for _ in range(workers):
+            self.pool.submit(_ready)
+        self.vad = None
+        self.vad_lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        return load_silero_vad is not None
+
+    def split(self, audio):
+        """[(beg, end)] sample ranges of the segments"""
+        with self.vad_lock:
+            if self.vad is None:
+                self.vad = load_silero_vad()
+            spans = get_speech_timestamps(torch.from_numpy(audio), self.vad, sampling_rate=SAMPLE_RATE,
+                                          min_silence_duration_ms=500, speech_pad_ms=100)
+        return pack_segments([(s["start"], s["end"]) for s in spans], self.max_len)
+
+    def transcribe(self, audio, options, on_segment=None, on_progress=None, should_stop=None):
+        """Transcribes the audio in VAD segments in parallel. The callbacks are those of
+        transcription.transcribe_windows; the segments are passed in order. It blocks, so it runs in the inference
+        pool. Returns {"text", "segments", "language"}."""
+        ranges = self.split(audio)
+        logger.info(f"{len(ranges)} segments, {sum(e - b for b, e in ranges) / SAMPLE_RATE:.1f} s of speech "
+                    f"in {len(audio) / SAMPLE_RATE:.1f} s of audio, {self.workers} workers")
+        options = dict(options)
+        language = options.get("language")
+        segments = []
+        pending = list(ranges)
+        futures = []
+
+        def submit(beg, end):
+            futures.append((beg, end, self.pool.submit(_transcribe_segment, audio[beg:end], options)))
+
+        # without the language, it's detected on the first segment, and the others use it too
+        if language is None and pending:
+            submit(*pending.pop(0))
+            language = options["language"] = futures[0][2].result()[1]
+        for beg, end in pending:
+            submit(beg, end)
+
+        try:
+            for beg, end, f in futures:
+                if should_stop is not None and should_stop():
+                    break
+                parts, _ = f.result()
+                for start, stop, text in parts:
+                    if not text:
+                        continue
+                    seg = {"id": len(segments), "start": round(beg / SAMPLE_RATE + start, 3),
+                           "end": round(beg / SAMPLE_RATE + stop, 3), "text": text}
+                    segments.append(seg)
+                    if on_segment is not None:
+                        on_segment(seg)
+                if on_progress is not None:
+                    on_progress(end / len(audio))
+        finally:
+            for _, _, f in futures:
+                f.cancel()
+        return {"text": " ".join(s["text"] for s in segments), "segments": segments, "language": language}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,29 @@
+"""Packing of the speech spans found by VAD into the segments that are transcribed independently.
+
+It's used by parallel.py and by whisper_streaming/parallel_transcribe.py, which imports it from here, so it has
+no dependencies.
+"""
+
+
+def pack_segments(spans, max_len):
+    """Joins the consecutive speech spans [(beg, end)] into segments of at most max_len samples. A span that is
+    longer is cut into pieces of max_len. Returns [(beg, end)]."""
+    segments = []
+    cur = None
+    for beg, end in spans:
+        while end - beg > max_len:
+            if cur is not None:
+                segments.append(tuple(cur))
+                cur = None
+            segments.append((beg, beg + max_len))
+            beg += max_len
+        if cur is None:
+            cur = [beg, end]
+        elif end - cur[0] <= max_len:
+            cur[1] = end
+        else:
+            segments.append(tuple(cur))
+            cur = [beg, end]
+    if cur is not None:
+        segments.append(tuple(cur))
+    return segments
@@ -0,0 +1,29 @@
+import os
+import sys
+import types
+import importlib.util
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# The API tests replace the model with a fake one, so they don't need the Whisper and torch packages. Without
+# them, only the attributes that the backend reads at import are provided.
+if importlib.util.find_spec("whisper") is None:
+    whisper = types.ModuleType("whisper")
+    whisper.audio = types.SimpleNamespace(SAMPLE_RATE=16000, N_SAMPLES=30 * 16000)
+    whisper.load_model = None  # set by the tests
+    sys.modules["whisper"] = whisper
+
+if importlib.util.find_spec("torch") is None:
+    torch = types.ModuleType("torch")
+    torch.cuda = types.SimpleNamespace(is_available=lambda: False, empty_cache=lambda: None)
+    sys.modules["torch"] = torch
+
+
+@pytest.fixture
+def backend_dir(monkeypatch):
+    # main.py mounts the frontend by paths relative to the backend directory
+    monkeypatch.chdir(BACKEND_DIR)
+    return BACKEND_DIR
@@ -0,0 +1,111 @@
+import sys
+import time
+import asyncio
+import threading
+
+import pytest
+
+import inference
+
+
+def blocked_pool(workers, max_queue):
+    """a pool and the event that lets its calls return"""
+    return inference.InferencePool(workers=workers, max_queue=max_queue), threading.Event()
+
+
+def test_full_queue_raises_queue_full_with_retry_after():
+    async def main():
+        pool, release = blocked_pool(workers=1, max_queue=2)
+        positions = []
+        calls = [asyncio.ensure_future(pool.run(release.wait, on_position=positions.append)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert positions == [0, 1, 2]
+        assert pool.full()
+        assert pool.status() == {"workers": 1, "running": 1, "queued": 2, "max_queue": 2}
+
+        with pytest.raises(inference.QueueFull) as e:
+            await pool.run(release.wait)
+        # no job finished yet: 10 s for each waiting call and the new one
+        assert (e.value.retry_after, e.value.queued) == (30, 2)
+
+        release.set()
+        assert await asyncio.gather(*calls) == [True, True, True]
+        assert pool.status()["running"] == 0 and not pool.full()
+        pool.shutdown()
+
+    asyncio.run(main())
+
+
+def test_retry_after_follows_the_job_duration():
+    pool = inference.InferencePool(workers=2, max_queue=4)
+    assert pool.retry_after() == 5
+    pool._done(4.0)
+    assert pool.avg_seconds == 4.0
+    pool.running = 2
+    pool._done(9.0)
+    assert pool.avg_seconds == pytest.approx(5.0)
+    pool.waiting.extend([None, None, None])
+    # 4 calls on 2 workers
+    assert pool.retry_after() == 10
+    pool.avg_seconds = 0.01
+    assert pool.retry_after() == 1
+    pool.shutdown()
+
+
+def test_cancelled_waiting_call_leaves_the_queue():
+    async def main():
+        pool, release = blocked_pool(workers=1, max_queue=1)
+        running = asyncio.ensure_future(pool.run(release.wait))
+        waiting = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0)
+        assert pool.queued == 1
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert pool.queued == 0 and not pool.full()
+
+        release.set()
+        assert await running
+        assert pool.status()["running"] == 0
+        pool.shutdown()
+
+    asyncio.run(main())
+
+
+def test_transcribe_answers_429_when_the_queue_is_full(backend_dir, monkeypatch, tmp_path):
+    pytest.importorskip("fastapi.testclient")
+    pytest.importorskip("av")
+    from test_jobs import FakeModel, write_wav
+    import whisper
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setenv("WHISPER_TRANSCRIPT_CACHE_DIR", str(tmp_path / "transcript_cache"))
+    monkeypatch.setattr(whisper, "load_model", lambda *args, **kwargs: FakeModel(), raising=False)
+    monkeypatch.delitem(sys.modules, "main", raising=False)
+    import main
+
+    path = tmp_path / "speech.wav"
+    write_wav(path, 2)
+    with TestClient(main.app) as client:
+        deadline = time.time() + 10
+        while not client.get("/health").json()["model_loaded"]:
+            assert time.time() < deadline, "the model was not loaded"
+            time.sleep(0.05)
+
+        # all workers busy and the queue full: rejected before the upload
+        monkeypatch.setattr(main.inference_pool, "full", lambda: True)
+        monkeypatch.setattr(main.inference_pool, "avg_seconds", 7.0)
+        with open(path, "rb") as f:
+            r = client.post("/transcribe", files={"file": ("speech.wav", f, "audio/wav")})
+        assert r.status_code == 429
+        assert r.headers["Retry-After"] == "7"
+
+        # the queue filled up during the upload
+        monkeypatch.setattr(main.inference_pool, "full", lambda: False)
+
+        async def run(fn, *args, **kwargs):
+            raise inference.QueueFull(42, 8)
+        monkeypatch.setattr(main.inference_pool, "run", run)
+        with open(path, "rb") as f:
+            r = client.post("/transcribe", files={"file": ("speech.wav", f, "audio/wav")})
+        assert r.status_code == 429
+        assert r.headers["Retry-After"] == "42"
@@ -0,0 +1,98 @@
+import sys
+import json
+import time
+import wave
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi.testclient")
+pytest.importorskip("av")
+
+SAMPLE_RATE = 16000
+
+
+class FakeModel:
+    """Splits each window into two segments of equal length"""
+
+    def parameters(self):
+        return []
+
+    def buffers(self):
+        return []
+
+    def transcribe(self, audio, **options):
+        half = len(audio) / SAMPLE_RATE / 2
+        return {"language": options.get("language") or "en", "segments": [
+            {"start": 0.0, "end": half, "text": " one"},
+            {"start": half, "end": 2 * half, "text": " two"},
+        ]}
+
+
+def write_wav(path, seconds):
+    audio = (np.random.default_rng(0).standard_normal(int(seconds * SAMPLE_RATE)) * 1000).astype("<i2")
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(audio.tobytes())
+
+
+@pytest.fixture
+def client(backend_dir, tmp_path, monkeypatch):
+    monkeypatch.setenv("WHISPER_TRANSCRIPT_CACHE_DIR", str(tmp_path / "transcript_cache"))
+    import whisper
+    monkeypatch.setattr(whisper, "load_model", lambda *args, **kwargs: FakeModel(), raising=False)
+    from fastapi.testclient import TestClient
+    # a new app for each test, the shutdown of the previous one stopped its inference pool
+    monkeypatch.delitem(sys.modules, "main", raising=False)
+    import main
+
+    with TestClient(main.app) as client:
+        deadline = time.time() + 10
+        while not client.get("/health").json()["model_loaded"]:
+            assert time.time() < deadline, "the model was not loaded"
+            time.sleep(0.05)
+        yield client
+
+
+def test_job_streams_segments_until_done(client, tmp_path):
+    # 40 s: the first 30 s window keeps its first segment, the second window starts at the cut-off one
+    path = tmp_path / "speech.wav"
+    write_wav(path, 40)
+    with open(path, "rb") as f:
+        r = client.post("/jobs", files={"file": ("speech.wav", f, "audio/wav")})
+    assert r.status_code == 202
+    job = r.json()
+
+    with client.stream("GET", job["stream_url"]) as r:
+        lines = [json.loads(line) for line in r.iter_lines() if line]
+    segments = [line for line in lines if line["type"] == "segment"]
+    assert [s["start"] for s in segments] == [0.0, 15.0, 27.5]
+    assert [s["text"] for s in segments] == ["one", "one", "two"]
+    assert lines[-1]["type"] == "done"
+    assert lines[-1]["text"] == "one one two"
+
+    status = client.get(job["status_url"]).json()
+    assert status["status"] == "done"
+    assert status["progress"] == 100.0
+    assert status["segments"] == 3
+
+
+def test_transcribe_decodes_and_loads_in_the_inference_worker(client, tmp_path, monkeypatch):
+    # the requests waiting in the queue hold neither decoded audio nor a model
+    import threading
+    import audio_decode
+    threads = []
+    load_audio = audio_decode.load_audio
+    monkeypatch.setattr(audio_decode, "load_audio", lambda path: threads.append(threading.current_thread().name) or load_audio(path))
+
+    path = tmp_path / "speech.wav"
+    write_wav(path, 4)
+    with open(path, "rb") as f:
+        r = client.post("/transcribe", params={"model": "tiny"}, files={"file": ("speech.wav", f, "audio/wav")})
+    assert r.status_code == 200
+    assert r.json()["model"] == "tiny"
+    assert len(threads) == 1 and threads[0].startswith("inference")
+    models = {m["name"]: m for m in client.get("/health").json()["models"]}
+    assert models["tiny"]["in_use"] == 0
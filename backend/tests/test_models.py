@@ -0,0 +1,95 @@
+import asyncio
+
+import models
+
+
+class Tensor:
+
+    def __init__(self, mb):
+        self.mb = mb
+
+    def numel(self):
+        return self.mb * 1024**2 // 4
+
+    def element_size(self):
+        return 4
+
+
+class FakeModel:
+
+    def __init__(self, mb):
+        self.tensors = [Tensor(mb)]
+
+    def parameters(self):
+        return self.tensors
+
+    def buffers(self):
+        return []
+
+
+SIZES = {"tiny": 1, "base": 2, "small": 5}
+
+
+def make_registry(loads, max_mb):
+    def loader(name):
+        loads.append(name)
+        return FakeModel(SIZES[name]), f"name:{name}"
+    registry = models.ModelRegistry(loader, SIZES, max_bytes=max_mb * 1024**2)
+    registry.add("base", FakeModel(2), "name:base", pinned=True)
+    return registry
+
+
+def test_loaded_model_is_held_before_the_waiter_resumes():
+    loads = []
+    registry = make_registry(loads, max_mb=7)
+
+    async def release_when_loaded(held):
+        # another request ends as soon as the model is registered, before the waiter runs again
+        while "small" not in registry.entries:
+            await asyncio.sleep(0)
+        held.set()
+
+    async def hold_tiny(held):
+        async with registry.use("tiny"):
+            await held.wait()
+
+    async def main():
+        held = asyncio.Event()
+        tiny = asyncio.ensure_future(hold_tiny(held))
+        await asyncio.sleep(0)
+        releaser = asyncio.ensure_future(release_when_loaded(held))
+        async with registry.use("small") as (model, source):
+            assert source == "name:small"
+            assert "small" in registry.entries
+        await asyncio.gather(tiny, releaser)
+        async with registry.use("small"):
+            pass
+
+    asyncio.run(main())
+    # tiny made room for small, which was never dropped while it was in use
+    assert loads == ["tiny", "small"]
+    assert sorted(registry.entries) == ["base", "small"]
+
+
+def test_copies_count_in_the_budget():
+    registry = make_registry([], max_mb=0)
+    registry.add("base", FakeModel(2), "name:base", pinned=True, copies=3)
+    assert registry.resident_bytes == 6 * 1024**2
+
+
+def test_unfit_lists_the_models_over_the_budget_next_to_the_pinned_ones():
+    registry = make_registry([], max_mb=6)
+    registry.allowed.add("custom")
+    sizes = {"tiny": 1, "small": 5, "custom": None}
+    # small alone fits, not next to base; the size of custom is unknown
+    assert registry.unfit(lambda name: sizes[name] and sizes[name] * 1024**2) == ["small"]
+    registry.max_bytes = 0
+    assert registry.unfit() == []
+
+
+def test_default_budget_fits_the_default_models():
+    budget = 4096 * 1024**2
+    assert models.estimated_bytes("medium") + models.estimated_bytes("base") <= budget
+    assert models.estimated_bytes("medium.en") == models.estimated_bytes("medium")
+    assert models.estimated_bytes("large-v3-turbo") == models.estimated_bytes("turbo")
+    assert models.estimated_bytes("./my-model") is None
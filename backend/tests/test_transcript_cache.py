@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from transcript_cache import TranscriptCache, cache_key
+
+
+def test_concurrent_requests_run_the_transcription_once(tmp_path):
+    async def main():
+        cache = TranscriptCache(str(tmp_path))
+        key = cache_key("0" * 64, model="base", language=None, beam_size=5, task="transcribe")
+        calls = []
+        release = asyncio.Event()
+
+        async def transcribe():
+            calls.append(key)
+            await release.wait()
+            return {"text": "one two"}
+
+        requests = [asyncio.ensure_future(cache.compute(key, transcribe)) for _ in range(4)]
+        await asyncio.sleep(0)
+        assert list(cache.inflight) == [key]
+        release.set()
+        results = await asyncio.gather(*requests)
+        assert calls == [key]
+        assert results == [({"text": "one two"}, False)] + [({"text": "one two"}, True)] * 3
+        assert not cache.inflight
+
+        assert await cache.get(key) == ({"text": "one two"}, "memory")
+        # a new process finds it on disk
+        assert await TranscriptCache(str(tmp_path)).get(key) == ({"text": "one two"}, "disk")
+
+    asyncio.run(main())
+
+
+def test_cancelled_request_does_not_cancel_the_transcription():
+    async def main():
+        cache = TranscriptCache()
+        release = asyncio.Event()
+
+        async def transcribe():
+            await release.wait()
+            return {"text": "one"}
+
+        first = asyncio.ensure_future(cache.compute("k", transcribe))
+        second = asyncio.ensure_future(cache.compute("k", transcribe))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == ({"text": "one"}, True)
+        assert await cache.get("k") == ({"text": "one"}, "memory")
+
+    asyncio.run(main())
+
+
+def test_failed_transcription_is_not_cached():
+    async def main():
+        cache = TranscriptCache()
+
+        async def transcribe():
+            await asyncio.sleep(0)
+            raise RuntimeError("decoding failed")
+
+        requests = [asyncio.ensure_future(cache.compute("k", transcribe)) for _ in range(2)]
+        for r in requests:
+            with pytest.raises(RuntimeError):
+                await r
+        assert not cache.inflight
+        assert await cache.get("k") == (None, None)
+
+    asyncio.run(main())
+
+
+def test_key_depends_on_the_parameters():
+    digest = "ab" * 32
+    assert cache_key(digest, model="base", task="transcribe") == cache_key(digest, task="transcribe", model="base")
+    assert cache_key(digest, model="base", task="transcribe") != cache_key(digest, model="small", task="transcribe")
+    assert cache_key(digest, model="base") != cache_key("cd" * 32, model="base")
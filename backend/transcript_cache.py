@@ -0,0 +1,165 @@
+"""Content-addressed cache of the transcripts.
+
+The key is the SHA-256 of the uploaded bytes together with the parameters that change the result (model,
+language, beam size, task), so a retried or repeated upload is answered without running the model again.
+There are two tiers: a small in-memory LRU of the recent results, and JSON files on disk with a size budget,
+evicted by the least recent use. Concurrent requests with the same key are coalesced: the first one runs the
+transcription in a task, the others wait for its result.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(digest, **params):
+    """key of the audio with the sha256 hex digest and the parameters of the transcription"""
+    return hashlib.sha256(json.dumps(dict(params, audio=digest), sort_keys=True).encode()).hexdigest()
+
+
+class TranscriptCache:
+    """Transcripts (JSON-serializable dicts) by key. cache_dir=None keeps only the memory tier, max_bytes=0 disables
+    the cache."""
+
+    def __init__(self, cache_dir=None, max_bytes=256*1024**2, memory_items=256):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory = collections.OrderedDict()
+        self.lock = threading.Lock()  # of the disk index, it's used from the worker threads
+        self.index = collections.OrderedDict()  # key -> file size, the least recently used first
+        self.size = 0
+        self.inflight = {}
+        if self.enabled and cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _load_index(self):
+        entries = []
+        for root, _, names in os.walk(self.cache_dir):
+            for n in names:
+                if n.endswith(".json"):
+                    try:
+                        st = os.stat(os.path.join(root, n))
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, n[:-5], st.st_size))
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.size += size
+        logger.info(f"transcript cache: {len(self.index)} entries, {self.size/1024**2:.1f} MB in {self.cache_dir}")
+        self._evict()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _read(self, key):
+        with self.lock:
+            if key not in self.index:
+                return None
+            self.index.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = json.load(f)
+            # the modification time orders the entries when the index is loaded again
+            os.utime(path)
+            return value
+        except (OSError, ValueError) as e:
+            logger.warning(f"transcript cache: can't read {path}: {e}")
+            self._forget(key)
+            return None
+
+    def _write(self, key, value):
+        path = self._path(key)
+        data = json.dumps(value).encode("utf-8")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"transcript cache: can't write {path}: {e}")
+            return
+        with self.lock:
+            self.size += len(data) - self.index.pop(key, 0)
+            self.index[key] = len(data)
+        self._evict()
+
+    def _forget(self, key):
+        with self.lock:
+            self.size -= self.index.pop(key, 0)
+
+    def _evict(self):
+        while True:
+            with self.lock:
+                if self.size <= self.max_bytes or len(self.index) <= 1:
+                    return
+                key, size = self.index.popitem(last=False)
+                self.size -= size
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    async def get(self, key):
+        """Returns (value, tier) with tier "memory" or "disk", or (None, None)"""
+        if not self.enabled:
+            return None, None
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+            return value, "memory"
+        if self.cache_dir is None:
+            return None, None
+        value = await asyncio.to_thread(self._read, key)
+        if value is None:
+            return None, None
+        self._remember(key, value)
+        return value, "disk"
+
+    async def put(self, key, value):
+        if not self.enabled:
+            return
+        self._remember(key, value)
+        if self.cache_dir is not None:
+            await asyncio.to_thread(self._write, key, value)
+
+    async def compute(self, key, factory):
+        """Returns (value, coalesced). Runs factory() (a coroutine function) and caches its result, or waits for the
+        result of the same key that is being computed. The computation runs in its own task, so it isn't cancelled
+        when one of the waiting requests is."""
+        task = self.inflight.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        async def run():
+            try:
+                value = await factory()
+                await self.put(key, value)
+                return value
+            finally:
+                del self.inflight[key]
+
+        task = self.inflight[key] = asyncio.ensure_future(run())
+        return await asyncio.shield(task), False
+
+    def stats(self):
+        return {"memory_entries": len(self.memory), "disk_entries": len(self.index), "disk_bytes": self.size,
+                "max_bytes": self.max_bytes, "in_flight": len(self.inflight)}
@@ -0,0 +1,184 @@
+"""Transcription jobs: windowed transcription with progress, and the in-memory store of the jobs.
+
+transcribe_windows runs Whisper on 30 s windows of the audio one after another, like whisper.transcribe does
+internally, but returns each segment as soon as its window is decoded. The jobs of the API run it in the
+inference pool and publish the segments to the clients that poll the status or stream the segments.
+transcribe_stream does the same over a decoder that yields the audio block by block, so that a long file is
+never held in memory as a whole.
+"""
+import time
+import uuid
+import asyncio
+import logging
+
+import numpy as np
+import whisper
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+WINDOW_SAMPLES = whisper.audio.N_SAMPLES  # 30 s, the input size of the model
+PROMPT_CHARS = 200  # of the previous text, passed as the initial prompt of the next window
+
+
+def transcribe_windows(model, audio, options, on_segment=None, on_progress=None, should_stop=None):
+    """Transcribes the audio window by window. on_segment(segment) is called with each segment as soon as it's
+    decoded, on_progress(fraction) after each window, and should_stop() before each window.
+
+    The last segment of a window may be cut off by the window end, so it's dropped and the next window starts at its
+    beginning, unless it's the only one. The segments are dicts with id, start, end (seconds in the audio) and text.
+    Returns {"text", "segments", "language"}, the same keys as whisper.transcribe, and "duration".
+    """
+    return transcribe_stream(model, [audio], options, duration=len(audio) / SAMPLE_RATE, on_segment=on_segment,
+                             on_progress=on_progress, should_stop=should_stop)
+
+
+def transcribe_stream(model, blocks, options, duration=None, on_segment=None, on_progress=None, should_stop=None):
+    """The same as transcribe_windows, but the audio comes as an iterable of float32 blocks (see
+    audio_decode.iter_audio), and only the current window is kept, so the memory doesn't grow with the length of
+    the audio. duration: of the audio in seconds for on_progress, if it's known in advance.
+    """
+    options = dict(options)
+    prompt = options.pop("initial_prompt", None)
+    language = options.pop("language", None)
+    segments = []
+    window = np.empty(WINDOW_SAMPLES, dtype=np.float32)
+    filled = 0
+    offset = 0  # of the window in the audio, in samples
+    blocks = iter(blocks)
+    pending = None  # the rest of the last block that didn't fit into the window
+    ended = False
+    while True:
+        while filled < WINDOW_SAMPLES and not ended:
+            if pending is None or not len(pending):
+                pending = next(blocks, None)
+                if pending is None:
+                    ended = True
+                    break
+            n = min(len(pending), WINDOW_SAMPLES - filled)
+            window[filled:filled + n] = pending[:n]
+            pending = pending[n:]
+            filled += n
+        if not filled or (should_stop is not None and should_stop()):
+            break
+
+        result = model.transcribe(window[:filled], language=language, initial_prompt=prompt,
+                                  condition_on_previous_text=False, **options)
+        # the language of the first window is kept, it's detected only once
+        language = language or result.get("language")
+        window_segments = result.get("segments", [])
+        next_pos = filled
+        # a full window may be followed by more audio
+        if filled == WINDOW_SAMPLES and len(window_segments) > 1:
+            cut = int(window_segments[-1]["start"] * SAMPLE_RATE)
+            if 0 < cut < filled:
+                window_segments = window_segments[:-1]
+                next_pos = cut
+        for s in window_segments:
+            text = s["text"].strip()
+            if not text:
+                continue
+            seg = {"id": len(segments), "start": round(offset / SAMPLE_RATE + s["start"], 3),
+                   "end": round(offset / SAMPLE_RATE + s["end"], 3), "text": text}
+            segments.append(seg)
+            if on_segment is not None:
+                on_segment(seg)
+        if segments:
+            prompt = " ".join(s["text"] for s in segments[-8:])[-PROMPT_CHARS:]
+
+        # the audio after the cut stays for the next window
+        window[:filled - next_pos] = window[next_pos:filled]
+        filled -= next_pos
+        offset += next_pos
+        if on_progress is not None and duration:
+            on_progress(min(1.0, offset / SAMPLE_RATE / duration))
+    return {"text": " ".join(s["text"] for s in segments), "segments": segments, "language": language,
+            "duration": (offset + filled) / SAMPLE_RATE}
+
+
+class Job:
+    """State of one transcription job. It's updated only in the event loop; the worker thread schedules the
+    updates with call_soon_threadsafe. The waiting clients are woken up by changed()."""
+
+    def __init__(self, filename, language=None, model=None):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.language = language
+        self.model = model
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.queue_position = None
+        self.created = time.time()
+        self.finished_at = None
+        self.duration = None  # of the audio, in seconds, known after decoding
+        self.progress = 0.0
+        self.segments = []
+        self.text = None
+        self.error = None
+        self.cancelled = False
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def changed(self):
+        """awaitable of the next update of the job, from the time of this call"""
+        return self._changed.wait()
+
+    def update(self, **fields):
+        for k, v in fields.items():
+            setattr(self, k, v)
+        self._notify()
+
+    def add_segment(self, segment):
+        self.segments.append(segment)
+        self._notify()
+
+    def finish(self, status, **fields):
+        self.finished_at = time.time()
+        self.update(status=status, **fields)
+
+    def to_dict(self):
+        d = {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "progress": round(self.progress * 100, 1),
+            "duration": self.duration,
+            "segments": len(self.segments),
+            "language": self.language,
+            "model": self.model,
+            "created": self.created,
+        }
+        if self.status == "queued" and self.queue_position is not None:
+            d["queue_position"] = self.queue_position
+        if self.text is not None:
+            d["text"] = self.text
+        if self.error is not None:
+            d["error"] = self.error
+        return d
+
+
+class JobStore:
+    """The jobs by id. The finished ones are forgotten after `ttl` seconds."""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.jobs = {}
+
+    def add(self, job):
+        self.expire()
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def expire(self):
+        now = time.time()
+        for job_id in [j.id for j in self.jobs.values() if j.finished_at is not None and now - j.finished_at > self.ttl]:
+            del self.jobs[job_id]
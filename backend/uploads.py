@@ -0,0 +1,169 @@
+"""Uploads of the transcription endpoints, written to disk once, as they arrive.
+
+With UploadFile, Starlette spools the multipart body to its own temporary file, which is closed with the request,
+and the API had to copy it to a file that the decoder, the jobs and the transcript cache can own. Here the body is
+parsed while it's received, and the file part goes straight to a named temporary file, hashed on the way (SHA-256,
+the key of the transcript cache). The parsing runs in the event loop; the data is hashed and written in a worker
+thread, in batches of WRITE_SIZE, so a large upload doesn't block the other requests.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+WRITE_SIZE = 1024 * 1024  # the received data is written to the file in batches of at least this size
+
+
+class UploadError(ValueError):
+    """The request is not a multipart upload of the file"""
+
+
+class Upload:
+    """The uploaded file: the path of its temporary file, the filename and content type sent by the client, the
+    SHA-256 of the content and its size"""
+
+    def __init__(self, path, filename, content_type, sha256, size):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+        self.sha256 = sha256
+        self.size = size
+
+
+class _Receiver:
+    """Callbacks of MultipartParser: the data of the first part named `field` with a filename is collected in
+    `pending`, and flush() writes it to a temporary file. The other parts are skipped."""
+
+    def __init__(self, field):
+        self.field = field.encode()
+        self.headers = {}
+        self._name = b""
+        self._value = b""
+        self.receiving = False  # the data of the file part is coming
+        self.complete = False  # the file part has ended
+        self.pending = []
+        self.pending_size = 0
+        self.file = None
+        self.filename = None
+        self.content_type = None
+        self.digest = None
+        self.size = 0
+        self.upload = None
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self.headers = {}
+
+    def on_header_field(self, data, start, end):
+        self._name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self._name.lower()] = self._value
+        self._name = b""
+        self._value = b""
+
+    def on_headers_finished(self):
+        if self.complete or self.receiving:
+            return
+        _, params = parse_options_header(self.headers.get(b"content-disposition", b""))
+        if params.get(b"name") != self.field or b"filename" not in params:
+            return
+        self.filename = params[b"filename"].decode(errors="replace")
+        self.content_type = self.headers.get(b"content-type", b"").decode(errors="replace") or None
+        self.receiving = True
+
+    def on_part_data(self, data, start, end):
+        if self.receiving:
+            self.pending.append(bytes(data[start:end]))
+            self.pending_size += end - start
+
+    def on_part_end(self):
+        if self.receiving:
+            self.receiving = False
+            self.complete = True
+
+    def _write(self, chunks, close):
+        # in a worker thread
+        if self.file is None:
+            self.digest = hashlib.sha256()
+            self.file = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(self.filename)[1])
+        for chunk in chunks:
+            self.digest.update(chunk)
+            self.file.write(chunk)
+            self.size += len(chunk)
+        if close:
+            self.file.close()
+
+    async def flush(self):
+        """writes the pending data when there's enough of it or the part has ended"""
+        if self.upload is not None or not (self.pending_size >= WRITE_SIZE or self.complete):
+            return
+        chunks = self.pending
+        self.pending = []
+        self.pending_size = 0
+        await asyncio.to_thread(self._write, chunks, self.complete)
+        if self.complete:
+            self.upload = Upload(self.file.name, self.filename, self.content_type, self.digest.hexdigest(), self.size)
+
+    def discard(self):
+        """removes the file of an upload that failed"""
+        if self.file is None:
+            return
+        self.file.close()
+        try:
+            os.unlink(self.file.name)
+        except OSError as e:
+            logger.warning(f"Failed to delete temp file: {e}")
+
+
+async def spool_upload(request, field="file"):
+    """Receives the multipart/form-data body of the request and writes its file part `field` to a temporary file
+    with the extension of the filename. Returns an Upload; the caller removes the file. Raises UploadError if there
+    is no such part or the body is malformed."""
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise UploadError("Expected a multipart/form-data upload")
+    receiver = _Receiver(field)
+    parser = MultipartParser(params[b"boundary"], receiver.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await receiver.flush()
+        parser.finalize()
+        await receiver.flush()
+        if receiver.receiving:
+            raise UploadError("The upload is incomplete")
+    except UploadError:
+        receiver.discard()
+        raise
+    except ValueError as e:
+        # the parse errors of python-multipart
+        receiver.discard()
+        raise UploadError(f"Malformed upload: {e}") from e
+    except BaseException:
+        receiver.discard()
+        raise
+    if receiver.upload is None:
+        raise UploadError(f"No file in the '{field}' field of the upload")
+    return receiver.upload
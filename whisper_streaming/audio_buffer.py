@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import numpy as np
+
+
+class AudioRingBuffer:
+    '''Fixed-capacity audio store for the streaming processors.
+
+    The samples live in one preallocated array. Appending writes behind the last sample
+    and trimming only moves the start index, so none of them copies the stored audio.
+    When the write position reaches the end of the array, the live samples are moved back
+    to its beginning (or the array is doubled if they don't fit into capacity). It happens
+    at most once per `capacity` appended samples, so the inserts are amortized O(chunk).
+    Unlike a wrapping ring, the live samples are always contiguous, and the backend gets
+    them as one array without concatenation.
+
+    With dtype=np.int16, the audio is stored as 16-bit PCM (half of the memory of float32).
+    The float32 view is then made lazily when it is read, and cached until the next change.
+
+    The buffer also counts the absolute position of the samples since the last clear():
+    `offset` is the position of the first stored sample and `end` is behind the last one.
+    Several readers can share one buffer and read it by absolute positions with slice(),
+    e.g. the VAD reading 512-sample windows and the VAC reading the voiced audio.
+    '''
+
+    def __init__(self, capacity, dtype=np.float32):
+        """capacity: number of samples that the buffer is expected to hold at once. It grows if needed.
+        dtype: np.float32 or np.int16, the storage format
+        """
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.int16):
+            raise ValueError(f"unsupported audio buffer dtype {self.dtype}, use float32 or int16")
+        self.capacity = max(1, int(capacity))
+        self._data = np.zeros(2*self.capacity, dtype=self.dtype)
+        self._beg = 0
+        self._end = 0
+        self._float = None  # cached float32 view for the int16 storage
+        self.offset = 0  # absolute position of the first stored sample
+
+    def __len__(self):
+        return self._end - self._beg
+
+    @property
+    def end(self):
+        """absolute position behind the last stored sample"""
+        return self.offset + len(self)
+
+    def clear(self):
+        self._beg = self._end = 0
+        self._float = None
+        self.offset = 0
+
+    def append(self, audio):
+        audio = np.asarray(audio)
+        n = len(audio)
+        if n == 0:
+            return
+        if self._end + n > len(self._data):
+            self._make_room(n)
+        self._write(self._data[self._end:self._end+n], audio)
+        self._end += n
+        self._float = None
+
+    def drop(self, n):
+        """removes n samples from the beginning"""
+        n = min(max(0, int(n)), len(self))
+        self._beg += n
+        self.offset += n
+        if self._beg == self._end:
+            self._beg = self._end = 0
+        if n:
+            self._float = None
+
+    def drop_to(self, position):
+        """removes the samples before the absolute position"""
+        self.drop(position - self.offset)
+
+    def slice(self, beg, end=None):
+        """Returns float32 audio between the absolute positions beg and end (default: the end of buffer).
+        The positions are clipped to the stored samples. For the float32 storage, it's a view without copying,
+        valid only until the next append or drop.
+        """
+        if end is None:
+            end = self.end
+        beg = min(max(beg, self.offset), self.end) - self.offset
+        end = min(max(end, self.offset), self.end) - self.offset
+        if self.dtype == np.float32:
+            return self._data[self._beg+beg:self._beg+max(beg, end)]
+        return self.view()[beg:max(beg, end)]
+
+    def view(self):
+        """Returns the stored audio as float32 array. It is a view into the buffer (for the float32 storage),
+        so it is valid only until the next append or drop.
+        """
+        if self.dtype == np.float32:
+            return self._data[self._beg:self._end]
+        if self._float is None:
+            self._float = np.multiply(self._data[self._beg:self._end], 1/32768, dtype=np.float32)
+        return self._float
+
+    def _make_room(self, n):
+        live = len(self)
+        if live + n > self.capacity:
+            while live + n > self.capacity:
+                self.capacity *= 2
+            data = np.zeros(2*self.capacity, dtype=self.dtype)
+        else:
+            data = self._data
+        # numpy handles the overlapping copy correctly
+        data[:live] = self._data[self._beg:self._end]
+        self._data = data
+        self._beg = 0
+        self._end = live
+
+    def _write(self, dest, audio):
+        if audio.dtype == self.dtype:
+            dest[...] = audio
+        elif self.dtype == np.int16:
+            # float audio in [-1,1] to PCM16
+            np.multiply(np.clip(audio, -1, 1), 32767, out=dest, casting="unsafe")
+        elif audio.dtype == np.int16:
+            np.multiply(audio, 1/32768, out=dest, casting="unsafe")
+        else:
+            dest[...] = audio
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+import json
+from math import gcd
+import numpy as np
+
+# raw sample formats that the clients can send
+PCM_FORMATS = {
+    "s16le": np.dtype("<i2"),
+    "f32le": np.dtype("<f4"),
+}
+
+
+class PCMBuffer:
+    '''Receives a byte stream of raw PCM audio into a preallocated buffer and turns it into samples.
+
+    The socket writes directly into the buffer (recv_into the writable() view, then commit()), or the bytes are
+    copied in by feed(). take() returns all the complete samples as a numpy view of the buffer, without decoding
+    or copying. If a packet boundary splits a sample, its bytes stay in the buffer and the sample is completed
+    by the next packet.
+    '''
+
+    def __init__(self, sample_format="s16le", capacity=32000, channels=1):
+        """sample_format: "s16le" or "f32le"
+        capacity: initial size of the buffer in bytes. It grows if needed.
+        channels: number of interleaved channels. A sample is then a frame of all the channels.
+        """
+        self.dtype = PCM_FORMATS[sample_format]
+        self.channels = channels
+        self.frame_size = self.dtype.itemsize*channels
+        self.buf = bytearray(capacity)
+        self.filled = 0  # bytes in the buffer
+        self.taken = 0  # bytes returned by the last take(), they are released by the next write
+
+    def samples(self):
+        """number of complete samples that were not taken yet"""
+        return (self.filled - self.taken)//self.frame_size
+
+    def _release(self, need):
+        if self.taken:
+            # the incomplete sample goes to the beginning. The view from take() is not valid anymore.
+            rest = self.filled - self.taken
+            self.buf[:rest] = self.buf[self.taken:self.filled]
+            self.filled = rest
+            self.taken = 0
+        if self.filled + need > len(self.buf):
+            buf = bytearray(max(2*len(self.buf), self.filled + need))
+            buf[:self.filled] = self.buf[:self.filled]
+            self.buf = buf
+
+    def writable(self, size=65536):
+        """memoryview of at least `size` free bytes, for socket.recv_into. Then call commit() with the number of received bytes."""
+        self._release(size)
+        return memoryview(self.buf)[self.filled:]
+
+    def commit(self, n):
+        self.filled += n
+
+    def feed(self, data):
+        """copies the bytes-like data into the buffer"""
+        n = len(data)
+        self._release(n)
+        self.buf[self.filled:self.filled+n] = data
+        self.filled += n
+
+    def take(self):
+        """Returns all the complete samples as a numpy array, shape (samples,) or (samples, channels).
+        It's a view of the buffer, valid until the next write."""
+        self._release(0)
+        n = self.filled//self.frame_size
+        self.taken = n*self.frame_size
+        a = np.frombuffer(self.buf, dtype=self.dtype, count=n*self.channels)
+        if self.channels > 1:
+            a = a.reshape(n, self.channels)
+        return a
+
+
+class StreamingResampler:
+    '''Polyphase resampler of an audio stream that comes in chunks.
+
+    The rate is changed by the rational factor up/down (e.g. 1/3 from 48 kHz to 16 kHz, 160/441 from 44.1 kHz).
+    The low-pass filter is a Kaiser-windowed sinc with `taps` coefficients per phase, and only the phases that
+    produce the output samples are computed, so one output sample costs `taps` multiplications. The last input
+    samples are kept between the calls, so the chunk boundaries don't make any discontinuity: the output is the
+    same as if the whole stream was resampled at once. The output is delayed by about taps/2 input samples.
+    '''
+
+    def __init__(self, in_rate, out_rate=16000, taps=32, beta=8.0, rolloff=0.92):
+        g = gcd(int(in_rate), int(out_rate))
+        self.up = int(out_rate)//g
+        self.down = int(in_rate)//g
+        self.taps = taps
+
+        # prototype filter at the upsampled rate, cut off below the lower of the two Nyquist frequencies
+        n = taps*self.up
+        cutoff = rolloff/max(self.up, self.down)
+        t = np.arange(n) - (n - 1)/2
+        h = cutoff*np.sinc(cutoff*t)*np.kaiser(n, beta)
+        h *= self.up/h.sum()
+        # phases[p, k] = h[p + k*up], the coefficient of x[i-k] for the output samples with phase p
+        self.phases = h.reshape(taps, self.up).T.astype(np.float32)
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.consumed = 0  # number of input samples
+        self.produced = 0  # number of output samples
+
+    def __call__(self, audio):
+        """audio: 1-D float32 chunk. Returns the resampled chunk, all the output samples that it completes."""
+        x = np.concatenate([self.history, audio.astype(np.float32, copy=False)])
+        total = self.consumed + len(audio)
+        # output n needs the input sample n*down//up
+        n_end = (total*self.up - 1)//self.down + 1 if total else 0
+        n = np.arange(self.produced, n_end, dtype=np.int64)
+        pos = n*self.down
+        i = pos//self.up - (self.consumed - (self.taps - 1))  # index of x[n*down//up] in x
+        idx = i[:, None] - np.arange(self.taps)
+        out = np.einsum("nk,nk->n", x[idx], self.phases[pos % self.up])
+
+        self.history = x[len(x) - (self.taps - 1):].copy()
+        self.consumed = total
+        self.produced = n_end
+        return out
+
+
+class PCMStream:
+    '''Raw PCM audio stream of one client, converted to 16 kHz mono float32 for the ASR.
+
+    The bytes are received into a PCMBuffer (writable/commit or feed). take() downmixes the channels by averaging
+    them and resamples the audio with StreamingResampler, if the client doesn't send 16 kHz mono. Otherwise,
+    take() returns the view of the receive buffer directly.
+    '''
+
+    def __init__(self, sample_format="s16le", sample_rate=16000, channels=1, out_rate=16000, capacity=None):
+        self.out_rate = out_rate
+        self.capacity = capacity
+        self.configure(sample_format, sample_rate, channels)
+
+    def configure(self, sample_format=None, sample_rate=None, channels=None):
+        """Sets the format of the audio that the client sends. Only before the first audio."""
+        self.sample_format = sample_format or self.sample_format
+        self.sample_rate = int(sample_rate or self.sample_rate)
+        self.channels = int(channels or self.channels)
+        if self.sample_format not in PCM_FORMATS:
+            raise ValueError(f"unknown sample format {self.sample_format}")
+        if self.sample_rate <= 0 or self.channels <= 0:
+            raise ValueError(f"invalid sample rate {self.sample_rate} or number of channels {self.channels}")
+        capacity = self.capacity or self.sample_rate*PCM_FORMATS[self.sample_format].itemsize*self.channels
+        self.pcm = PCMBuffer(self.sample_format, capacity, self.channels)
+        self.resampler = StreamingResampler(self.sample_rate, self.out_rate) if self.sample_rate != self.out_rate else None
+
+    def configure_json(self, payload):
+        """configure() with the JSON object from the client, e.g. {"sample_rate": 48000, "channels": 2, "format": "s16le"}"""
+        cfg = json.loads(bytes(payload).decode("utf-8"))
+        self.configure(cfg.get("format"), cfg.get("sample_rate"), cfg.get("channels"))
+
+    def writable(self, size=65536):
+        return self.pcm.writable(size)
+
+    def commit(self, n):
+        self.pcm.commit(n)
+
+    def feed(self, data):
+        self.pcm.feed(data)
+
+    def duration(self):
+        """seconds of the audio that was received and not taken yet"""
+        return self.pcm.samples()/self.sample_rate
+
+    def take(self):
+        """Returns the received audio at out_rate and mono. It may be a view of the buffer, valid until the next write."""
+        audio = self.pcm.take()
+        if self.channels == 1 and self.resampler is None:
+            return audio
+        if audio.dtype == np.int16:
+            audio = audio.astype(np.float32)
+            audio *= 1/32768
+        if self.channels > 1:
+            audio = audio.mean(axis=1, dtype=np.float32)
+        if self.resampler is not None:
+            audio = self.resampler(audio)
+        return audio
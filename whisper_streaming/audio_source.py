@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import atexit
+import shutil
+import queue
+from collections import OrderedDict
+
+import numpy as np
+
+from audio_buffer import AudioRingBuffer
+from audio_ingest import StreamingResampler
+
+logger = logging.getLogger(__name__)
+
+
+class DecodedAudioCache:
+    '''Decoded audio files on disk, as memory-mapped .npy files, with LRU eviction under a byte budget.
+
+    A file is decoded once (librosa, to float32 mono at sampling_rate) and stored in cache_dir. The key is the
+    absolute path, modification time, size and sampling rate of the source file, so the cache entry of a
+    changed file is not used. get() returns a read-only memmap, and its slices don't copy anything: the process
+    keeps only the pages that are actually read, and the OS can drop them when it needs the memory.
+
+    When the total size of the entries is over max_bytes, the least recently used ones are removed. A removed
+    file stays readable by the arrays that were returned before.
+    '''
+
+    def __init__(self, cache_dir=None, max_bytes=2*1024**3, sampling_rate=16000):
+        """cache_dir: directory of the cache files. It is kept between runs. If None, a temporary directory is
+        used and removed at exit.
+        max_bytes: size budget of the cache files
+        """
+        if cache_dir is None:
+            cache_dir = tempfile.mkdtemp(prefix="whisper-audio-")
+            atexit.register(shutil.rmtree, cache_dir, ignore_errors=True)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.sampling_rate = sampling_rate
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> [path, size in bytes, memmap or None], the least recent first
+        self.total = 0
+        # the entries from the previous runs, by the time of their last use
+        old = []
+        for name in os.listdir(cache_dir):
+            if name.endswith(".npy"):
+                path = os.path.join(cache_dir, name)
+                st = os.stat(path)
+                old.append((st.st_mtime, name[:-4], path, st.st_size))
+        for _, key, path, size in sorted(old):
+            self.entries[key] = [path, size, None]
+            self.total += size
+        self._evict()
+
+    def _key(self, fname):
+        path = os.path.abspath(fname)
+        st = os.stat(path)
+        ident = f"{path}\0{st.st_mtime_ns}\0{st.st_size}\0{self.sampling_rate}"
+        return hashlib.sha1(ident.encode("utf-8", errors="surrogateescape")).hexdigest()
+
+    def _decode(self, fname):
+        import librosa
+        a, _ = librosa.load(fname, sr=self.sampling_rate, dtype=np.float32)
+        return a
+
+    def _evict(self):
+        # the most recent entry is kept even if it is over the budget alone
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            path, size, _ = self.entries.pop(key)
+            self.total -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            logger.debug(f"decoded audio cache: removed {path}")
+
+    def get(self, fname):
+        """Returns the decoded audio of fname, a read-only float32 memmap."""
+        key = self._key(fname)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if entry[2] is None:
+                    os.utime(entry[0])
+                    entry[2] = np.load(entry[0], mmap_mode="r")
+                return entry[2]
+
+        audio = self._decode(fname)
+        path = os.path.join(self.cache_dir, key + ".npy")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, audio)
+        os.replace(tmp, path)
+        del audio
+
+        with self.lock:
+            if key not in self.entries:
+                size = os.path.getsize(path)
+                self.entries[key] = [path, size, None]
+                self.total += size
+                self._evict()
+            entry = self.entries[key]
+            self.entries.move_to_end(key)
+            if entry[2] is None:
+                entry[2] = np.load(path, mmap_mode="r")
+            return entry[2]
+
+    def clear(self):
+        with self.lock:
+            for path, _, _ in self.entries.values():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.entries.clear()
+            self.total = 0
+
+
+class StreamingAudioFile:
+    '''Audio file that is decoded block by block, as it is read, e.g. for the simulation of live streaming.
+
+    chunk(beg, end) returns the audio between two times, at sampling_rate and mono. The blocks are read by
+    soundfile in a background thread, `read_ahead` blocks ahead of the reader, and the files with other sampling
+    rates or more channels are converted by StreamingResampler and averaging. Only the audio from the last
+    chunk beginning on is kept in memory, so a file of any length takes constant memory. start_at seeks in the
+    file without decoding the audio before it.
+    '''
+
+    def __init__(self, fname, sampling_rate=16000, start_at=0.0, block_seconds=1.0, read_ahead=4):
+        import soundfile
+        self.file = soundfile.SoundFile(fname)
+        self.sampling_rate = sampling_rate
+        self.block = max(1, int(block_seconds*self.file.samplerate))  # frames read from the file at once
+        self.out_block = max(1, int(block_seconds*sampling_rate))  # the same at sampling_rate
+        self.read_ahead = read_ahead
+        self.resampler = None
+        if self.file.samplerate != sampling_rate:
+            self.resampler = StreamingResampler(self.file.samplerate, sampling_rate)
+        self.buffer = AudioRingBuffer(int((read_ahead + 2)*block_seconds*sampling_rate))
+        self.thread = None
+        self.seek(start_at)
+
+    @property
+    def duration(self):
+        """length of the file in seconds, from its header"""
+        return self.file.frames/self.file.samplerate
+
+    def seek(self, time):
+        """The next chunk starts at the time in seconds. The audio before it is not decoded."""
+        self._stop()
+        time = min(max(0.0, time), self.duration)
+        self.file.seek(int(time*self.file.samplerate))
+        if self.resampler is not None:
+            self.resampler.reset()
+        self.buffer.clear()
+        self.buffer.offset = int(time*self.sampling_rate)
+        self.eof = False
+        self.stopping = threading.Event()
+        self.blocks = queue.Queue(maxsize=self.read_ahead)
+        self.thread = threading.Thread(target=self._read, name="audio-read-ahead", daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        # puts the blocks into self.blocks, then None at the end of file, or the exception if reading failed
+        while not self.stopping.is_set():
+            try:
+                a = self.file.read(self.block, dtype="float32", always_2d=True)
+                if len(a):
+                    a = a[:, 0] if a.shape[1] == 1 else a.mean(axis=1, dtype=np.float32)
+                    if self.resampler is not None:
+                        a = self.resampler(a)
+                block = a if len(a) else None
+            except Exception as e:
+                block = e
+            while not self.stopping.is_set():
+                try:
+                    self.blocks.put(block, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if block is None or isinstance(block, Exception):
+                return
+
+    def _stop(self):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    def chunk(self, beg, end):
+        """Returns float32 audio between the times beg and end in seconds, like load_audio_chunk."""
+        beg_s = int(beg*self.sampling_rate)
+        end_s = int(end*self.sampling_rate)
+        if beg_s < self.buffer.offset or beg_s > self.buffer.end + self.out_block:
+            self.seek(beg)
+        self.buffer.drop_to(beg_s)
+        while self.buffer.end < end_s and not self.eof:
+            block = self.blocks.get()
+            if block is None:
+                self.eof = True
+            elif isinstance(block, Exception):
+                self.eof = True
+                raise block
+            else:
+                self.buffer.append(block)
+        return self.buffer.slice(beg_s, end_s).copy()
+
+    def close(self):
+        self._stop()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DecodedAudioFile:
+    '''The interface of StreamingAudioFile for the audio that was decoded whole, e.g. by load_audio.'''
+
+    def __init__(self, audio, sampling_rate=16000):
+        self.audio = audio
+        self.sampling_rate = sampling_rate
+
+    @property
+    def duration(self):
+        return len(self.audio)/self.sampling_rate
+
+    def seek(self, time):
+        pass
+
+    def chunk(self, beg, end):
+        return self.audio[int(beg*self.sampling_rate):int(end*self.sampling_rate)]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
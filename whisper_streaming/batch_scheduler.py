@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class _Request:
+
+    __slots__ = ("audio", "init_prompt", "features", "time", "result", "error", "done")
+
+    def __init__(self, audio, init_prompt, features):
+        self.audio = audio
+        self.init_prompt = init_prompt
+        self.features = features
+        self.time = time.monotonic()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchScheduler:
+    '''Shares one ASR object between many OnlineASRProcessors, each of them running in its own thread.
+
+    It is used in place of the ASR object: OnlineASRProcessor.process_iter calls transcribe() as usual, and it
+    blocks until the result is ready. Meanwhile, the requests from all the sessions are queued, and the worker
+    threads send them to the backend by asr.transcribe_batch. With max_batch_size 1, each request is sent at once
+    and the scheduler only bounds the number of concurrent backend calls. A larger batch is sent when it has
+    max_batch_size requests, or max_wait seconds after the first of them arrived; it is worth it only if the
+    backend decodes the batch in one model call (asr.decodes_batches), otherwise the wait is only latency.
+    Each result is returned to the thread that asked for it, so it goes to the HypothesisBuffer of the right
+    session.
+
+    The other attributes (sep, ts_words, segments_end_ts, ...) are the ones of the wrapped ASR object.
+    '''
+
+    def __init__(self, asr, max_batch_size=8, max_wait=0.05, workers=1):
+        """asr: ASRBase object
+        max_batch_size: maximum number of audio buffers in one backend call
+        max_wait: maximum time in seconds that the first request waits for the others
+        workers: number of threads that call the backend. More than 1 only if the backend can run concurrently.
+        """
+        self.asr = asr
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+
+        self.workers = [threading.Thread(target=self._work, name=f"asr-batch-{i}", daemon=True) for i in range(workers)]
+        for w in self.workers:
+            w.start()
+
+    def __getattr__(self, name):
+        return getattr(self.asr, name)
+
+    def transcribe(self, audio, init_prompt="", features=None):
+        req = _Request(audio, init_prompt, features)
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("the batch scheduler is closed")
+            self.queue.append(req)
+            self.cond.notify_all()
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _next_batch(self):
+        with self.cond:
+            while not self.queue and not self.closed:
+                self.cond.wait()
+            if not self.queue:
+                return None
+            deadline = self.queue[0].time + self.max_wait
+            while len(self.queue) < self.max_batch_size and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return [self.queue.popleft() for _ in range(min(len(self.queue), self.max_batch_size))]
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue
+            logger.debug(f"transcribing a batch of {len(batch)}")
+            try:
+                features = None
+                if any(r.features is not None for r in batch):
+                    features = [r.features for r in batch]
+                results = self.asr.transcribe_batch([r.audio for r in batch], [r.init_prompt for r in batch], features=features)
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+            else:
+                for r, res in zip(batch, results):
+                    r.result = res
+            for r in batch:
+                r.done.set()
+
+    def close(self):
+        """Stops the workers after the requests that are waiting are processed."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for w in self.workers:
+            w.join()
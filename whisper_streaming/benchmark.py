@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Streaming replay benchmark.
+
+Replays a corpus of audio files through OnlineASRProcessor with whisper_online.simulate, the same way as the
+simulation in whisper_online.py, and reports the latency and speed of the streaming as JSON, for each file and
+in aggregate:
+
+  - time_to_first_token: from the start of the stream to the first committed text, in seconds
+  - first_token_latency: emission time of the first committed text minus the beginning of its audio
+  - commit_lag: emission time minus the end time of the last word of each committed text, percentiles
+  - rtf: real-time factor, the time spent in process_iter and finish divided by the audio duration
+  - process_iter: percentiles of the duration of one process_iter call
+  - peak_rss_mb: peak resident memory of the process by then (null on Windows)
+  - stages: histograms of the duration of the process_iter stages (see instrumentation.py), to tell whether
+    the inference or the bookkeeping takes the time
+
+With `--backend stub`, no model is needed, so it can run anywhere and compare the streaming pipeline itself.
+"""
+import sys
+import os
+import json
+import time
+import logging
+import platform
+
+import numpy as np
+
+from instrumentation import HistogramCollector
+from whisper_online import add_shared_args, create_asr, create_instrumentation, online_factory, open_audio_file, set_logging, set_audio_cache, simulate
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg")
+
+
+def corpus_files(paths):
+    """the files and the audio files in the directories, sorted"""
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                files.extend(os.path.join(root, n) for n in names if n.lower().endswith(AUDIO_EXTENSIONS))
+        else:
+            files.append(p)
+    return sorted(files)
+
+
+def percentiles(values, ps=(50, 90, 99)):
+    if not values:
+        return None
+    a = np.asarray(values, dtype=np.float64)
+    stats = {f"p{p}": float(np.percentile(a, p)) for p in ps}
+    stats.update(mean=float(a.mean()), max=float(a.max()), count=len(a))
+    return stats
+
+
+def peak_rss_mb():
+    """peak resident memory of the process, None on Windows"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return r/1024**2 if sys.platform == "darwin" else r/1024
+
+
+class StreamStats:
+    '''Collects the outputs of one simulated stream. It is the callback of whisper_online.simulate.'''
+
+    def __init__(self, start_at=0.0):
+        self.start_at = start_at
+        self.compute_times = []  # of process_iter calls, and finish as the last one
+        self.lags = []
+        self.time_to_first_token = None
+        self.first_token_latency = None
+        self.emissions = 0
+        self.words = 0
+
+    def __call__(self, o, now, end, compute_time):
+        self.compute_times.append(compute_time)
+        if o[0] is None:
+            return
+        self.emissions += 1
+        self.words += len(o[2].split())
+        self.lags.append(now - o[1])
+        if self.time_to_first_token is None:
+            self.time_to_first_token = now - self.start_at
+            self.first_token_latency = now - o[0]
+
+    def report(self, duration, wall_time):
+        iter_times = self.compute_times[:-1]
+        compute = sum(self.compute_times)
+        return {
+            "duration": duration,
+            "wall_time": wall_time,
+            "compute_time": compute,
+            "rtf": compute/duration if duration else None,
+            "time_to_first_token": self.time_to_first_token,
+            "first_token_latency": self.first_token_latency,
+            "commit_lag": percentiles(self.lags),
+            "process_iter": percentiles(iter_times),
+            "finish_time": self.compute_times[-1] if self.compute_times else None,
+            "emissions": self.emissions,
+            "words": self.words,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+
+def run_benchmark(args, files, mode="comp_unaware", start_at=0.0):
+    """Replays the files one by one with one shared ASR object, as the simulation does. Returns the report dict."""
+    asr = create_asr(args)
+    min_chunk = args.vac_chunk_size if args.vac else args.min_chunk_size
+
+    # warm up the ASR because the very first transcribe takes much more time than the other
+    with open_audio_file(files[0]) as source:
+        asr.transcribe(source.chunk(0, 1))
+
+    results = []
+    all_stats = []
+    # --instrumentation writes the records of the stages as JSON lines, too
+    jsonl = create_instrumentation(args)
+    stages = HistogramCollector(callback=jsonl.record if jsonl is not None else None)
+    for fname in files:
+        logger.info(f"replaying {fname}")
+        online = online_factory(args, asr, instrumentation=stages)
+        source = open_audio_file(fname, start_at=start_at)
+        stats = StreamStats(start_at)
+        t = time.time()
+        try:
+            simulate(online, source, min_chunk, start_at=start_at, mode=mode, callback=stats)
+        finally:
+            source.close()
+            online.close()
+        wall_time = time.time() - t
+        duration = max(0.0, source.duration - start_at)
+        r = stats.report(duration, wall_time)
+        r["file"] = fname
+        results.append(r)
+        all_stats.append(stats)
+        logger.info(f"{fname}: {duration:.1f} s of audio, rtf {r['rtf'] or 0:.3f}, {r['words']} words")
+
+    duration = sum(r["duration"] for r in results)
+    compute = sum(r["compute_time"] for r in results)
+    aggregate = {
+        "files": len(results),
+        "duration": duration,
+        "wall_time": sum(r["wall_time"] for r in results),
+        "compute_time": compute,
+        "rtf": compute/duration if duration else None,
+        "time_to_first_token": percentiles([s.time_to_first_token for s in all_stats if s.time_to_first_token is not None]),
+        "first_token_latency": percentiles([s.first_token_latency for s in all_stats if s.first_token_latency is not None]),
+        "commit_lag": percentiles([x for s in all_stats for x in s.lags]),
+        "process_iter": percentiles([x for s in all_stats for x in s.compute_times[:-1]]),
+        "words": sum(r["words"] for r in results),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages.summary(),
+    }
+    if hasattr(asr, "close"):
+        asr.close()
+    if jsonl is not None:
+        jsonl.close()
+    return {
+        "config": dict(vars(args), mode=mode, start_at=start_at),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()},
+        "files": results,
+        "aggregate": aggregate,
+    }
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Replays audio files through the streaming processor and reports latency and real-time factor as JSON.")
+    parser.add_argument('corpus', type=str, nargs='+', help="Audio files, or directories with .wav (.flac, .ogg) files.")
+    add_shared_args(parser)
+    parser.add_argument('--mode', type=str, default="comp_unaware", choices=["comp_unaware", "online", "offline"], help='Simulation mode, see whisper_online.simulate. comp_unaware is the fastest, online replays in real time.')
+    parser.add_argument('--start_at', type=float, default=0.0, help='Start processing each file at this time.')
+    parser.add_argument('--report', type=str, default=None, help='Write the JSON report to this file. Default: stdout.')
+    args = parser.parse_args()
+
+    set_logging(args, logger, other="")
+    set_audio_cache(args.audio_cache_dir, int(args.audio_cache_size*1024**2))
+
+    files = corpus_files(args.corpus)
+    if not files:
+        logger.error("No audio files in the corpus. Exiting.")
+        sys.exit(1)
+
+    report = run_benchmark(args, files, mode=args.mode, start_at=args.start_at)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import os
+import json
+import tempfile
+import logging
+from bisect import bisect_right
+
+logger = logging.getLogger(__name__)
+
+
+class CommittedTranscript:
+    '''Committed words of OnlineASRProcessor, with bounded memory.
+
+    Only the words that are needed for processing are kept in memory: the ones inside of the audio buffer,
+    and the ones before it that make the prompt (200 characters). When the audio buffer is trimmed, the older
+    words are appended to a log file (JSON lines [beg, end, "text"]) and dropped from memory. The whole
+    transcript can be still read by export().
+
+    If log_path is given, the log is kept after close(), with all the words, and it's appended to, so one file
+    can collect the transcript of a whole session. Otherwise, a temporary log is used and removed on close().
+    '''
+
+    PROMPT_CHARS = 200
+
+    def __init__(self, sep, log_path=None, spill_min_words=500):
+        """sep: the separator of words, asr.sep
+        log_path: where to store the words that don't fit to memory
+        spill_min_words: the words are written to the log in batches of at least this size
+        """
+        self.sep = sep
+        self.log_path = log_path
+        self.spill_min_words = spill_min_words
+
+        self.words = []
+        self.ends = []  # end timestamps of self.words, non-decreasing, for bisect
+        self.spilled = 0  # number of words in the log
+
+        self._log = None
+        self._tmp_path = None
+        self._prompt_cache = (None, "")
+
+    def __len__(self):
+        return self.spilled + len(self.words)
+
+    def extend(self, words):
+        for w in words:
+            end = w[1]
+            if self.ends and end < self.ends[-1]:
+                end = self.ends[-1]
+            self.words.append(w)
+            self.ends.append(end)
+
+    def last(self):
+        return self.words[-1] if self.words else None
+
+    def _split(self, time):
+        """index of the first word in memory that ends after time"""
+        return bisect_right(self.ends, time)
+
+    def since(self, time):
+        """the words that end after time"""
+        return self.words[self._split(time):]
+
+    def _prompt_start(self, k):
+        l = 0
+        p = k
+        while p > 0 and l < self.PROMPT_CHARS:
+            p -= 1
+            l += len(self.words[p][2])+1
+        return p
+
+    def _prompt_end(self, time):
+        return min(self._split(time), max(0, len(self.words)-1))
+
+    def prompt(self, time):
+        """Returns a tuple: (prompt, context), where "prompt" is a 200-character suffix of the words that end before time,
+        and "context" are the words after it. The last word is never in the prompt.
+        """
+        k = self._prompt_end(time)
+        key = self.spilled + k
+        if self._prompt_cache[0] != key:
+            p = self._prompt_start(k)
+            self._prompt_cache = (key, self.sep.join(w[2] for w in self.words[p:k]))
+        return self._prompt_cache[1], self.sep.join(w[2] for w in self.words[k:])
+
+    def trim(self, time):
+        """The audio before time won't be processed again. The words before the prompt are moved to the log."""
+        p = self._prompt_start(self._prompt_end(time))
+        if p >= self.spill_min_words:
+            self._spill(p)
+
+    def restart(self):
+        """Starts a new part of the same stream, e.g. after a pause found by VAD. The words in memory are moved
+        to the log, so the new part starts without a prompt, and export() still yields them."""
+        if self.words:
+            self._spill(len(self.words))
+
+    def _spill(self, n):
+        if self._log is None:
+            if self.log_path is None:
+                fd, self._tmp_path = tempfile.mkstemp(prefix="commited-", suffix=".jsonl")
+                self._log = os.fdopen(fd, "w", encoding="utf-8")
+            else:
+                self._log = open(self.log_path, "a", encoding="utf-8")
+        for w in self.words[:n]:
+            self._log.write(json.dumps([float(w[0]), float(w[1]), w[2]], ensure_ascii=False)+"\n")
+        self._log.flush()
+        del self.words[:n]
+        del self.ends[:n]
+        self.spilled += n
+        logger.debug(f"{n} commited words moved to the log, {len(self.words)} in memory")
+
+    def export(self):
+        """Yields all the commited words (beg, end, text), from the log and then from memory.
+        A log given by log_path contains also the words of the previous objects that used it.
+        """
+        path = self.log_path if self.log_path is not None else self._tmp_path
+        if path is not None and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    yield tuple(json.loads(line))
+        for w in self.words:
+            yield (w[0], w[1], w[2])
+
+    def close(self):
+        """Releases the log. A user's log gets the rest of the words, a temporary one is removed."""
+        if self.log_path is not None:
+            if self.words:
+                self._spill(len(self.words))
+            if self._log is not None:
+                self._log.close()
+        elif self._log is not None:
+            self._log.close()
+            os.unlink(self._tmp_path)
+            self._tmp_path = None
+        self._log = None
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""Length-prefixed framing of messages over a socket.
+
+Every message is one frame:
+
+  - 1 byte: message type (MSG_AUDIO, MSG_TEXT, MSG_END, MSG_CONFIG)
+
+  - 4 bytes: payload length, unsigned big-endian
+
+  - payload
+
+The client sends MSG_AUDIO frames with raw audio, and MSG_END when the stream is over. The server sends MSG_TEXT
+frames with the UTF-8 transcript lines, and MSG_END after the last one. Before the first audio, the client may
+send MSG_CONFIG with a JSON object that describes its audio, e.g. {"sample_rate": 48000, "channels": 2,
+"format": "s16le"}. Otherwise, the server expects the format of its command-line options. Unlike line_packet, there is no padding,
+and the frames may be split or merged by TCP arbitrarily.
+"""
+
+import struct
+
+MSG_AUDIO = 1
+MSG_TEXT = 2
+MSG_END = 3
+MSG_CONFIG = 4
+
+HEADER = struct.Struct("!BI")
+MAX_PAYLOAD = 16*1024*1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def send_frame(socket, msg_type, payload=b""):
+    """Sends one frame. payload: bytes-like object"""
+    socket.sendall(HEADER.pack(msg_type, len(payload)) + payload)
+
+
+def send_text(socket, text):
+    send_frame(socket, MSG_TEXT, text.encode("utf-8", errors="replace"))
+
+
+class FrameReader:
+    """Receives the frames from a socket incrementally.
+
+    It receives with recv_into into one preallocated buffer and returns the payloads as memoryviews of it,
+    without copying. A payload is valid only until the next call of read_frame.
+    """
+
+    def __init__(self, socket, bufsize=65536):
+        self.socket = socket
+        self.buf = bytearray(bufsize)
+        self.beg = 0  # start of the unread data
+        self.end = 0  # end of the received data
+
+    def _receive(self, need):
+        """receives until at least `need` bytes are unread. Returns False if the connection was closed."""
+        if self.beg == self.end:
+            self.beg = self.end = 0
+        if self.beg + need > len(self.buf):
+            # move the unread data to the beginning, or to a larger buffer
+            unread = self.end - self.beg
+            if need > len(self.buf):
+                buf = bytearray(max(need, 2*len(self.buf)))
+            else:
+                buf = self.buf
+            buf[:unread] = self.buf[self.beg:self.end]
+            self.buf = buf
+            self.beg, self.end = 0, unread
+        with memoryview(self.buf) as view:
+            while self.end - self.beg < need:
+                n = self.socket.recv_into(view[self.end:])
+                if n == 0:
+                    return False
+                self.end += n
+        return True
+
+    def read_frame(self):
+        """Returns a tuple (msg_type, payload memoryview), or None if the connection was closed."""
+        if not self._receive(HEADER.size):
+            return None
+        msg_type, length = HEADER.unpack_from(self.buf, self.beg)
+        if length > MAX_PAYLOAD:
+            raise ProtocolError(f"frame payload too long: {length} bytes")
+        if not self._receive(HEADER.size + length):
+            return None
+        beg = self.beg + HEADER.size
+        self.beg = beg + length
+        return msg_type, memoryview(self.buf)[beg:beg+length]
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import json
+import math
+import time
+import itertools
+import threading
+from bisect import bisect_left
+
+
+class IterationTimer:
+    '''Times the stages of one OnlineASRProcessor.process_iter call. lap(stage) ends the stage that started with the
+    previous lap (or with the iteration), and done() sends the record to the collector.'''
+
+    __slots__ = ("collector", "stream", "start", "last", "stages")
+
+    def __init__(self, collector, stream):
+        self.collector = collector
+        self.stream = stream
+        self.start = self.last = time.perf_counter()
+        self.stages = {}
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def done(self, **info):
+        rec = {"time": time.time(), "stream": self.stream, "total": time.perf_counter() - self.start, "stages": self.stages}
+        rec.update(info)
+        self.collector.record(rec)
+
+
+class Instrumentation:
+    '''Collector of the per-iteration records of OnlineASRProcessor.process_iter, e.g. for benchmark.py.
+
+    The processor gets it as `instrumentation` (see online_factory). In every iteration, it sends a record dict:
+      - time: wall clock time, stream: id of the processor
+      - total: duration of process_iter in seconds, stages: {stage: seconds}, the stages are prompt, features
+        (with the feature cache), transcribe, ts_words, insert, flush and trim
+      - buffer: length of the audio buffer in seconds, offset: its start time in the stream
+      - prompt_chars: length of the prompt, committed: number of the newly committed words,
+        committed_total: number of all the committed words of the stream, including the ones moved to the log of
+        CommittedTranscript, trimmed: seconds trimmed from the audio buffer
+
+    This one passes the records to the callback. Without instrumentation, the processor only checks for None.
+    One collector can be shared by more processors in more threads.
+    '''
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._streams = itertools.count()
+
+    def new_stream(self):
+        """Returns a new stream id, for one processor."""
+        return next(self._streams)
+
+    def iteration(self, stream):
+        return IterationTimer(self, stream)
+
+    def record(self, rec):
+        if self.callback is not None:
+            self.callback(rec)
+
+    def close(self):
+        pass
+
+
+class JSONLCollector(Instrumentation):
+    '''Writes the records into a file as JSON lines.'''
+
+    def __init__(self, path):
+        super().__init__()
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def record(self, rec):
+        line = json.dumps(rec, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class Histogram:
+    '''Log-scale histogram of positive values (e.g. durations), with 10 buckets per decade.'''
+
+    __slots__ = ("edges", "counts", "count", "sum", "max")
+
+    def __init__(self, low=1e-6, high=1e3, per_decade=10):
+        decades = math.log10(high/low)
+        self.edges = [low*10**(i/per_decade) for i in range(int(decades*per_decade) + 1)]
+        self.counts = [0]*(len(self.edges) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.edges, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """upper edge of the bucket of the q-quantile"""
+        if not self.count:
+            return None
+        rank = q*self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return min(self.edges[i], self.max) if i < len(self.edges) else self.max
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return None
+        return {"count": self.count, "mean": self.sum/self.count, "p50": self.quantile(0.5),
+                "p90": self.quantile(0.9), "p99": self.quantile(0.99), "max": self.max}
+
+
+class HistogramCollector(Instrumentation):
+    '''Keeps the histograms of the stage durations and of the other numbers of the records in memory.'''
+
+    VALUES = ("buffer", "prompt_chars", "committed", "trimmed")
+
+    def __init__(self, callback=None):
+        super().__init__(callback)
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.iterations = 0
+        self.trims = 0
+
+    def _add(self, name, value):
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = Histogram()
+        h.add(value)
+
+    def record(self, rec):
+        with self.lock:
+            self.iterations += 1
+            self._add("total", rec["total"])
+            for stage, t in rec["stages"].items():
+                self._add("stage." + stage, t)
+            for name in self.VALUES:
+                v = rec.get(name)
+                if v:
+                    self._add(name, v)
+            if rec.get("trimmed"):
+                self.trims += 1
+        super().record(rec)
+
+    def summary(self):
+        """Returns {"iterations", "trims", name: {count, mean, p50, p90, p99, max}}. The percentiles are bucket edges,
+        accurate to about 26%. The zeros of the other values (e.g. no trimming) are not counted."""
+        with self.lock:
+            out = {"iterations": self.iterations, "trims": self.trims}
+            for name, h in sorted(self.histograms.items()):
+                out[name] = h.summary()
+            return out
@@ -64,7 +64,7 @@ def receive_one_line(socket):
         A string representing a single line with a terminating newline or
         None if the connection has been closed.
     """
-    data = b''
+    data = bytearray()  # appending to bytes would copy all the data received so far
     while True:
         packet = socket.recv(PACKET_SIZE)
         if not packet:  # Connection has been closed.
@@ -91,3 +91,31 @@ def receive_lines(socket):
     if len(lines)==1 and not lines[0]:
         return None
     return lines
+
+
+class LineReceiver:
+    """Receives lines from a socket. Unlike receive_lines, it keeps the incomplete
+    last line of a packet and completes it by the next packets.
+    """
+
+    def __init__(self, socket):
+        self.socket = socket
+        self.pending = bytearray()
+
+    def receive_lines(self):
+        """Returns the list of complete lines that are available, [] if there is none
+        yet (for non-blocking socket), or None if the connection has been closed."""
+        try:
+            data = self.socket.recv(PACKET_SIZE)
+        except BlockingIOError:
+            return []
+        if not data:  # Connection has been closed.
+            return None
+        self.pending += data.replace(b'\0', b'')
+        end = self.pending.rfind(b'\n')
+        if end < 0:
+            return []
+        complete = self.pending[:end]
+        del self.pending[:end+1]
+        # TODO Is there a better way of handling bad input than 'replace'?
+        return complete.decode('utf-8', errors='replace').split('\n')
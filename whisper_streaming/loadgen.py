@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""Load generator for the transcription servers, to size the nodes before rollouts.
+
+  - `server`: N concurrent simulated microphone streams against whisper_online_server.py. Each stream sends the
+    raw PCM16 of a local wav file at real time, in the raw or framed protocol, and receives the transcript lines.
+
+  - `transcribe`: concurrent uploads of the wav files to the /transcribe endpoint of backend/main.py.
+
+It reports the transcript latency percentiles (p50, p95, p99), dropped connections, the growth of the server-side
+lag during the streams, and the throughput in seconds of audio per second of wall time, as JSON. The server can
+run with the real model or with `--backend stub`.
+
+    python3 loadgen.py server corpus_dir/ --port 43007 --streams 16
+    python3 loadgen.py transcribe corpus_dir/ --url http://localhost:8000/transcribe --concurrency 4 --requests 40
+"""
+import sys
+import os
+import io
+import json
+import time
+import uuid
+import wave
+import socket
+import logging
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import line_packet
+import frame_protocol
+
+logger = logging.getLogger(__name__)
+
+
+def corpus_files(paths):
+    """the wav files and the wav files in the directories, sorted"""
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                files.extend(os.path.join(root, n) for n in names if n.lower().endswith(".wav"))
+        else:
+            files.append(p)
+    return sorted(files)
+
+
+def read_wav(fname, max_seconds=None):
+    """Returns (PCM16 bytes, sampling rate, channels) of a 16-bit wav file."""
+    with wave.open(fname, "rb") as w:
+        if w.getsampwidth() != 2:
+            raise ValueError(f"{fname}: only 16-bit PCM wav files are supported")
+        frames = w.getnframes()
+        if max_seconds is not None:
+            frames = min(frames, int(max_seconds*w.getframerate()))
+        return w.readframes(frames), w.getframerate(), w.getnchannels()
+
+
+def percentiles(values, ps=(50, 95, 99)):
+    if not values:
+        return None
+    a = np.asarray(values, dtype=np.float64)
+    stats = {f"p{p}": float(np.percentile(a, p)) for p in ps}
+    stats.update(mean=float(a.mean()), max=float(a.max()), count=len(a))
+    return stats
+
+
+# server streams
+
+class Stream:
+    '''One simulated microphone stream. The audio is sent at real time from self.start, so its audio time t is
+    sent at about self.start + t, and the latency of a transcript line is its receive time minus that of its end.
+    '''
+
+    def __init__(self, index, fname, pcm, sample_rate, channels):
+        self.index = index
+        self.fname = fname
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.duration = len(pcm)/(2*sample_rate*channels)
+        self.start = None
+        self.sent = 0.0  # seconds of audio
+        self.latencies = []  # (audio end time of the line, latency)
+        self.lines = 0
+        self.error = None
+        self.complete = False  # all the audio was sent and the server finished the stream
+
+    def _parse_line(self, line, now):
+        parts = line.split(" ", 2)
+        if len(parts) < 2:
+            return
+        try:
+            end = float(parts[1])/1000
+        except ValueError:
+            return
+        self.lines += 1
+        self.latencies.append((end, now - self.start - end))
+
+    def _receive(self, sock, protocol):
+        # returns True if the server ended the stream properly (closed it in raw protocol, MSG_END in framed)
+        if protocol == "framed":
+            reader = frame_protocol.FrameReader(sock)
+            while True:
+                frame = reader.read_frame()
+                if frame is None:
+                    return False
+                msg_type, payload = frame
+                if msg_type == frame_protocol.MSG_END:
+                    return True
+                if msg_type == frame_protocol.MSG_TEXT:
+                    self._parse_line(bytes(payload).decode("utf-8", errors="replace"), time.time())
+        else:
+            receiver = line_packet.LineReceiver(sock)
+            while True:
+                lines = receiver.receive_lines()
+                if lines is None:
+                    return True
+                now = time.time()
+                for line in lines:
+                    self._parse_line(line, now)
+
+    def run(self, host, port, protocol="raw", chunk=0.1, timeout=60.0):
+        try:
+            sock = socket.create_connection((host, port), timeout=timeout)
+        except OSError as e:
+            self.error = f"connect: {e}"
+            return
+        result = {}
+
+        def receive():
+            try:
+                result["ended"] = self._receive(sock, protocol)
+            except OSError as e:
+                result["error"] = f"receive: {e}"
+
+        receiver = threading.Thread(target=receive, name=f"loadgen-recv-{self.index}", daemon=True)
+        try:
+            if protocol == "framed":
+                config = {"sample_rate": self.sample_rate, "channels": self.channels, "format": "s16le"}
+                frame_protocol.send_frame(sock, frame_protocol.MSG_CONFIG, json.dumps(config).encode("utf-8"))
+            receiver.start()
+            chunk_bytes = 2*self.channels*max(1, int(chunk*self.sample_rate))
+            bytes_per_second = 2*self.channels*self.sample_rate
+            self.start = time.time()
+            for off in range(0, len(self.pcm), chunk_bytes):
+                data = self.pcm[off:off+chunk_bytes]
+                # like a microphone, the chunk is available when its last sample was recorded
+                wait = self.start + (off + len(data))/bytes_per_second - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                if not receiver.is_alive():
+                    raise ConnectionError("the server closed the connection")
+                if protocol == "framed":
+                    frame_protocol.send_frame(sock, frame_protocol.MSG_AUDIO, data)
+                else:
+                    sock.sendall(data)
+                self.sent = (off + len(data))/bytes_per_second
+            if protocol == "framed":
+                frame_protocol.send_frame(sock, frame_protocol.MSG_END)
+            else:
+                sock.shutdown(socket.SHUT_WR)
+            receiver.join(timeout)
+            if receiver.is_alive():
+                self.error = "timeout waiting for the rest of the transcript"
+            elif "error" in result:
+                self.error = result["error"]
+            elif not result.get("ended"):
+                self.error = "the server closed the connection before the end of the transcript"
+            else:
+                self.complete = True
+        except OSError as e:  # includes ConnectionError
+            self.error = f"send: {e}"
+        finally:
+            sock.close()
+
+    def lag_growth(self):
+        """slope of the latency over the audio time: seconds of lag gained per second of audio"""
+        if len(self.latencies) < 3:
+            return None
+        t, lat = np.asarray(self.latencies, dtype=np.float64).T
+        if t.max() - t.min() < 1.0:
+            return None
+        return float(np.polyfit(t, lat, 1)[0])
+
+    def report(self):
+        return {
+            "stream": self.index,
+            "file": self.fname,
+            "duration": self.duration,
+            "sent": self.sent,
+            "complete": self.complete,
+            "error": self.error,
+            "lines": self.lines,
+            "latency": percentiles([lat for _, lat in self.latencies]),
+            "lag_growth": self.lag_growth(),
+        }
+
+
+def load_server(args, files):
+    audio = {f: read_wav(f, args.max_audio) for f in files}
+    streams = []
+    for i in range(args.streams):
+        fname = files[i % len(files)]
+        streams.append(Stream(i, fname, *audio[fname]))
+    threads = []
+    t = time.time()
+    for s in streams:
+        th = threading.Thread(target=s.run, args=(args.host, args.port, args.protocol, args.chunk, args.timeout), name=f"loadgen-{s.index}")
+        th.start()
+        threads.append(th)
+        if args.ramp:
+            time.sleep(args.ramp)
+    for th in threads:
+        th.join()
+    wall_time = time.time() - t
+
+    reports = [s.report() for s in streams]
+    growth = [r["lag_growth"] for r in reports if r["lag_growth"] is not None]
+    audio_seconds = sum(s.sent for s in streams)
+    return {
+        "target": "server",
+        "config": vars(args),
+        "streams": reports,
+        "aggregate": {
+            "streams": len(streams),
+            "complete": sum(s.complete for s in streams),
+            "dropped": sum(s.error is not None for s in streams),
+            "latency": percentiles([lat for s in streams for _, lat in s.latencies]),
+            "lag_growth": percentiles(growth),
+            "audio_seconds": audio_seconds,
+            "wall_time": wall_time,
+            "throughput": audio_seconds/wall_time if wall_time else None,
+        },
+    }
+
+
+# backend /transcribe uploads
+
+def post_file(url, fname, data, language=None, timeout=300.0):
+    """Uploads the file to /transcribe as multipart/form-data. Returns (HTTP status, response body)."""
+    u = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(u.query))
+    if language:
+        query["language"] = language
+    path = (u.path or "/") + ("?" + urllib.parse.urlencode(query) if query else "")
+
+    boundary = uuid.uuid4().hex
+    name = os.path.basename(fname).replace('"', "")
+    body = io.BytesIO()
+    body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\nContent-Type: audio/wav\r\n\r\n'.encode("utf-8"))
+    body.write(data)
+    body.write(f"\r\n--{boundary}--\r\n".encode("utf-8"))
+
+    conn_cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(u.hostname, u.port, timeout=timeout)
+    try:
+        conn.request("POST", path, body.getvalue(), headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+def wav_duration(fname):
+    try:
+        with wave.open(fname, "rb") as w:
+            return w.getnframes()/w.getframerate()
+    except (wave.Error, EOFError):
+        return None
+
+
+def load_transcribe(args, files):
+    uploads = {f: (open(f, "rb").read(), wav_duration(f)) for f in files}
+    results = []
+    lock = threading.Lock()
+
+    def upload(i):
+        fname = files[i % len(files)]
+        data, duration = uploads[fname]
+        t = time.time()
+        try:
+            status, _ = post_file(args.url, fname, data, args.language, args.timeout)
+            error = None if status == 200 else f"HTTP {status}"
+        except (OSError, http.client.HTTPException) as e:
+            status, error = None, f"{type(e).__name__}: {e}"
+        r = {"request": i, "file": fname, "status": status, "error": error, "latency": time.time() - t, "duration": duration}
+        with lock:
+            results.append(r)
+        logger.debug(f"request {i}: {status} in {r['latency']:.2f} s")
+
+    t = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="loadgen") as pool:
+        list(pool.map(upload, range(args.requests)))
+    wall_time = time.time() - t
+
+    ok = [r for r in results if r["error"] is None]
+    errors = {}
+    for r in results:
+        if r["error"] is not None:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    audio_seconds = sum(r["duration"] or 0 for r in ok)
+    return {
+        "target": "transcribe",
+        "config": vars(args),
+        "requests": sorted(results, key=lambda r: r["request"]),
+        "aggregate": {
+            "requests": len(results),
+            "ok": len(ok),
+            "errors": errors,
+            "latency": percentiles([r["latency"] for r in ok]),
+            "audio_seconds": audio_seconds,
+            "wall_time": wall_time,
+            "throughput": audio_seconds/wall_time if wall_time else None,
+        },
+    }
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Load generator for whisper_online_server.py and backend /transcribe.")
+    parser.add_argument("-l", "--log-level", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help="Set the log level", default='INFO')
+    parser.add_argument('--report', type=str, default=None, help='Write the JSON report to this file. Default: stdout.')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Socket timeout in seconds, and the time to wait for the rest of the transcript after the stream.')
+    sub = parser.add_subparsers(dest="target", required=True)
+
+    p = sub.add_parser("server", help="Concurrent real-time audio streams to whisper_online_server.py.")
+    p.add_argument('corpus', type=str, nargs='+', help="16-bit wav files, or directories with them. The streams use them in turn.")
+    p.add_argument("--host", type=str, default='localhost')
+    p.add_argument("--port", type=int, default=43007)
+    p.add_argument("--protocol", type=str, default="raw", choices=["raw", "framed"], help="The protocol of the server. In the raw protocol, the wav files must match the server's --client-sample-rate and --client-channels.")
+    p.add_argument("--streams", type=int, default=4, help="Number of concurrent streams.")
+    p.add_argument("--ramp", type=float, default=0.0, help="Delay in seconds between the starts of the streams.")
+    p.add_argument("--chunk", type=float, default=0.1, help="Audio sent at once, in seconds.")
+    p.add_argument("--max-audio", type=float, default=None, dest="max_audio", help="Send at most this many seconds of each file.")
+
+    p = sub.add_parser("transcribe", help="Concurrent uploads to the /transcribe endpoint of backend/main.py.")
+    p.add_argument('corpus', type=str, nargs='+', help="Audio files, or directories with wav files. The requests use them in turn.")
+    p.add_argument("--url", type=str, default="http://localhost:8000/transcribe")
+    p.add_argument("--language", type=str, default=None)
+    p.add_argument("--concurrency", type=int, default=4, help="Number of concurrent requests.")
+    p.add_argument("--requests", type=int, default=20, help="Total number of requests.")
+
+    args = parser.parse_args()
+    logging.basicConfig(format='%(levelname)s\t%(message)s')
+    logger.setLevel(args.log_level)
+
+    files = corpus_files(args.corpus)
+    if not files:
+        logger.error("No audio files in the corpus. Exiting.")
+        sys.exit(1)
+
+    if args.target == "server":
+        report = load_server(args, files)
+    else:
+        report = load_transcribe(args, files)
+    agg = report["aggregate"]
+    logger.info(f"throughput {agg['throughput'] or 0:.2f} audio-s/s, latency p95 {(agg['latency'] or {}).get('p95', float('nan')):.2f} s")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
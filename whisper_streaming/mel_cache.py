@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import numpy as np
+import librosa
+
+
+class LogMelCache:
+    '''Incremental log-mel features of the audio buffer of one session.
+
+    OnlineASRProcessor sends the whole audio buffer to Whisper in every iteration, so most of its features were
+    already computed in the previous ones. This cache keeps the log-mel frames by their absolute position in the
+    stream, and computes only the frames of the new tail. It produces the same features as Whisper's front end
+    (STFT with n_fft=400 and hop=160 of the audio padded by 160 zeros, centered with reflection, without the
+    last frame, then log10 of the mel spectrogram, clamped to max-8 and scaled).
+
+    Only the frames that depend on the audio samples alone are cached. The first two frames of the buffer
+    (in the reflected padding) and the frames at its end (in the zero padding) are computed in every call.
+    The normalization depends on the maximum of the whole buffer, so it is applied in every call, too.
+
+    The cached frames stay valid while the buffer start moves by multiples of hop_length. Otherwise, the cache
+    is started again from the new position.
+    '''
+
+    def __init__(self, n_mels=80, sampling_rate=16000, n_fft=400, hop_length=160, padding=160):
+        self.n_fft = n_fft
+        self.hop = hop_length
+        self.padding = padding
+        self.half = n_fft//2
+        self.window = np.hanning(n_fft+1)[:-1].astype(np.float32)
+        self.mel_filters = librosa.filters.mel(sr=sampling_rate, n_fft=n_fft, n_mels=n_mels).astype(np.float32)
+        self.reset()
+
+    def reset(self, origin=0):
+        """origin: absolute sample position of the frame 0"""
+        self.origin = origin
+        self.frames = np.zeros((self.mel_filters.shape[0], 0), dtype=np.float32)
+        self.first = 0  # absolute index (from origin) of the first cached frame
+
+    def evict(self, position):
+        """The audio before the absolute sample position was removed from the buffer."""
+        if (position - self.origin) % self.hop:
+            self.reset(position)
+            return
+        # the first frames of the buffer will be in the reflected padding
+        first = (position - self.origin)//self.hop + (self.half + self.hop - 1)//self.hop
+        drop = min(max(0, first - self.first), self.frames.shape[1])
+        self.frames = self.frames[:, drop:]
+        self.first += drop
+
+    def _log_mel(self, padded, j_beg, j_end):
+        """log10 mel of the frames j_beg..j_end-1 of the padded and centered signal"""
+        if j_end <= j_beg:
+            return np.zeros((self.mel_filters.shape[0], 0), dtype=np.float32)
+        seg = padded[j_beg*self.hop:(j_end-1)*self.hop+self.n_fft]
+        frames = np.lib.stride_tricks.sliding_window_view(seg, self.n_fft)[::self.hop]
+        spec = np.fft.rfft(frames*self.window, axis=-1)
+        power = (spec.real**2 + spec.imag**2).astype(np.float32)
+        mel = self.mel_filters @ power.T
+        return np.log10(np.maximum(mel, 1e-10))
+
+    def features(self, audio, position):
+        """audio: float32 audio buffer
+        position: absolute sample position of audio[0]
+        Returns: normalized log-mel features, shape (n_mels, frames), the same as Whisper's front end
+        """
+        if (position - self.origin) % self.hop:
+            self.reset(position)
+        n = len(audio)
+        n_frames = (n + self.padding)//self.hop
+        padded = np.pad(np.pad(audio.astype(np.float32, copy=False), (0, self.padding)), self.half, mode="reflect")
+
+        base = (position - self.origin)//self.hop  # absolute index of the frame 0 of this buffer
+        head = min(n_frames, (self.half + self.hop - 1)//self.hop)  # frames that reach into the reflected beginning
+        tail = max(head, min(n_frames, (n - self.half)//self.hop + 1))  # frames from here reach behind the audio
+
+        # the cached frames must follow the head of this buffer
+        if self.frames.shape[1] and not (self.first <= base + head <= self.first + self.frames.shape[1]):
+            self.reset(position)
+            base = 0
+        if not self.frames.shape[1]:
+            self.first = base + head
+        cached_end = self.first + self.frames.shape[1]
+        if base + tail > cached_end:
+            new = self._log_mel(padded, cached_end - base, tail)
+            self.frames = np.concatenate([self.frames, new], axis=1)
+
+        interior = self.frames[:, base + head - self.first:base + tail - self.first]
+        log_spec = np.concatenate([
+            self._log_mel(padded, 0, head),
+            interior,
+            self._log_mel(padded, tail, n_frames)], axis=1)
+        log_spec = np.maximum(log_spec, log_spec.max() - 8.0)
+        return (log_spec + 4.0)/4.0
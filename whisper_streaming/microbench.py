@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks of the streaming hot paths, without model inference.
+
+Each benchmark runs one operation of the pipeline that is repeated dozens of times a second per session (one
+iteration of HypothesisBuffer, an audio chunk for OnlineASRProcessor or VAD, a line over a socket), and measures
+its time with timeit. The results can be stored as a baseline and compared with it later:
+
+    python3 microbench.py --save-baseline microbench_baseline.json
+    python3 microbench.py --baseline microbench_baseline.json --threshold 0.2
+
+With --baseline, the benchmarks that are slower than the baseline by more than the threshold are reported as
+regressions, and the exit code is 1. The baseline is specific to the machine, so it's not part of the repository.
+"""
+import sys
+import os
+import re
+import json
+import socket
+import timeit
+import atexit
+import logging
+import platform
+
+import numpy as np
+
+from whisper_online import HypothesisBuffer, OnlineASRProcessor, StubASR
+import line_packet
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark. The decorated function prepares it and returns the operation, a function without arguments.
+    If the operation has a close attribute, it's called after the measurement."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def synthetic_words(n, seed=0):
+    """n words with their times, (beg, end, text), about 3 words a second"""
+    rng = np.random.default_rng(seed)
+    vocabulary = StubASR.VOCABULARY
+    words = []
+    t = 0.0
+    for i in range(n):
+        d = float(rng.uniform(0.15, 0.5))
+        text = vocabulary[int(rng.integers(len(vocabulary)))]
+        if i % 12 == 11:
+            text += "."
+        words.append((round(t, 2), round(t + d, 2), " " + text))
+        t += d + float(rng.uniform(0.02, 0.2))
+    return words
+
+
+# the log of the benchmarked objects, opened once so the iterations don't open files
+_DEVNULL = open(os.devnull, "w")
+atexit.register(_DEVNULL.close)
+
+
+@benchmark("hypothesis_buffer.iteration")
+def bench_hypothesis_buffer():
+    # the hypotheses of consecutive iterations over a sliding 15 s buffer: the words agree except the last one
+    words = synthetic_words(6000)
+    hypotheses = []
+    offset = 0.0
+    now = 1.0
+    i0 = 0
+    while now < words[-1][1]:
+        while words[i0][0] < offset:
+            i0 += 1
+        hyp = [(b - offset, e - offset, t) for b, e, t in words[i0:] if e <= now]
+        if hyp and len(hypotheses) % 2:
+            b, e, t = hyp[-1]
+            hyp[-1] = (b, e, t + "s")  # unstable last word
+        trim = offset + 10.0 if now - offset > 15.0 else None
+        hypotheses.append((hyp, offset, trim))
+        if trim is not None:
+            offset = trim
+        now += 1.0
+    state = {"i": 0, "buffer": HypothesisBuffer(logfile=_DEVNULL)}
+
+    def op():
+        i = state["i"]
+        if i == len(hypotheses):
+            i = 0
+            state["buffer"] = HypothesisBuffer(logfile=_DEVNULL)
+        hyp, offset, trim = hypotheses[i]
+        buf = state["buffer"]
+        buf.insert(hyp, offset)
+        buf.flush()
+        if trim is not None:
+            buf.pop_commited(trim)
+        state["i"] = i + 1
+    return op
+
+
+def _online(tokenizer=None):
+    return OnlineASRProcessor(StubASR(), tokenizer, logfile=_DEVNULL)
+
+
+@benchmark("online.insert_audio_chunk")
+def bench_insert_audio_chunk():
+    online = _online()
+    chunk = np.random.default_rng(0).standard_normal(int(0.04*SAMPLING_RATE)).astype(np.float32)*0.1
+
+    def op():
+        online.insert_audio_chunk(chunk)
+        if len(online.audio_buffer) > 30*SAMPLING_RATE:
+            online.audio_buffer.drop(15*SAMPLING_RATE)
+    return op
+
+
+@benchmark("online.chunk_at")
+def bench_chunk_at():
+    # 1 second of audio is added and trimmed in each operation, the buffer stays at 15 s
+    online = _online()
+    second = np.random.default_rng(0).standard_normal(SAMPLING_RATE).astype(np.float32)*0.1
+    for _ in range(15):
+        online.insert_audio_chunk(second)
+
+    def op():
+        online.insert_audio_chunk(second)
+        online.chunk_at(online.buffer_time_offset + 1.0)
+    return op
+
+
+class SentenceTokenizer:
+    """splits sentences after . ! ?, like the tokenizers of create_tokenizer"""
+
+    def split(self, text):
+        return [s for s in re.split(r"(?<=[.!?])\s+", text) if s]
+
+
+@benchmark("online.words_to_sentences")
+def bench_words_to_sentences():
+    online = _online(SentenceTokenizer())
+    words = synthetic_words(60)
+
+    def op():
+        online.words_to_sentences(words)
+    return op
+
+
+class StubVADModel:
+    """constant speech probability, with the interface of the Silero model"""
+
+    def __init__(self, prob=0.7):
+        import torch
+        self.prob = torch.tensor([[prob]])
+
+    def __call__(self, x, sr):
+        return self.prob
+
+    def reset_states(self):
+        pass
+
+
+@benchmark("vad.fixed_iterator")
+def bench_fixed_vad_iterator():
+    from silero_vad_iterator import FixedVADIterator
+    vad = FixedVADIterator(StubVADModel())
+    chunk = np.random.default_rng(0).standard_normal(int(0.04*SAMPLING_RATE)).astype(np.float32)*0.1
+
+    def op():
+        vad(chunk)
+    return op
+
+
+def _socketpair():
+    a, b = socket.socketpair()
+    # one padded packet must fit into the socket buffers, the same thread sends and receives
+    for sock in (a, b):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4*line_packet.PACKET_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*line_packet.PACKET_SIZE)
+    return a, b
+
+
+LINE = "1200 3400 Chairman, thank you. If the debate today had a subject"
+
+
+@benchmark("line_packet.send_receive")
+def bench_line_packet():
+    # padded packets, received by receive_one_line
+    a, b = _socketpair()
+
+    def op():
+        line_packet.send_one_line(a, LINE, pad_zeros=True)
+        line_packet.receive_one_line(b)
+    op.close = lambda: (a.close(), b.close())
+    return op
+
+
+@benchmark("line_packet.line_receiver")
+def bench_line_receiver():
+    # the lines that the server sends, received by LineReceiver
+    a, b = _socketpair()
+    receiver = line_packet.LineReceiver(b)
+
+    def op():
+        line_packet.send_one_line(a, LINE)
+        receiver.receive_lines()
+    op.close = lambda: (a.close(), b.close())
+    return op
+
+
+def measure(op, repeat=5, min_time=0.2):
+    """Returns the best and median time of one op in seconds, and the number of ops per repetition."""
+    timer = timeit.Timer(op)
+    number, _ = timer.autorange()
+    # at least min_time per repetition
+    number = max(1, int(number*max(1.0, min_time/0.2)))
+    times = [t/number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"best": min(times), "median": float(np.median(times)), "number": number}
+
+
+def run(names=None, repeat=5, min_time=0.2):
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        try:
+            op = setup()
+        except ImportError as e:
+            logger.warning(f"{name}: skipped, {e}")
+            results[name] = {"skipped": str(e)}
+            continue
+        try:
+            results[name] = measure(op, repeat=repeat, min_time=min_time)
+        finally:
+            # the resources of the benchmark, e.g. sockets
+            if hasattr(op, "close"):
+                op.close()
+        logger.info(f"{name}: {results[name]['best']*1e6:.2f} us")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns the list of (name, best time, baseline best time, relative change) and the names of the regressions."""
+    rows = []
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name, {})
+        if "best" not in r or "best" not in base:
+            rows.append((name, r.get("best"), base.get("best"), None))
+            continue
+        change = r["best"]/base["best"] - 1
+        rows.append((name, r["best"], base["best"], change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def print_table(rows, regressions, file=sys.stdout):
+    print(f"{'benchmark':32} {'time/op':>12} {'baseline':>12} {'change':>8}", file=file)
+    for name, best, base, change in rows:
+        t = f"{best*1e6:10.2f}us" if best is not None else f"{'skipped':>12}"
+        b = f"{base*1e6:10.2f}us" if base is not None else f"{'-':>12}"
+        c = f"{change*100:+7.1f}%" if change is not None else f"{'':>8}"
+        mark = "  REGRESSION" if name in regressions else ""
+        print(f"{name:32} {t} {b} {c}{mark}", file=file)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the streaming hot paths.")
+    parser.add_argument('names', type=str, nargs='*', help="Run only these benchmarks. Default: all of " + ", ".join(BENCHMARKS))
+    parser.add_argument('--baseline', type=str, default=None, help='JSON file with the baseline results to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown against the baseline that is reported as a regression, e.g. 0.2 = 20%%.')
+    parser.add_argument('--save-baseline', type=str, default=None, dest="save_baseline", help='Store the results as the baseline into this JSON file.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions of each benchmark. The best one is compared.')
+    parser.add_argument('--min-time', type=float, default=0.2, dest="min_time", help='Minimum duration of one repetition in seconds.')
+    parser.add_argument("-l", "--log-level", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help="Set the log level", default='INFO')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s\t%(message)s')
+    logger.setLevel(args.log_level)
+
+    unknown = [n for n in args.names if n not in BENCHMARKS]
+    if unknown:
+        logger.error(f"Unknown benchmarks: {', '.join(unknown)}. Exiting.")
+        sys.exit(2)
+
+    results = run(args.names, repeat=args.repeat, min_time=args.min_time)
+    report = {
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system(), "numpy": np.__version__},
+        "benchmarks": results,
+    }
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["benchmarks"]
+    rows, regressions = compare(results, baseline, args.threshold)
+    print_table(rows, regressions)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"baseline saved to {args.save_baseline}")
+
+    if regressions:
+        logger.error(f"{len(regressions)} regression(s) over {args.threshold*100:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
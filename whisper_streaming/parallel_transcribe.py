@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Parallel transcription of long recordings, for the offline mode of whisper_online.py.
+
+The audio is split at the silences that Silero VAD finds (silero_vad_iterator.VADIterator), into segments of at
+most `max_segment` seconds, which contain only speech. The segments are independent, so they are transcribed in
+parallel by a pool of worker processes, each with its own ASR object (see create_asr), and their outputs are
+put back in order with the absolute timestamps. Without torch, the audio is split at the quietest frames near the
+segment length instead.
+
+Unlike the whole-file transcription, a segment doesn't get the text of the previous one as the prompt.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# the packing of the speech spans is shared with the API, backend/speech_segments.py has no dependencies
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "backend"))
+from speech_segments import pack_segments
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+
+
+def speech_spans(audio, model_path=None, threshold=0.5, min_silence_ms=500, speech_pad_ms=100):
+    """Returns the [(beg, end)] sample ranges of speech by Silero VAD. Raises ImportError without torch."""
+    from silero_vad_iterator import VADIterator
+    from vad_engine import load_silero_vad_model
+
+    vad = VADIterator(load_silero_vad_model(model_path), threshold=threshold, sampling_rate=SAMPLING_RATE,
+                      min_silence_duration_ms=min_silence_ms, speech_pad_ms=speech_pad_ms)
+    W = 512  # the window size of Silero VAD at 16 kHz
+    spans = []
+    start = None
+    for p in range(0, len(audio), W):
+        window = audio[p:p+W]
+        if len(window) < W:
+            window = np.pad(window, (0, W - len(window)))
+        r = vad(np.ascontiguousarray(window, dtype=np.float32))
+        if r is None:
+            continue
+        if "start" in r:
+            start = r["start"]
+        elif "end" in r and start is not None:
+            spans.append((start, min(r["end"], len(audio))))
+            start = None
+    if start is not None:
+        spans.append((start, len(audio)))
+    return spans
+
+
+def quiet_spans(audio, max_len, frame=1600):
+    """Splits the audio into ranges of at most max_len samples at the quietest 100 ms frame of the last quarter of
+    each range. The fallback of speech_spans without VAD."""
+    spans = []
+    beg = 0
+    while len(audio) - beg > max_len:
+        lo = beg + max_len*3//4
+        n = (beg + max_len - lo)//frame
+        if n == 0:
+            # the ranges are too short to look for a quiet frame
+            cut = beg + max_len
+        else:
+            rms = np.sqrt(np.mean(np.square(audio[lo:lo+n*frame].reshape(n, frame)), axis=1))
+            cut = lo + int(np.argmin(rms))*frame + frame//2
+        spans.append((beg, cut))
+        beg = cut
+    spans.append((beg, len(audio)))
+    return spans
+
+
+def split_audio(audio, max_segment=30.0, vad_model_path=None):
+    """[(beg, end)] sample ranges of the segments to transcribe"""
+    max_len = int(max_segment*SAMPLING_RATE)
+    if max_len <= 0:
+        raise ValueError(f"max_segment must be positive, got {max_segment}")
+    try:
+        spans = speech_spans(audio, model_path=vad_model_path)
+    except ImportError as e:
+        logger.warning(f"VAD is not available ({e}), splitting the audio at the quiet frames")
+        return quiet_spans(audio, max_len)
+    return pack_segments(spans, max_len)
+
+
+# the ASR object of a worker process
+_asr = None
+
+
+def _init_worker(args):
+    global _asr
+    from whisper_online import create_asr
+    # the worker processes one segment at a time
+    args = argparse.Namespace(**dict(vars(args), batch_size=1, inference_workers=None))
+    _asr = create_asr(args)
+
+
+def _transcribe_segment(beg, audio, asr=None):
+    """Returns the words of the segment with the absolute times, and the separator of the words."""
+    asr = asr or _asr
+    words = asr.ts_words(asr.transcribe(audio))
+    offset = beg/SAMPLING_RATE
+    return [(offset + b, offset + e, t) for b, e, t in words], asr.sep
+
+
+def transcribe_parallel(args, audio, workers, max_segment=30.0, asr=None, callback=None):
+    """Transcribes the audio in the VAD segments, with `workers` processes, or sequentially with `asr` if workers is
+    at most 1. callback(o) is called with (beg, end, text) of each segment, in order, as soon as it and all the
+    previous ones are done. Returns the list of them."""
+    segments = split_audio(audio, max_segment, getattr(args, "vac_model", None))
+    logger.info(f"{len(segments)} segments, {sum(e - b for b, e in segments)/SAMPLING_RATE:.1f} s of speech in "
+                f"{len(audio)/SAMPLING_RATE:.1f} s of audio")
+
+    outputs = []
+
+    def emit(words, sep):
+        if not words:
+            return
+        o = (words[0][0], words[-1][1], sep.join(w[2] for w in words))
+        outputs.append(o)
+        if callback is not None:
+            callback(o)
+
+    if workers <= 1:
+        if asr is None:
+            _init_worker(args)
+        for beg, end in segments:
+            emit(*_transcribe_segment(beg, audio[beg:end], asr))
+        return outputs
+
+    # spawn: the workers don't inherit the threads and the torch state of this process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(args,)) as pool:
+        futures = [pool.submit(_transcribe_segment, beg, audio[beg:end]) for beg, end in segments]
+        for f in futures:
+            emit(*f.result())
+    return outputs
+
+
+if __name__ == "__main__":
+
+    from whisper_online import add_shared_args, load_audio, set_logging
+
+    parser = argparse.ArgumentParser(description="Transcribes a long recording in VAD segments with parallel worker processes.")
+    parser.add_argument('audio_path', type=str, help="Filename of the audio.")
+    add_shared_args(parser)
+    parser.add_argument('--workers', type=int, default=4, help='Number of worker processes, each one loads the model. 1 transcribes the segments in this process.')
+    parser.add_argument('--max-segment', type=float, default=30.0, dest="max_segment", help='Maximum segment length in seconds.')
+    args = parser.parse_args()
+    if args.max_segment <= 0:
+        parser.error("--max-segment must be positive")
+    set_logging(args, logger, other="")
+
+    audio = load_audio(args.audio_path)
+    start = time.time()
+
+    def output(o):
+        print("%1.4f %1.0f %1.0f %s" % ((time.time() - start)*1000, o[0]*1000, o[1]*1000, o[2]), flush=True)
+
+    transcribe_parallel(args, audio, args.workers, args.max_segment, callback=output)
+    logger.info(f"done in {time.time() - start:.1f} s")
@@ -1,4 +1,5 @@
 import torch
+import numpy as np
 
 # This is copied from silero-vad's vad_utils.py:
 # https://github.com/snakers4/silero-vad/blob/94811cbe1207ec24bc0f5370b895364b8934936f/src/silero_vad/utils_vad.py#L398C1-L489C20
@@ -67,16 +68,22 @@ class VADIterator:
             time resolution of speech coordinates when requested as seconds
         """
 
-        if not torch.is_tensor(x):
+        if isinstance(x, np.ndarray) and x.dtype == np.float32:
+            x = torch.from_numpy(x)  # no copy
+        elif not torch.is_tensor(x):
             try:
                 x = torch.Tensor(x)
             except:
                 raise TypeError("Audio cannot be casted to tensor. Cast it manually")
 
         window_size_samples = len(x[0]) if x.dim() == 2 else len(x)
-        self.current_sample += window_size_samples
 
         speech_prob = self.model(x, self.sampling_rate).item()
+        return self.update(speech_prob, window_size_samples, return_seconds, time_resolution)
+
+    def update(self, speech_prob, window_size_samples, return_seconds=False, time_resolution: int = 1):
+        """the same as __call__, but with the speech probability of the window already computed"""
+        self.current_sample += window_size_samples
 
         if (speech_prob >= self.threshold) and self.temp_end:
             self.temp_end = 0
@@ -102,23 +109,62 @@ class VADIterator:
 #######################
 # because Silero now requires exactly 512-sized audio chunks 
 
-import numpy as np
+from audio_buffer import AudioRingBuffer
+
 class FixedVADIterator(VADIterator):
     '''It fixes VADIterator by allowing to process any audio length, not only exactly 512 frames at once.
     If audio to be processed at once is long and multiple voiced segments detected, 
     then __call__ returns the start of the first segment, and end (or middle, which means no end) of the last segment. 
+
+    The 512-sample windows are views into an AudioRingBuffer, not copies. The buffer can be shared with the caller
+    (parameter `buffer`): the caller appends the audio to it and calls this object with no audio, and it processes
+    the windows that are complete. Then the caller owns the buffer and trims it, but not behind self.position.
+
+    With `engine` (vad_engine.SileroVADEngine), the model is shared with other streams and all the complete windows
+    are evaluated in one request to the engine. The recurrent state of this stream is then kept in self.vad_state.
     '''
 
-    def reset_states(self):
-        super().reset_states()
-        self.buffer = np.array([],dtype=np.float32)
+    WINDOW = 512
+
+    def __init__(self, model=None, buffer=None, engine=None, **kw):
+        self.shared_buffer = buffer
+        self.engine = engine
+        if engine is not None:
+            model = engine.model
+        super().__init__(model, **kw)
 
-    def __call__(self, x, return_seconds=False):
-        self.buffer = np.append(self.buffer, x) 
+    def reset_states(self):
+        if self.engine is None:
+            super().reset_states()
+        else:
+            # the shared model is not reset, the state of this stream is kept outside of it
+            self.vad_state = self.engine.new_state()
+            self.triggered = False
+            self.temp_end = 0
+            self.current_sample = 0
+        if self.shared_buffer is not None:
+            self.buffer = self.shared_buffer
+        elif hasattr(self, "buffer"):
+            self.buffer.clear()
+        else:
+            self.buffer = AudioRingBuffer(4*self.WINDOW)
+        self.position = self.buffer.end  # absolute position of the first sample not processed yet
+
+    def __call__(self, x=None, return_seconds=False):
+        if x is not None:
+            self.buffer.append(x)
+        W = self.WINDOW
+        n = (self.buffer.end - self.position)//W
+        if self.engine is not None:
+            windows = [self.buffer.slice(p, p+W) for p in range(self.position, self.position+n*W, W)]
+            probs = self.engine(self.vad_state, windows)
         ret = None
-        while len(self.buffer) >= 512:
-            r = super().__call__(self.buffer[:512], return_seconds=return_seconds)
-            self.buffer = self.buffer[512:]
+        for i in range(n):
+            if self.engine is not None:
+                r = self.update(probs[i], W, return_seconds=return_seconds)
+            else:
+                r = super().__call__(self.buffer.slice(self.position, self.position+W), return_seconds=return_seconds)
+            self.position += W
             if ret is None:
                 ret = r
             elif r is not None:
@@ -127,6 +173,8 @@ class FixedVADIterator(VADIterator):
                 if 'start' in r and 'end' in ret:  # there is an earlier start.
                     # Remove end, merging this segment with the previous one.
                     del ret['end']
+        if self.shared_buffer is None:
+            self.buffer.drop_to(self.position)
         return ret if ret != {} else None
 
 if __name__ == "__main__":
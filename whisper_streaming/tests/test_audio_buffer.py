@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from audio_buffer import AudioRingBuffer
+
+
+def operations(seed, n=400):
+    """random appends (of float32 audio) and drops, some of them longer than the capacity"""
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        if rng.random() < 0.6:
+            yield "append", rng.uniform(-1, 1, int(rng.integers(0, 700))).astype(np.float32)
+        else:
+            yield "drop", int(rng.integers(0, 900))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_float32_buffer_matches_np_append(seed):
+    # the reference: the buffer of OnlineASRProcessor before the ring, np.append and slicing
+    buffer = AudioRingBuffer(256)
+    reference = np.array([], dtype=np.float32)
+    offset = 0
+    for op, arg in operations(seed):
+        if op == "append":
+            buffer.append(arg)
+            reference = np.append(reference, arg)
+        else:
+            buffer.drop(arg)
+            dropped = min(arg, len(reference))
+            reference = reference[dropped:]
+            offset += dropped
+        assert buffer.view().dtype == np.float32
+        np.testing.assert_array_equal(buffer.view(), reference)
+        assert (buffer.offset, buffer.end) == (offset, offset + len(reference))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_int16_buffer_matches_np_append_within_quantization(seed):
+    buffer = AudioRingBuffer(256, dtype=np.int16)
+    reference = np.array([], dtype=np.float32)
+    for op, arg in operations(seed):
+        if op == "append":
+            buffer.append(arg)
+            reference = np.append(reference, arg)
+        else:
+            buffer.drop(arg)
+            reference = reference[min(arg, len(reference)):]
+        np.testing.assert_allclose(buffer.view(), reference, atol=1/16384)
+
+
+def test_slice_by_absolute_positions():
+    buffer = AudioRingBuffer(4)
+    audio = np.arange(20, dtype=np.float32)
+    buffer.append(audio[:12])
+    buffer.drop_to(5)
+    buffer.append(audio[12:])
+    assert (buffer.offset, buffer.end) == (5, 20)
+    np.testing.assert_array_equal(buffer.slice(8, 11), audio[8:11])
+    # clipped to the stored samples
+    np.testing.assert_array_equal(buffer.slice(0, 7), audio[5:7])
+    np.testing.assert_array_equal(buffer.slice(18, 30), audio[18:20])
+    assert len(buffer.slice(25)) == 0
+    assert len(buffer.slice(10, 8)) == 0
+
+
+def test_clear_restarts_the_positions():
+    buffer = AudioRingBuffer(8)
+    buffer.append(np.ones(10, dtype=np.float32))
+    buffer.drop(3)
+    buffer.clear()
+    assert (len(buffer), buffer.offset, buffer.end) == (0, 0, 0)
+
+
+def test_unsupported_dtype():
+    with pytest.raises(ValueError):
+        AudioRingBuffer(8, dtype=np.float64)
@@ -0,0 +1,113 @@
+import json
+
+import numpy as np
+import pytest
+
+from audio_ingest import PCMBuffer, PCMStream, StreamingResampler
+
+
+def chunks(data, seed, max_size=7):
+    """the bytes in packets of random sizes, which split the samples"""
+    rng = np.random.default_rng(seed)
+    i = 0
+    while i < len(data):
+        n = int(rng.integers(1, max_size + 1))
+        yield data[i:i+n]
+        i += n
+
+
+@pytest.mark.parametrize("sample_format,dtype", [("s16le", "<i2"), ("f32le", "<f4")])
+def test_pcm_buffer_completes_split_samples(sample_format, dtype):
+    samples = (np.random.default_rng(0).uniform(-1, 1, 500) * (32767 if dtype == "<i2" else 1)).astype(dtype)
+    buffer = PCMBuffer(sample_format, capacity=16)
+    received = []
+    for packet in chunks(samples.tobytes(), 1):
+        buffer.feed(packet)
+        received.append(buffer.take().copy())
+    np.testing.assert_array_equal(np.concatenate(received), samples)
+    assert buffer.samples() == 0
+
+
+def test_pcm_buffer_receives_into_the_writable_view():
+    frames = np.arange(600, dtype="<i2").reshape(300, 2)
+    data = frames.tobytes()
+    buffer = PCMBuffer("s16le", capacity=8, channels=2)
+    received = []
+    for packet in chunks(data, 2, max_size=13):
+        view = buffer.writable(len(packet))
+        view[:len(packet)] = packet
+        buffer.commit(len(packet))
+        received.append(buffer.take().copy())
+    np.testing.assert_array_equal(np.concatenate(received), frames)
+
+
+def sine(freq, rate, seconds):
+    t = np.arange(int(rate * seconds)) / rate
+    return (0.5 * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+@pytest.mark.parametrize("in_rate", [48000, 44100, 8000])
+def test_resampler_in_chunks_matches_one_call(in_rate):
+    audio = sine(440, in_rate, 1.0)
+    whole = StreamingResampler(in_rate)(audio)
+    resampler = StreamingResampler(in_rate)
+    parts = []
+    rng = np.random.default_rng(3)
+    i = 0
+    while i < len(audio):
+        n = int(rng.integers(0, 2000))
+        parts.append(resampler(audio[i:i+n]))
+        i += n
+    np.testing.assert_allclose(np.concatenate(parts), whole, atol=1e-6)
+    assert len(whole) == int(np.ceil(len(audio) * 16000 / in_rate))
+
+
+@pytest.mark.parametrize("in_rate", [48000, 44100])
+def test_resampler_keeps_the_tone(in_rate):
+    out = StreamingResampler(in_rate)(sine(1000, in_rate, 1.0))[1000:-1000]
+    # a 1 kHz tone at 16 kHz, of the same amplitude
+    expected = sine(1000, 16000, 1.0)
+    spectrum = np.abs(np.fft.rfft(out))
+    assert np.fft.rfftfreq(len(out), 1/16000)[spectrum.argmax()] == pytest.approx(1000, abs=2)
+    assert np.sqrt(np.mean(out**2)) == pytest.approx(np.sqrt(np.mean(expected**2)), rel=0.02)
+
+
+def test_resampler_removes_the_frequencies_above_nyquist():
+    # 7 kHz passes to 16 kHz, 12 kHz would alias to 4 kHz
+    audio = sine(12000, 48000, 1.0)
+    out = StreamingResampler(48000)(audio)[1000:-1000]
+    assert np.sqrt(np.mean(out**2)) < 0.01
+
+
+def test_stream_downmixes_and_resamples():
+    left = sine(440, 48000, 0.5)
+    right = -left / 2
+    stereo = (np.stack([left, right], axis=1) * 32768).astype("<i2")
+    stream = PCMStream()
+    stream.configure_json(json.dumps({"format": "s16le", "sample_rate": 48000, "channels": 2}).encode())
+    out = []
+    for packet in chunks(stereo.tobytes(), 4, max_size=999):
+        stream.feed(packet)
+        out.append(stream.take())
+    out = np.concatenate(out)
+    expected = StreamingResampler(48000)(((left + right) / 2).astype(np.float32))
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, expected, atol=1e-3)
+
+
+def test_stream_of_16khz_mono_is_not_converted():
+    samples = np.arange(100, dtype="<i2")
+    stream = PCMStream()
+    stream.feed(samples.tobytes())
+    assert stream.duration() == 100/16000
+    np.testing.assert_array_equal(stream.take(), samples)
+
+
+def test_stream_rejects_bad_formats():
+    with pytest.raises(ValueError):
+        PCMStream(sample_format="mp3")
+    stream = PCMStream()
+    with pytest.raises(ValueError):
+        stream.configure(sample_rate=-8000)
+    with pytest.raises(ValueError):
+        stream.configure(sample_rate=16000, channels=-1)
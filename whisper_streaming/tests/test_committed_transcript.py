@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+from committed_transcript import CommittedTranscript
+
+
+def reference_prompt(commited, buffer_time_offset, sep):
+    """OnlineASRProcessor.prompt with all the committed words in one list, before CommittedTranscript"""
+    k = max(0,len(commited)-1)
+    while k > 0 and commited[k-1][1] > buffer_time_offset:
+        k -= 1
+    p = [t for _,_,t in commited[:k]]
+    prompt = []
+    l = 0
+    while p and l < 200:
+        x = p.pop(-1)
+        l += len(x)+1
+        prompt.append(x)
+    return sep.join(prompt[::-1]), sep.join(t for _,_,t in commited[k:])
+
+
+def words(rng, start, n):
+    t = start
+    out = []
+    for _ in range(n):
+        text = " " + "w" * int(rng.integers(1, 9))
+        out.append((t, t + 0.3, text))
+        t += float(rng.uniform(0.3, 0.8))
+    return out, t
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_spilling_keeps_the_prompts_and_the_transcript(seed):
+    rng = np.random.default_rng(seed)
+    transcript = CommittedTranscript("", spill_min_words=20)
+    commited = []
+    t = offset = 0.0
+    for _ in range(300):
+        new, t = words(rng, t, int(rng.integers(0, 6)))
+        transcript.extend(new)
+        commited.extend(new)
+        if rng.random() < 0.3:
+            # the audio buffer is trimmed at a committed word, it only moves forward
+            if commited:
+                offset = max(offset, commited[int(rng.integers(len(commited)))][1])
+            transcript.trim(offset)
+        assert transcript.prompt(offset) == reference_prompt(commited, offset, "")
+        assert len(transcript) == len(commited)
+        assert transcript.last() == (commited[-1] if commited else None)
+    # most of the words were moved to the log, all of them are exported
+    assert transcript.spilled > len(transcript.words)
+    assert list(transcript.export()) == commited
+    transcript.close()
+
+
+def test_restart_drops_the_prompt():
+    transcript = CommittedTranscript(" ")
+    transcript.extend([(0.0, 0.5, "one"), (0.5, 1.0, "two"), (1.0, 1.5, "three")])
+    assert transcript.prompt(1.2) == ("one two", "three")
+    transcript.restart()
+    assert transcript.prompt(1.2) == ("", "")
+    transcript.extend([(2.0, 2.5, "four")])
+    assert [w[2] for w in transcript.export()] == ["one", "two", "three", "four"]
+    transcript.close()
+
+
+def test_temporary_log_is_removed_on_close():
+    transcript = CommittedTranscript(" ", spill_min_words=1)
+    transcript.extend([(0.0, 0.5, "one"), (0.5, 1.0, "two")])
+    transcript.restart()
+    path = transcript._tmp_path
+    assert os.path.exists(path)
+    transcript.close()
+    assert not os.path.exists(path)
+
+
+def test_log_path_collects_the_sessions(tmp_path):
+    path = str(tmp_path / "transcript.jsonl")
+    for session in range(2):
+        transcript = CommittedTranscript(" ", log_path=path, spill_min_words=1)
+        transcript.extend([(session, session + 0.5, f"s{session}a"), (session + 0.5, session + 1.0, f"s{session}b")])
+        transcript.close()
+    transcript = CommittedTranscript(" ", log_path=path)
+    assert [w[2] for w in transcript.export()] == ["s0a", "s0b", "s1a", "s1b"]
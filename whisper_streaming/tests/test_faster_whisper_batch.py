@@ -0,0 +1,120 @@
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("soundfile")
+pytest.importorskip("faster_whisper")
+
+import whisper_online
+
+
+@pytest.fixture(scope="module")
+def asr(tmp_path_factory):
+    """FasterWhisperASR with a small English-only model of random weights and a byte-level tokenizer, so that no
+    model is downloaded. Its transcripts are nonsense, but deterministic."""
+    from ctranslate2.specs import model_spec, whisper_spec
+    from faster_whisper import WhisperModel
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+
+    rng = np.random.default_rng(0)
+    d, layers = 64, 2
+
+    def weights(*shape):
+        return (rng.standard_normal(shape) * 0.2).astype("float32")
+
+    def layer_norm(spec):
+        spec.gamma = np.ones(d, "float32")
+        spec.beta = np.zeros(d, "float32")
+
+    def linear(spec, out, inp):
+        spec.weight = weights(out, inp)
+        spec.bias = np.zeros(out, "float32")
+
+    bytes_ = sorted(pre_tokenizers.ByteLevel.alphabet())
+    specials = ["<|endoftext|>", "<|startoftranscript|>", "<|translate|>", "<|transcribe|>", "<|startoflm|>",
+                "<|startofprev|>", "<|nocaptions|>", "<|notimestamps|>"] + ["<|%.2f|>" % (i * 0.02) for i in range(1501)]
+    tokenizer = Tokenizer(models.BPE(vocab={t: i for i, t in enumerate(bytes_)}, merges=[]))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.add_special_tokens(specials)
+
+    spec = whisper_spec.WhisperSpec(layers, 2, layers, 2)
+    encoder, decoder = spec.encoder, spec.decoder
+    encoder.conv1.weight, encoder.conv1.bias = weights(d, 80, 3), np.zeros(d, "float32")
+    encoder.conv2.weight, encoder.conv2.bias = weights(d, d, 3), np.zeros(d, "float32")
+    encoder.position_encodings.encodings = weights(1500, d)
+    decoder.embeddings.weight = decoder.projection.weight = weights(len(bytes_) + len(specials), d)
+    decoder.position_encodings.encodings = weights(448, d)
+    layer_norm(encoder.layer_norm)
+    layer_norm(decoder.layer_norm)
+    for layer in encoder.layer + decoder.layer:
+        layer_norm(layer.self_attention.layer_norm)
+        linear(layer.self_attention.linear[0], 3 * d, d)
+        linear(layer.self_attention.linear[1], d, d)
+        layer_norm(layer.ffn.layer_norm)
+        linear(layer.ffn.linear_0, 2 * d, d)
+        linear(layer.ffn.linear_1, d, 2 * d)
+    for layer in decoder.layer:
+        layer_norm(layer.attention.layer_norm)
+        linear(layer.attention.linear[0], d, d)
+        linear(layer.attention.linear[1], 2 * d, d)
+        linear(layer.attention.linear[2], d, d)
+    spec.register_vocabulary(bytes_ + specials)
+    spec.config.suppress_ids = []
+    spec.config.suppress_ids_begin = []
+    spec.config.lang_ids = []
+    spec.config.alignment_heads = [[layers - 1, 0], [layers - 1, 1]]
+    path = str(tmp_path_factory.mktemp("model"))
+    with pytest.MonkeyPatch.context() as mp:
+        # the backend tests put a stand-in torch module, without tensors, in sys.modules
+        if "torch" in sys.modules and not hasattr(sys.modules["torch"], "Tensor"):
+            mp.setattr(model_spec, "torch_is_available", False)
+        spec.validate()
+        spec.optimize(quantization=None)
+        spec.save(path)
+    tokenizer.save(f"{path}/tokenizer.json")
+
+    asr = object.__new__(whisper_online.FasterWhisperASR)
+    asr.logfile = sys.stderr
+    asr.original_language = "en"
+    # the one by one path without the temperature fallback, which the batch doesn't do
+    asr.transcribe_kargs = {"temperature": [0.0]}
+    asr.model = WhisperModel(path, device="cpu", compute_type="float32")
+    asr.model.feature_extractor = whisper_online.PrecomputedFeatureExtractor(asr.model.feature_extractor)
+    return asr
+
+
+def noise(seed, seconds):
+    return (np.random.default_rng(seed).standard_normal(int(seconds * 16000)) * 0.1).astype(np.float32)
+
+
+def test_batch_of_one_buffer_is_transcribed_as_one_by_one(asr):
+    # the window loop of the batch reproduces transcribe, over one and more windows
+    for seed, seconds, prompt in [(1, 5, "hello"), (2, 47.2, ""), (3, 95, "some longer prompt")]:
+        audio = noise(seed, seconds)
+        batch = asr._decode_batch([audio], [prompt], [None])[0]
+        single = asr.transcribe(audio, prompt)
+        assert [s.tokens for s in batch] == [s.tokens for s in single]
+        assert asr.ts_words(batch) == asr.ts_words(single)
+
+
+def test_batch_decodes_each_buffer_on_its_own(asr, monkeypatch):
+    # the same buffer in each session: the prompts keep the same length, so nothing is cut
+    audio = noise(4, 70)
+    batches = []
+    decode_batch = asr._decode_batch
+    monkeypatch.setattr(asr, "_decode_batch", lambda *args: batches.append(len(args[0])) or decode_batch(*args))
+    results = asr.transcribe_batch([audio, audio.copy(), audio.copy()], ["hi there"] * 3)
+    single = asr.transcribe(audio, "hi there")
+    assert batches == [3]
+    assert all(asr.ts_words(r) == asr.ts_words(single) for r in results)
+
+
+def test_new_sessions_make_a_batch_of_their_own(asr, monkeypatch):
+    batches = []
+    decode_batch = asr._decode_batch
+    monkeypatch.setattr(asr, "_decode_batch", lambda *args: batches.append(list(args[1])) or decode_batch(*args))
+    results = asr.transcribe_batch([noise(5, 3), noise(6, 4), noise(7, 5)], ["", "hello", "bye n"])
+    assert batches == [["hello", "bye n"]]
+    assert len(results) == 3
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("soundfile")
+
+from whisper_online import HypothesisBuffer
+
+
+class ReferenceHypothesisBuffer:
+    """HypothesisBuffer before the token ids and the rolling hashes: lists of (beg, end, text), and the n-grams
+    compared as joined strings"""
+
+    def __init__(self):
+        self.commited_in_buffer = []
+        self.buffer = []
+        self.new = []
+        self.last_commited_time = 0
+        self.last_commited_word = None
+
+    def insert(self, new, offset):
+        new = [(a+offset,b+offset,t) for a,b,t in new]
+        self.new = [(a,b,t) for a,b,t in new if a > self.last_commited_time-0.1]
+        if len(self.new) >= 1:
+            a,b,t = self.new[0]
+            if abs(a - self.last_commited_time) < 1:
+                if self.commited_in_buffer:
+                    cn = len(self.commited_in_buffer)
+                    nn = len(self.new)
+                    for i in range(1,min(min(cn,nn),5)+1):
+                        c = " ".join([self.commited_in_buffer[-j][2] for j in range(1,i+1)][::-1])
+                        tail = " ".join(self.new[j-1][2] for j in range(1,i+1))
+                        if c == tail:
+                            for j in range(i):
+                                self.new.pop(0)
+                            break
+
+    def flush(self):
+        commit = []
+        while self.new:
+            na, nb, nt = self.new[0]
+            if len(self.buffer) == 0:
+                break
+            if nt == self.buffer[0][2]:
+                commit.append((na,nb,nt))
+                self.last_commited_word = nt
+                self.last_commited_time = nb
+                self.buffer.pop(0)
+                self.new.pop(0)
+            else:
+                break
+        self.buffer = self.new
+        self.new = []
+        self.commited_in_buffer.extend(commit)
+        return commit
+
+    def pop_commited(self, time):
+        while self.commited_in_buffer and self.commited_in_buffer[0][1] <= time:
+            self.commited_in_buffer.pop(0)
+
+
+def hypotheses(seed, n=300):
+    """Hypotheses of a growing buffer: the words of one transcript from a small vocabulary (so that the n-grams
+    often repeat), from around the last commit, with some words misheard and the times jittered"""
+    rng = np.random.default_rng(seed)
+    vocabulary = [" the", " a", " cat", " sat", " on", " mat", " the mat", "."]
+    transcript = [vocabulary[i] for i in rng.integers(0, len(vocabulary), 2000)]
+    start = 0
+    for _ in range(n):
+        start = max(0, start + int(rng.integers(-2, 4)))
+        words = []
+        for k in range(start, start + int(rng.integers(0, 12))):
+            text = transcript[k] if rng.random() > 0.1 else vocabulary[rng.integers(0, len(vocabulary))]
+            beg = k * 0.5 + rng.uniform(-0.2, 0.2)
+            words.append((beg, beg + 0.4, text))
+        offset = float(rng.choice([0.0, 0.5, 1.0]))
+        yield [(a - offset, b - offset, t) for a, b, t in words], offset, k * 0.5 - 3 if words else None
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_the_ngram_loop(seed):
+    buffer, reference = HypothesisBuffer(), ReferenceHypothesisBuffer()
+    commits = 0
+    for new, offset, trim in hypotheses(seed):
+        buffer.insert(new, offset)
+        reference.insert(new, offset)
+        assert [tuple(w) for w in buffer.new] == reference.new
+
+        commit = buffer.flush()
+        assert [tuple(w) for w in commit] == reference.flush()
+        commits += len(commit)
+        assert [tuple(w) for w in buffer.complete()] == reference.buffer
+        assert (buffer.last_commited_time, buffer.last_commited_word) == (reference.last_commited_time, reference.last_commited_word)
+
+        if trim is not None:
+            buffer.pop_commited(trim)
+            reference.pop_commited(trim)
+        assert [tuple(w) for w in buffer.commited_in_buffer] == reference.commited_in_buffer
+    # the hypotheses agree often enough to exercise the n-gram removal
+    assert commits > 50
+
+
+def test_removes_the_words_that_were_committed():
+    buffer = HypothesisBuffer()
+    buffer.insert([(0.0, 0.5, " a"), (0.5, 1.0, " b"), (1.0, 1.5, " c")], 0)
+    buffer.flush()
+    buffer.insert([(0.0, 0.5, " a"), (0.5, 1.0, " b"), (1.0, 1.5, " c")], 0)
+    assert len(buffer.flush()) == 3
+    # " b c" is the end of the commit
+    buffer.insert([(1.45, 1.9, " b"), (1.9, 2.4, " c"), (2.4, 2.9, " d")], 0)
+    assert [w.text for w in buffer.new] == [" d"]
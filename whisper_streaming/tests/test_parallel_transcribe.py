@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import parallel_transcribe
+from parallel_transcribe import SAMPLING_RATE, pack_segments, quiet_spans, transcribe_parallel
+
+
+def test_pack_segments_joins_spans_up_to_max_len():
+    assert pack_segments([(0, 10), (20, 30), (40, 50)], 30) == [(0, 30), (40, 50)]
+
+
+def test_pack_segments_cuts_long_spans():
+    assert pack_segments([(0, 5), (10, 85), (90, 95)], 30) == [(0, 5), (10, 40), (40, 70), (70, 95)]
+
+
+def test_pack_segments_empty():
+    assert pack_segments([], 30) == []
+
+
+def test_quiet_spans_cover_the_audio():
+    audio = np.random.default_rng(0).standard_normal(10*SAMPLING_RATE).astype(np.float32)
+    spans = quiet_spans(audio, 3*SAMPLING_RATE)
+    assert spans[0][0] == 0 and spans[-1][1] == len(audio)
+    assert all(a[1] == b[0] for a, b in zip(spans, spans[1:]))
+    assert all(0 < end - beg <= 3*SAMPLING_RATE for beg, end in spans)
+
+
+def test_quiet_spans_shorter_than_a_frame():
+    # the last quarter of 0.2 s is shorter than one 100 ms frame
+    spans = quiet_spans(np.zeros(SAMPLING_RATE, dtype=np.float32), int(0.2*SAMPLING_RATE))
+    assert spans == [(i*3200, (i + 1)*3200) for i in range(5)]
+
+
+def test_split_audio_rejects_non_positive_max_segment():
+    with pytest.raises(ValueError):
+        parallel_transcribe.split_audio(np.zeros(SAMPLING_RATE, dtype=np.float32), max_segment=0)
+
+
+class FakeASR:
+    """One word over the whole segment, with its length as the text"""
+
+    sep = " "
+
+    def transcribe(self, audio):
+        return len(audio)
+
+    def ts_words(self, n):
+        return [(0.0, n/SAMPLING_RATE, str(n))]
+
+
+def test_transcribe_parallel_absolute_timestamps(monkeypatch):
+    # speech at 1-3 s and 40-41 s; the segments are transcribed from their own start
+    monkeypatch.setattr(parallel_transcribe, "speech_spans", lambda audio, model_path=None: [(16000, 48000), (640000, 656000)])
+    outputs = []
+    result = transcribe_parallel(None, np.zeros(45*SAMPLING_RATE, dtype=np.float32), workers=1, max_segment=30.0,
+                                 asr=FakeASR(), callback=outputs.append)
+    assert result == [(1.0, 3.0, "32000"), (40.0, 41.0, "16000")]
+    assert outputs == result
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import threading
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class VADState:
+    '''Recurrent state of Silero VAD for one audio stream.'''
+
+    __slots__ = ("state", "context")
+
+    def __init__(self, state, context):
+        self.state = state
+        self.context = context
+
+
+class _Request:
+
+    __slots__ = ("state", "windows", "probs", "error", "done")
+
+    def __init__(self, state, windows):
+        self.state = state
+        self.windows = windows
+        self.probs = [None]*len(windows)
+        self.error = None
+        self.done = False
+
+
+class SileroVADEngine:
+    '''One Silero VAD model shared by all the VAC sessions in the process.
+
+    Silero VAD is recurrent, so the windows of one stream must be processed in order, each one with the state
+    after the previous one. But the windows of different streams are independent, and the model processes
+    them in one forward pass as a batch. The engine keeps the state of every stream in a VADState object, and
+    before the batched pass it stacks the states of the streams into the model (the `_state` and `_context`
+    attributes of Silero v5 jit and onnx models), and then it splits them back.
+
+    The callers block in __call__ with all the windows that they have ready. The first of them runs the
+    model on all the requests that are waiting, the others wait for it and then the next one takes the
+    requests that came meanwhile. So the concurrent sessions are batched without any fixed tick, and one
+    session's backlog is processed in one request, with one conversion of the probabilities to Python floats.
+    '''
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, model, sampling_rate=16000):
+        self.model = model
+        self.sampling_rate = sampling_rate
+
+        self.cond = threading.Condition()
+        self.pending = []
+        self.running = False
+
+        # the shapes of the initial state and context, by one probing run
+        with torch.no_grad():
+            self.model.reset_states()
+            self.model(torch.zeros(1, 512), self.sampling_rate)
+        self.zero_state = torch.zeros_like(self.model._state)
+        self.zero_context = torch.zeros_like(self.model._context)
+        self.model.reset_states()
+
+    @classmethod
+    def shared(cls, model_path=None):
+        """Returns the engine for the model, it is loaded only once per process."""
+        with cls._shared_lock:
+            if model_path not in cls._shared:
+                cls._shared[model_path] = cls(load_silero_vad_model(model_path))
+            return cls._shared[model_path]
+
+    def new_state(self):
+        return VADState(self.zero_state, self.zero_context)
+
+    def __call__(self, state, windows):
+        """Returns the speech probabilities of the 512-sample windows (float32 arrays) of one stream.
+        state: VADState of the stream, it is updated
+        """
+        if not windows:
+            return []
+        req = _Request(state, windows)
+        with self.cond:
+            self.pending.append(req)
+            while not req.done:
+                if self.running:
+                    self.cond.wait()
+                    continue
+                batch, self.pending = self.pending, []
+                self.running = True
+                self.cond.release()
+                try:
+                    self._run(batch)
+                except Exception as e:
+                    for r in batch:
+                        r.error = e
+                finally:
+                    self.cond.acquire()
+                    for r in batch:
+                        r.done = True
+                    self.running = False
+                    self.cond.notify_all()
+        if req.error is not None:
+            raise req.error
+        return req.probs
+
+    @torch.no_grad()
+    def _run(self, batch):
+        steps = max(len(r.windows) for r in batch)
+        outs = []
+        for t in range(steps):
+            active = [r for r in batch if t < len(r.windows)]
+            x = torch.stack([torch.from_numpy(r.windows[t]) for r in active])
+            self.model._state = torch.cat([r.state.state for r in active], dim=1)
+            self.model._context = torch.cat([r.state.context for r in active], dim=0)
+            self.model._last_sr = self.sampling_rate
+            self.model._last_batch_size = len(active)
+            out = self.model(x, self.sampling_rate)
+            state, context = self.model._state, self.model._context
+            for i, r in enumerate(active):
+                r.state.state = state[:, i:i+1]
+                r.state.context = context[i:i+1]
+            outs.append((t, active, out))
+        # one conversion per batch instead of .item() per window
+        for t, active, out in outs:
+            for r, p in zip(active, out.view(-1).tolist()):
+                r.probs[t] = p
+
+
+def load_silero_vad_model(model_path=None):
+    """Loads Silero VAD from a local .jit or .onnx file. Without the path, it uses the model bundled in
+    the silero-vad package, and if it's not installed, it downloads the model with torch.hub.
+    """
+    if model_path is not None:
+        logger.info(f"Loading Silero VAD from {model_path}")
+        if model_path.endswith(".onnx"):
+            from silero_vad.utils_vad import OnnxWrapper
+            return OnnxWrapper(model_path)
+        model = torch.jit.load(model_path, map_location="cpu")
+        model.eval()
+        return model
+    try:
+        from silero_vad import load_silero_vad
+    except ImportError:
+        logger.warning("Silero VAD model path is not set and silero-vad package is not installed. Downloading the model with torch.hub.")
+        model, _ = torch.hub.load(
+            repo_or_dir='snakers4/silero-vad',
+            model='silero_vad'
+        )
+        return model
+    return load_silero_vad()
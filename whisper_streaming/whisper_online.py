@@ -1,21 +1,34 @@
 #!/usr/bin/env python3
 import sys
 import numpy as np
-import librosa
-from functools import lru_cache
 import time
 import logging
+import threading
+from collections import deque
+from types import SimpleNamespace
 
 import io
 import soundfile as sf
 import math
 
+from audio_buffer import AudioRingBuffer
+from committed_transcript import CommittedTranscript
+from audio_source import DecodedAudioCache, StreamingAudioFile, DecodedAudioFile
+
 logger = logging.getLogger(__name__)
 
-@lru_cache(10**6)
+# decoded audio files, see set_audio_cache
+audio_cache = None
+
+def set_audio_cache(cache_dir=None, max_bytes=2*1024**3):
+    global audio_cache
+    audio_cache = DecodedAudioCache(cache_dir, max_bytes, sampling_rate=16000)
+
 def load_audio(fname):
-    a, _ = librosa.load(fname, sr=16000, dtype=np.float32)
-    return a
+    """Returns the whole audio file, 16kHz mono float32. It's a read-only memory-mapped array from audio_cache."""
+    if audio_cache is None:
+        set_audio_cache()
+    return audio_cache.get(fname)
 
 def load_audio_chunk(fname, beg, end):
     audio = load_audio(fname)
@@ -23,6 +36,16 @@ def load_audio_chunk(fname, beg, end):
     end_s = int(end*16000)
     return audio[beg_s:end_s]
 
+def open_audio_file(fname, start_at=0.0):
+    """Returns the audio file as a source of chunks, see audio_source.StreamingAudioFile. It is decoded block by
+    block as it is read. The formats that soundfile can't read are decoded whole by load_audio.
+    """
+    try:
+        return StreamingAudioFile(fname, sampling_rate=16000, start_at=start_at)
+    except (ImportError, RuntimeError) as e:
+        logger.info(f"{fname} can't be read by blocks ({e}), decoding it whole")
+        return DecodedAudioFile(load_audio(fname))
+
 
 # Whisper backend
 
@@ -31,6 +54,10 @@ class ASRBase:
     sep = " "   # join transcribe words with this character (" " for whisper_timestamped,
                 # "" for faster-whisper because it emits the spaces when neeeded)
 
+    accepts_features = False  # whether transcribe can use precomputed log-mel features, see mel_cache.LogMelCache
+
+    decodes_batches = False  # whether transcribe_batch decodes the buffers in one model call, see batch_scheduler.BatchScheduler
+
     def __init__(self, lan, modelsize=None, cache_dir=None, model_dir=None, logfile=sys.stderr):
         self.logfile = logfile
 
@@ -49,6 +76,16 @@ class ASRBase:
     def transcribe(self, audio, init_prompt=""):
         raise NotImplemented("must be implemented in the child class")
 
+    def transcribe_batch(self, audios, init_prompts, features=None):
+        """Transcribes independent audio buffers (e.g. of different sessions, see batch_scheduler.BatchScheduler), each with its own prompt.
+        features: None, or the list of precomputed features (or None) for each audio, if self.accepts_features
+        Returns: the list of the results of transcribe, in the same order.
+        This one processes them one by one. A backend that can decode a batch at once may override it, and set decodes_batches.
+        """
+        if features is None:
+            return [self.transcribe(a, p) for a, p in zip(audios, init_prompts)]
+        return [self.transcribe(a, p, features=f) for a, p, f in zip(audios, init_prompts, features)]
+
     def use_vad(self):
         raise NotImplemented("must be implemented in the child class")
 
@@ -103,6 +140,8 @@ class FasterWhisperASR(ASRBase):
 
     sep = ""
 
+    decodes_batches = True  # see transcribe_batch
+
     def load_model(self, modelsize=None, cache_dir=None, model_dir=None):
         from faster_whisper import WhisperModel
 #        logging.getLogger("faster_whisper").setLevel(logger.level)
@@ -125,15 +164,140 @@ class FasterWhisperASR(ASRBase):
         # or run on CPU with INT8
         # tested: works, but slow, appx 10-times than cuda FP16
 #        model = WhisperModel(modelsize, device="cpu", compute_type="int8") #, download_root="faster-disk-cache-dir/")
+
+        model.feature_extractor = PrecomputedFeatureExtractor(model.feature_extractor)
+        self.n_mels = getattr(model.feature_extractor, "feature_size", 80)
         return model
 
-    def transcribe(self, audio, init_prompt=""):
+    @property
+    def accepts_features(self):
+        return not self.model.feature_extractor.disabled
 
-        # tested: beam_size=5 is faster and better than 1 (on one 200 second document from En ESIC, min chunk 0.01)
-        segments, info = self.model.transcribe(audio, language=self.original_language, initial_prompt=init_prompt, beam_size=5, word_timestamps=True, condition_on_previous_text=True, **self.transcribe_kargs)
-        #print(info)  # info contains language detection result
+    def transcribe(self, audio, init_prompt="", features=None):
 
-        return list(segments)
+        self.model.feature_extractor.provide(audio, features)
+        try:
+            # tested: beam_size=5 is faster and better than 1 (on one 200 second document from En ESIC, min chunk 0.01)
+            segments, info = self.model.transcribe(audio, language=self.original_language, initial_prompt=init_prompt, beam_size=5, word_timestamps=True, condition_on_previous_text=True, **self.transcribe_kargs)
+            #print(info)  # info contains language detection result
+
+            return list(segments)
+        finally:
+            self.model.feature_extractor.provide(None, None)
+
+    def transcribe_batch(self, audios, init_prompts, features=None):
+        """Decodes the buffers together: window by window as transcribe does, and for each window one encoder call,
+        one beam search and one word alignment for all the buffers that reach it. Unlike transcribe, it decodes at
+        temperature 0 only, without the fallback to higher temperatures. CTranslate2 requires the transcript to start
+        at the same position in all the prompts, so they are cut to the same number of tokens (the last ones); the
+        buffers without a prompt (a new session) make a batch of their own.
+        The buffers alone in their batch, and all of them with the VAD filter, are transcribed one by one.
+        """
+        if features is None:
+            features = [None] * len(audios)
+        groups = {}
+        if "vad_filter" not in self.transcribe_kargs:
+            for i, prompt in enumerate(init_prompts):
+                groups.setdefault(bool(prompt.strip()), []).append(i)
+        results = [None] * len(audios)
+        for group in groups.values():
+            if len(group) > 1:
+                decoded = self._decode_batch([audios[i] for i in group], [init_prompts[i] for i in group], [features[i] for i in group])
+                for i, res in zip(group, decoded):
+                    results[i] = res
+        for i, a in enumerate(audios):
+            if results[i] is None:
+                results[i] = self.transcribe(a, init_prompts[i], features=features[i])
+        return results
+
+    def _decode_batch(self, audios, init_prompts, features, language=None):
+        # WhisperModel.generate_segments for a batch, with the options of transcribe
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.tokenizer import Tokenizer
+        from faster_whisper.transcribe import Segment, Word, get_compression_ratio, get_suppressed_tokens
+
+        model = self.model
+        extractor = model.feature_extractor
+        multilingual = model.model.is_multilingual
+        language = language or self.original_language
+        task = self.transcribe_kargs.get("task", "transcribe")
+        tokenizer = Tokenizer(model.hf_tokenizer, multilingual, task=task, language=language or "en")
+
+        streams = []
+        for audio, f, prompt in zip(audios, features, init_prompts):
+            extractor.provide(audio, f)
+            try:
+                mel = extractor(audio)
+            finally:
+                extractor.provide(None, None)
+            # mel: without the last frame; tokens: the prompt and the transcript so far; speech_end: of the last word
+            streams.append(SimpleNamespace(mel=mel[:, :-1], seek=0, tokens=tokenizer.encode(" " + prompt.strip()), speech_end=0.0, segments=[]))
+
+        active = streams
+        while active:
+            sizes = [min(extractor.nb_max_frames, s.mel.shape[-1] - s.seek) for s in active]
+            encoder_output = model.encode(np.stack([pad_or_trim(s.mel[:, s.seek:s.seek + n]) for s, n in zip(active, sizes)]))
+            if multilingual and language is None:
+                # detected in the first window, as in transcribe; the word alignment needs one language for the batch
+                languages = [l[0][0][2:-2] for l in model.model.detect_language(encoder_output)]
+                if len(set(languages)) > 1:
+                    results = [None] * len(audios)
+                    for lang in set(languages):
+                        group = [i for i, l in enumerate(languages) if l == lang]
+                        decoded = self._decode_batch([audios[i] for i in group], [init_prompts[i] for i in group], [features[i] for i in group], lang)
+                        for i, res in zip(group, decoded):
+                            results[i] = res
+                    return results
+                language = languages[0]
+                tokenizer = Tokenizer(model.hf_tokenizer, multilingual, task=task, language=language)
+
+            previous = [s.tokens[-(model.max_length // 2 - 1):] for s in active]
+            n = min(len(p) for p in previous)
+            outputs = model.model.generate(
+                encoder_output, [model.get_prompt(tokenizer, p[len(p) - n:]) for p in previous],
+                beam_size=5, patience=1, length_penalty=1, max_length=model.max_length,
+                return_scores=True, return_no_speech_prob=True, suppress_blank=True,
+                suppress_tokens=get_suppressed_tokens(tokenizer, [-1]),
+                max_initial_timestamp_index=int(round(1.0 / model.time_precision)),
+            )
+
+            windows = []
+            for s, output, size in zip(active, outputs, sizes):
+                tokens = output.sequences_ids[0]
+                avg_logprob = output.scores[0] * len(tokens) / (len(tokens) + 1)
+                if output.no_speech_prob > 0.6 and avg_logprob < -1.0:
+                    # the no speech check of transcribe, with its default thresholds
+                    windows.append((output, avg_logprob, [], s.seek + size, True))
+                    continue
+                windows.append((output, avg_logprob) + model._split_segments_by_timestamps(
+                    tokenizer=tokenizer, tokens=tokens, time_offset=s.seek * extractor.time_per_frame,
+                    segment_size=size, segment_duration=size * extractor.time_per_frame, seek=s.seek))
+
+            # aligned in one batch; then the words of each buffer are timed on their own by add_word_timestamps, which
+            # would otherwise carry the end of the speech over from one buffer to the next
+            text_tokens = [[t for sub in w[2] for t in sub["tokens"] if t < tokenizer.eot] for w in windows]
+            alignments = model.find_alignment(tokenizer, text_tokens, encoder_output, sizes)
+            for s, (output, avg_logprob, subsegments, seek, single_timestamp_ending), alignment, size in zip(active, windows, alignments, sizes):
+                if subsegments:
+                    aligned = SimpleNamespace(frames_per_second=model.frames_per_second, find_alignment=lambda *a, alignment=alignment: [alignment])
+                    type(model).add_word_timestamps(aligned, [subsegments], tokenizer, None, [size],
+                                                    "\"'“¿([{-", "\"'.。,，!！?？:：”)]}、", s.speech_end)
+                    last_word_end = next((w["end"] for sub in reversed(subsegments) for w in reversed(sub["words"])), subsegments[-1]["end"])
+                    if not single_timestamp_ending and last_word_end > s.seek * extractor.time_per_frame:
+                        seek = round(last_word_end * model.frames_per_second)
+                    s.speech_end = last_word_end
+                for sub in subsegments:
+                    text = tokenizer.decode(sub["tokens"])
+                    if sub["start"] == sub["end"] or not text.strip():
+                        continue
+                    s.tokens.extend(sub["tokens"])
+                    s.segments.append(Segment(
+                        id=len(s.segments) + 1, seek=s.seek, start=sub["start"], end=sub["end"], text=text,
+                        tokens=sub["tokens"], avg_logprob=avg_logprob, compression_ratio=get_compression_ratio(text),
+                        no_speech_prob=output.no_speech_prob, words=[Word(**w) for w in sub["words"]], temperature=0.0))
+                s.seek = seek
+            active = [s for s in active if s.seek < s.mel.shape[-1]]
+        return [s.segments for s in streams]
 
     def ts_words(self, segments):
         o = []
@@ -156,6 +320,39 @@ class FasterWhisperASR(ASRBase):
     def set_translate_task(self):
         self.transcribe_kargs["task"] = "translate"
 
+class PrecomputedFeatureExtractor:
+    """Wraps faster-whisper's FeatureExtractor. When it gets the audio that was given to provide() with its features
+    (from mel_cache.LogMelCache), it returns them instead of computing them again. Otherwise, e.g. when faster-whisper
+    changed the audio by its VAD filter, it computes them as usual.
+    The features are compared with the original ones in the first use. If they differ (e.g. another faster-whisper version
+    computes them differently), they are not used.
+    """
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.local = threading.local()  # the model may be shared by more threads
+        self.verified = False
+        self.disabled = False
+
+    def __getattr__(self, name):
+        return getattr(self.extractor, name)
+
+    def provide(self, audio, features):
+        self.local.pending = (audio, features)
+
+    def __call__(self, waveform, *a, **kw):
+        audio, features = getattr(self.local, "pending", (None, None))
+        if features is None or waveform is not audio or self.disabled or kw.get("chunk_length") is not None:
+            return self.extractor(waveform, *a, **kw)
+        if not self.verified:
+            expected = self.extractor(waveform, *a, **kw)
+            if expected.shape != features.shape or not np.allclose(expected, features, atol=1e-3):
+                logger.warning("Cached log-mel features differ from faster-whisper's, the feature cache is disabled.")
+                self.disabled = True
+                return expected
+            self.verified = True
+        return features
+
 class MLXWhisper(ASRBase):
     """
     Uses MLX Whisper library as the backend, optimized for Apple Silicon.
@@ -356,39 +553,145 @@ class OpenaiApiASR(ASRBase):
 
 
 
+class StubASR(ASRBase):
+    """Deterministic backend without any model, for the tests and benchmarks of the streaming pipeline (e.g. benchmark.py) on CPU.
+
+    The "words" are the runs of loud 20 ms frames, and their text is chosen by their length and loudness, so the same
+    audio gives the same words in every iteration, like Whisper does (mostly). Gaps over 1 second end a segment.
+    compute_time: simulated processing time in seconds per second of audio
+    """
+
+    sep = " "
+
+    FRAME = 320  # 20 ms
+    VOCABULARY = "alpha bravo charlie delta echo foxtrot golf hotel india juliett kilo lima mike november oscar papa quebec romeo sierra tango uniform victor whiskey xray yankee zulu".split()
+
+    def __init__(self, lan=None, modelsize=None, cache_dir=None, model_dir=None, logfile=sys.stderr, threshold=0.02, min_gap=0.1, compute_time=0.0):
+        super().__init__(lan, modelsize, cache_dir, model_dir, logfile)
+        self.threshold = threshold
+        self.min_gap = int(min_gap*16000)//self.FRAME
+        self.compute_time = compute_time
+
+    def load_model(self, modelsize=None, cache_dir=None, model_dir=None):
+        return None
+
+    def transcribe(self, audio, init_prompt=""):
+        t = time.time()
+        frame_sec = self.FRAME/16000
+        n = len(audio)//self.FRAME
+        rms = np.sqrt(np.mean(np.square(audio[:n*self.FRAME].reshape(n, self.FRAME), dtype=np.float32), axis=1))
+        loud = np.concatenate([[0], (rms > self.threshold).astype(np.int8), [0]])
+        runs = np.flatnonzero(np.diff(loud)).reshape(-1, 2)  # [beg, end) frames
+
+        words = []
+        for beg, end in runs.tolist():
+            if words and beg - words[-1][1] < self.min_gap:
+                words[-1][1] = end
+            else:
+                words.append([beg, end])
+        segments = []
+        for beg, end in words:
+            level = int(20*np.log10(rms[beg:end].max()))
+            text = self.VOCABULARY[((end - beg)//5*7 + level//6) % len(self.VOCABULARY)]
+            w = {"start": round(beg*frame_sec, 2), "end": round(end*frame_sec, 2), "text": text}
+            if not segments or w["start"] - segments[-1]["end"] > 1.0:
+                segments.append({"start": w["start"], "end": w["end"], "words": []})
+            segments[-1]["words"].append(w)
+            segments[-1]["end"] = w["end"]
+
+        if self.compute_time:
+            time.sleep(max(0.0, self.compute_time*len(audio)/16000 - (time.time() - t)))
+        return {"segments": segments}
+
+    def ts_words(self, r):
+        return [(w["start"], w["end"], w["text"]) for s in r["segments"] for w in s["words"]]
+
+    def segments_end_ts(self, res):
+        return [s["end"] for s in res["segments"]]
+
+    def use_vad(self):
+        pass
+
+    def set_translate_task(self):
+        pass
+
+
+class Word:
+    """A timestamped word of the transcript. It behaves like the tuple (beg, end, text) that was used before,
+    and it carries `tid`, an integer id of the text that is unique within one HypothesisBuffer, for fast comparisons.
+    """
+
+    __slots__ = ("beg", "end", "text", "tid")
+
+    def __init__(self, beg, end, text, tid):
+        self.beg = beg
+        self.end = end
+        self.text = text
+        self.tid = tid
+
+    def __getitem__(self, i):
+        return (self.beg, self.end, self.text)[i]
+
+    def __iter__(self):
+        return iter((self.beg, self.end, self.text))
+
+    def __len__(self):
+        return 3
+
+    def __repr__(self):
+        return repr((self.beg, self.end, self.text))
+
+
 class HypothesisBuffer:
 
+    # rolling hash of n-grams of token ids
+    HASH_BASE = 1000003
+    HASH_MOD = (1 << 61) - 1
+
     def __init__(self, logfile=sys.stderr):
-        self.commited_in_buffer = []
-        self.buffer = []
-        self.new = []
+        self.commited_in_buffer = deque()
+        self.buffer = deque()
+        self.new = deque()
 
         self.last_commited_time = 0
         self.last_commited_word = None
 
+        self.token_ids = {}  # text -> tid
+
         self.logfile = logfile
 
+    def word(self, beg, end, text):
+        tid = self.token_ids.get(text)
+        if tid is None:
+            tid = self.token_ids[text] = len(self.token_ids)
+        return Word(beg, end, text, tid)
+
     def insert(self, new, offset):
         # compare self.commited_in_buffer and new. It inserts only the words in new that extend the commited_in_buffer, it means they are roughly behind last_commited_time and new in content
         # the new tail is added to self.new
         
-        new = [(a+offset,b+offset,t) for a,b,t in new]
-        self.new = [(a,b,t) for a,b,t in new if a > self.last_commited_time-0.1]
+        min_time = self.last_commited_time-0.1
+        self.new = deque(self.word(a+offset,b+offset,t) for a,b,t in new if a+offset > min_time)
 
         if len(self.new) >= 1:
-            a,b,t = self.new[0]
+            a = self.new[0].beg
             if abs(a - self.last_commited_time) < 1:
                 if self.commited_in_buffer:
                     # it's going to search for 1, 2, ..., 5 consecutive words (n-grams) that are identical in commited and new. If they are, they're dropped.
+                    # The n-grams are compared by rolling hashes of token ids, extended by one word in each step, and verified when the hashes match.
                     cn = len(self.commited_in_buffer)
                     nn = len(self.new)
+                    B, M = self.HASH_BASE, self.HASH_MOD
+                    hc = hn = 0
+                    power = 1
                     for i in range(1,min(min(cn,nn),5)+1):  # 5 is the maximum 
-                        c = " ".join([self.commited_in_buffer[-j][2] for j in range(1,i+1)][::-1])
-                        tail = " ".join(self.new[j-1][2] for j in range(1,i+1))
-                        if c == tail:
+                        hc = (self.commited_in_buffer[-i].tid*power + hc) % M  # prepends a word to the commited suffix
+                        hn = (hn*B + self.new[i-1].tid) % M  # appends a word to the new prefix
+                        power = power*B % M
+                        if hc == hn and all(self.commited_in_buffer[j-i].tid == self.new[j].tid for j in range(i)):
                             words = []
                             for j in range(i):
-                                words.append(repr(self.new.pop(0)))
+                                words.append(repr(self.new.popleft()))
                             words_msg = " ".join(words)
                             logger.debug(f"removing last {i} words: {words_msg}")
                             break
@@ -397,28 +700,23 @@ class HypothesisBuffer:
         # returns commited chunk = the longest common prefix of 2 last inserts. 
 
         commit = []
-        while self.new:
-            na, nb, nt = self.new[0]
-
-            if len(self.buffer) == 0:
-                break
-
-            if nt == self.buffer[0][2]:
-                commit.append((na,nb,nt))
-                self.last_commited_word = nt
-                self.last_commited_time = nb
-                self.buffer.pop(0)
-                self.new.pop(0)
-            else:
+        while self.new and self.buffer:
+            w = self.new[0]
+            if w.tid != self.buffer[0].tid:
                 break
+            commit.append(w)
+            self.last_commited_word = w.text
+            self.last_commited_time = w.end
+            self.buffer.popleft()
+            self.new.popleft()
         self.buffer = self.new
-        self.new = []
+        self.new = deque()
         self.commited_in_buffer.extend(commit)
         return commit
 
     def pop_commited(self, time):
-        while self.commited_in_buffer and self.commited_in_buffer[0][1] <= time:
-            self.commited_in_buffer.pop(0)
+        while self.commited_in_buffer and self.commited_in_buffer[0].end <= time:
+            self.commited_in_buffer.popleft()
 
     def complete(self):
         return self.buffer
@@ -427,52 +725,68 @@ class OnlineASRProcessor:
 
     SAMPLING_RATE = 16000
 
-    def __init__(self, asr, tokenizer=None, buffer_trimming=("segment", 15), logfile=sys.stderr):
+    def __init__(self, asr, tokenizer=None, buffer_trimming=("segment", 15), logfile=sys.stderr, audio_dtype=np.float32, commit_log=None, feature_cache=False, instrumentation=None):
         """asr: WhisperASR object
         tokenizer: sentence tokenizer object for the target language. Must have a method *split* that behaves like the one of MosesTokenizer. It can be None, if "segment" buffer trimming option is used, then tokenizer is not used at all.
         ("segment", 15)
         buffer_trimming: a pair of (option, seconds), where option is either "sentence" or "segment", and seconds is a number. Buffer is trimmed if it is longer than "seconds" threshold. Default is the most recommended option.
         logfile: where to store the log. 
+        audio_dtype: storage format of the audio buffer, np.float32 or np.int16 (half of the memory)
+        commit_log: file where the commited words that are not needed for processing are stored, see CommittedTranscript.
+            If None, a temporary file is used.
+        feature_cache: reuse the log-mel features of the audio that was already processed, see mel_cache.LogMelCache.
+            Only if the backend accepts them (faster-whisper).
+        instrumentation: collector of the timing of process_iter stages, see instrumentation.Instrumentation, or None
         """
         self.asr = asr
+        self.instrumentation = instrumentation
+        self.stream_id = instrumentation.new_stream() if instrumentation is not None else None
         self.tokenizer = tokenizer
         self.logfile = logfile
-
-        self.init()
+        self.commit_log = commit_log
+        self.commited = None
 
         self.buffer_trimming_way, self.buffer_trimming_sec = buffer_trimming
 
+        # the buffer is trimmed when it's longer than buffer_trimming_sec, or 30 seconds in the "sentence" mode.
+        # A few seconds more for the chunks that arrive before trimming. It grows if it's not enough.
+        capacity = (max(self.buffer_trimming_sec, 30) + 5)*self.SAMPLING_RATE
+        self.audio_buffer = AudioRingBuffer(capacity, dtype=audio_dtype)
+
+        self.feature_cache = None
+        if feature_cache:
+            if getattr(asr, "accepts_features", False):
+                from mel_cache import LogMelCache
+                self.feature_cache = LogMelCache(n_mels=asr.n_mels)
+            else:
+                logger.warning("The backend doesn't accept precomputed features, the feature cache is not used.")
+
+        self.init()
+
     def init(self, offset=None):
         """run this when starting or restarting processing"""
-        self.audio_buffer = np.array([],dtype=np.float32)
+        self.audio_buffer.clear()
+        if self.feature_cache is not None:
+            self.feature_cache.reset()
         self.transcript_buffer = HypothesisBuffer(logfile=self.logfile)
         self.buffer_time_offset = 0
         if offset is not None:
             self.buffer_time_offset = offset
         self.transcript_buffer.last_commited_time = self.buffer_time_offset
-        self.commited = []
+        if self.commited is None:
+            self.commited = CommittedTranscript(self.asr.sep, log_path=self.commit_log)
+        else:
+            # one transcript for the whole session, the restarted processing doesn't use the previous words
+            self.commited.restart()
 
     def insert_audio_chunk(self, audio):
-        self.audio_buffer = np.append(self.audio_buffer, audio)
+        self.audio_buffer.append(audio)
 
     def prompt(self):
         """Returns a tuple: (prompt, context), where "prompt" is a 200-character suffix of commited text that is inside of the scrolled away part of audio buffer. 
         "context" is the commited text that is inside the audio buffer. It is transcribed again and skipped. It is returned only for debugging and logging reasons.
         """
-        k = max(0,len(self.commited)-1)
-        while k > 0 and self.commited[k-1][1] > self.buffer_time_offset:
-            k -= 1
-
-        p = self.commited[:k]
-        p = [t for _,_,t in p]
-        prompt = []
-        l = 0
-        while p and l < 200:  # 200 characters prompt size
-            x = p.pop(-1)
-            l += len(x)+1
-            prompt.append(x)
-        non_prompt = self.commited[k:]
-        return self.asr.sep.join(prompt[::-1]), self.asr.sep.join(t for _,_,t in non_prompt)
+        return self.commited.prompt(self.buffer_time_offset)
 
     def process_iter(self):
         """Runs on the current audio buffer.
@@ -480,22 +794,43 @@ class OnlineASRProcessor:
         The non-emty text is confirmed (committed) partial transcript.
         """
 
+        timer = self.instrumentation.iteration(self.stream_id) if self.instrumentation is not None else None
+        buffer_sec = len(self.audio_buffer)/self.SAMPLING_RATE
+        buffer_offset = self.buffer_time_offset
+
         prompt, non_prompt = self.prompt()
         logger.debug(f"PROMPT: {prompt}")
         logger.debug(f"CONTEXT: {non_prompt}")
         logger.debug(f"transcribing {len(self.audio_buffer)/self.SAMPLING_RATE:2.2f} seconds from {self.buffer_time_offset:2.2f}")
-        res = self.asr.transcribe(self.audio_buffer, init_prompt=prompt)
+        audio = self.audio_buffer.view()
+        if timer is not None:
+            timer.lap("prompt")
+        if self.feature_cache is not None and self.asr.accepts_features:
+            features = self.feature_cache.features(audio, self.audio_buffer.offset)
+            if timer is not None:
+                timer.lap("features")
+            res = self.asr.transcribe(audio, init_prompt=prompt, features=features)
+        else:
+            res = self.asr.transcribe(audio, init_prompt=prompt)
+        if timer is not None:
+            timer.lap("transcribe")
 
         # transform to [(beg,end,"word1"), ...]
         tsw = self.asr.ts_words(res)
+        if timer is not None:
+            timer.lap("ts_words")
 
         self.transcript_buffer.insert(tsw, self.buffer_time_offset)
+        if timer is not None:
+            timer.lap("insert")
         o = self.transcript_buffer.flush()
         self.commited.extend(o)
         completed = self.to_flush(o)
         logger.debug(f">>>>COMPLETE NOW: {completed}")
         the_rest = self.to_flush(self.transcript_buffer.complete())
         logger.debug(f"INCOMPLETE: {the_rest}")
+        if timer is not None:
+            timer.lap("flush")
 
         # there is a newly confirmed text
 
@@ -523,12 +858,18 @@ class OnlineASRProcessor:
             #self.chunk_at(t)
 
         logger.debug(f"len of buffer now: {len(self.audio_buffer)/self.SAMPLING_RATE:2.2f}")
+        if timer is not None:
+            timer.lap("trim")
+            timer.done(buffer=buffer_sec, offset=buffer_offset, prompt_chars=len(prompt), committed=len(o),
+                       committed_total=len(self.commited), trimmed=self.buffer_time_offset - buffer_offset)
         return self.to_flush(o)
 
     def chunk_completed_sentence(self):
-        if self.commited == []: return
-        logger.debug(self.commited)
-        sents = self.words_to_sentences(self.commited)
+        if self.commited.last() is None: return
+        # the sentences that end before the audio buffer are not needed
+        words = self.commited.since(self.buffer_time_offset)
+        logger.debug(words)
+        sents = self.words_to_sentences(words)
         for s in sents:
             logger.debug(f"\t\tSENT: {s}")
         if len(sents) < 2:
@@ -542,11 +883,11 @@ class OnlineASRProcessor:
         self.chunk_at(chunk_at)
 
     def chunk_completed_segment(self, res):
-        if self.commited == []: return
+        if self.commited.last() is None: return
 
         ends = self.asr.segments_end_ts(res)
 
-        t = self.commited[-1][1]
+        t = self.commited.last()[1]
 
         if len(ends) > 1:
 
@@ -570,8 +911,17 @@ class OnlineASRProcessor:
         """trims the hypothesis and audio buffer at "time"
         """
         self.transcript_buffer.pop_commited(time)
+        self.commited.trim(time)
         cut_seconds = time - self.buffer_time_offset
-        self.audio_buffer = self.audio_buffer[int(cut_seconds*self.SAMPLING_RATE):]
+        cut = int(cut_seconds*self.SAMPLING_RATE)
+        if self.feature_cache is not None:
+            # the cached features stay valid when the buffer moves by whole frames. It starts a few ms earlier then.
+            r = (self.audio_buffer.offset + cut) % self.feature_cache.hop
+            cut -= r
+            time -= r/self.SAMPLING_RATE
+        self.audio_buffer.drop(cut)
+        if self.feature_cache is not None:
+            self.feature_cache.evict(self.audio_buffer.offset)
         self.buffer_time_offset = time
 
     def words_to_sentences(self, words):
@@ -607,10 +957,14 @@ class OnlineASRProcessor:
         o = self.transcript_buffer.complete()
         f = self.to_flush(o)
         logger.debug(f"last, noncommited: {f}")
-        self.buffer_time_offset += len(self.audio_buffer)/16000
+        self.buffer_time_offset += len(self.audio_buffer)/self.SAMPLING_RATE
         return f
 
 
+    def close(self):
+        """releases the files of the commited transcript, run it when the processor is not used anymore"""
+        self.commited.close()
+
     def to_flush(self, sents, sep=None, offset=0, ):
         # concatenates the timestamped words or sentences into one sequence that is flushed in one line
         # sents: [(beg1, end1, "sentence1"), ...] or [] if empty
@@ -634,79 +988,79 @@ class VACOnlineASRProcessor(OnlineASRProcessor):
     When it detects end of speech (non-voice for 500ms), it makes OnlineASRProcessor to end the utterance immediately.
     '''
 
-    def __init__(self, online_chunk_size, *a, **kw):
+    def __init__(self, online_chunk_size, *a, vac_model_path=None, **kw):
+        """vac_model_path: local Silero VAD .jit or .onnx file. The model is loaded once and shared by all the VAC processors.
+        The other arguments are the same as for OnlineASRProcessor.
+        """
         self.online_chunk_size = online_chunk_size
 
         self.online = OnlineASRProcessor(*a, **kw)
 
         # VAC:
-        import torch
-        model, _ = torch.hub.load(
-            repo_or_dir='snakers4/silero-vad',
-            model='silero_vad'
-        )
+        from vad_engine import SileroVADEngine
         from silero_vad_iterator import FixedVADIterator
-        self.vac = FixedVADIterator(model)  # we use the default options there: 500ms silence, 100ms padding, etc.  
+        engine = SileroVADEngine.shared(vac_model_path)
+        # The audio that was not sent to the online processor yet. VAD reads its 512-sample windows directly from it.
+        self.audio_buffer = AudioRingBuffer(2*self.SAMPLING_RATE)
+        self.vac = FixedVADIterator(buffer=self.audio_buffer, engine=engine)  # we use the default options there: 500ms silence, 100ms padding, etc.  
 
         self.logfile = self.online.logfile
         self.init()
 
     def init(self):
         self.online.init()
+        self.audio_buffer.clear()
         self.vac.reset_states()
         self.current_online_chunk_buffer_size = 0
 
         self.is_currently_final = False
 
         self.status = None  # or "voice" or "nonvoice"
-        self.audio_buffer = np.array([],dtype=np.float32)
-        self.buffer_offset = 0  # in frames
+        self.buffer_offset = 0  # in frames, the absolute position of the first sample not sent to the online processor
 
     def clear_buffer(self):
-        self.buffer_offset += len(self.audio_buffer)
-        self.audio_buffer = np.array([],dtype=np.float32)
+        self.buffer_offset = self.audio_buffer.end
 
+    def send_audio(self, beg, end=None):
+        """sends the audio between absolute positions beg and end to the online processor"""
+        send_audio = self.audio_buffer.slice(beg, end)
+        self.online.insert_audio_chunk(send_audio)
+        self.current_online_chunk_buffer_size += len(send_audio)
 
     def insert_audio_chunk(self, audio):
-        res = self.vac(audio)
-        self.audio_buffer = np.append(self.audio_buffer, audio)
+        self.audio_buffer.append(audio)
+        res = self.vac()
 
         if res is not None:
-            frame = list(res.values())[0]-self.buffer_offset
             if 'start' in res and 'end' not in res:
                 self.status = 'voice'
-                send_audio = self.audio_buffer[frame:]
-                self.online.init(offset=(frame+self.buffer_offset)/self.SAMPLING_RATE)
-                self.online.insert_audio_chunk(send_audio)
-                self.current_online_chunk_buffer_size += len(send_audio)
+                beg = max(res['start'], self.buffer_offset)
+                self.online.init(offset=beg/self.SAMPLING_RATE)
+                self.send_audio(beg)
                 self.clear_buffer()
             elif 'end' in res and 'start' not in res:
                 self.status = 'nonvoice'
-                send_audio = self.audio_buffer[:frame]
-                self.online.insert_audio_chunk(send_audio)
-                self.current_online_chunk_buffer_size += len(send_audio)
+                self.send_audio(self.buffer_offset, res['end'])
                 self.is_currently_final = True
                 self.clear_buffer()
             else:
-                beg = res["start"]-self.buffer_offset
-                end = res["end"]-self.buffer_offset
+                beg = max(res['start'], self.buffer_offset)
                 self.status = 'nonvoice'
-                send_audio = self.audio_buffer[beg:end]
-                self.online.init(offset=(beg+self.buffer_offset)/self.SAMPLING_RATE)
-                self.online.insert_audio_chunk(send_audio)
-                self.current_online_chunk_buffer_size += len(send_audio)
+                self.online.init(offset=beg/self.SAMPLING_RATE)
+                self.send_audio(beg, res['end'])
                 self.is_currently_final = True
                 self.clear_buffer()
         else:
             if self.status == 'voice':
-                self.online.insert_audio_chunk(self.audio_buffer)
-                self.current_online_chunk_buffer_size += len(self.audio_buffer)
+                self.send_audio(self.buffer_offset)
                 self.clear_buffer()
             else:
                 # We keep 1 second because VAD may later find start of voice in it.
                 # But we trim it to prevent OOM. 
-                self.buffer_offset += max(0,len(self.audio_buffer)-self.SAMPLING_RATE)
-                self.audio_buffer = self.audio_buffer[-self.SAMPLING_RATE:]
+                self.buffer_offset = max(self.buffer_offset, self.audio_buffer.end-self.SAMPLING_RATE)
+
+        # VAD may still need the incomplete window after the sent audio
+        self.audio_buffer.drop_to(min(self.buffer_offset, self.vac.position))
 
 
     def process_iter(self):
@@ -726,6 +1080,9 @@ class VACOnlineASRProcessor(OnlineASRProcessor):
         self.is_currently_final = False
         return ret
 
+    def close(self):
+        self.online.close()
+
 
 
 WHISPER_LANG_CODES = "af,am,ar,as,az,ba,be,bg,bn,bo,br,bs,ca,cs,cy,da,de,el,en,es,et,eu,fa,fi,fo,fr,gl,gu,ha,haw,he,hi,hr,ht,hu,hy,id,is,it,ja,jw,ka,kk,km,kn,ko,la,lb,ln,lo,lt,lv,mg,mi,mk,ml,mn,mr,ms,mt,my,ne,nl,nn,no,oc,pa,pl,ps,pt,ro,ru,sa,sd,si,sk,sl,sn,so,sq,sr,su,sv,sw,ta,te,tg,th,tk,tl,tr,tt,uk,ur,uz,vi,yi,yo,zh".split(",")
@@ -771,22 +1128,44 @@ def add_shared_args(parser):
     parser.add_argument('--model_dir', type=str, default=None, help="Dir where Whisper model.bin and other files are saved. This option overrides --model and --model_cache_dir parameter.")
     parser.add_argument('--lan', '--language', type=str, default='auto', help="Source language code, e.g. en,de,cs, or 'auto' for language detection.")
     parser.add_argument('--task', type=str, default='transcribe', choices=["transcribe","translate"],help="Transcribe or translate.")
-    parser.add_argument('--backend', type=str, default="faster-whisper", choices=["faster-whisper", "whisper_timestamped", "mlx-whisper", "openai-api"],help='Load only this backend for Whisper processing.')
+    parser.add_argument('--backend', type=str, default="faster-whisper", choices=["faster-whisper", "whisper_timestamped", "mlx-whisper", "openai-api", "stub"],help='Load only this backend for Whisper processing. "stub" is a fake backend without any model, for tests and benchmarks.')
     parser.add_argument('--vac', action="store_true", default=False, help='Use VAC = voice activity controller. Recommended. Requires torch.')
     parser.add_argument('--vac-chunk-size', type=float, default=0.04, help='VAC sample size in seconds.')
+    parser.add_argument('--vac-model', type=str, default=None, dest="vac_model", help='Local Silero VAD model file (.jit or .onnx) for VAC. If not set, the model from silero-vad package is used, or it is downloaded by torch.hub.')
     parser.add_argument('--vad', action="store_true", default=False, help='Use VAD = voice activity detection, with the default parameters.')
     parser.add_argument('--buffer_trimming', type=str, default="segment", choices=["sentence", "segment"],help='Buffer trimming strategy -- trim completed sentences marked with punctuation mark and detected by sentence segmenter, or the completed segments returned by Whisper. Sentence segmenter must be installed for "sentence" option.')
     parser.add_argument('--buffer_trimming_sec', type=float, default=15, help='Buffer trimming length threshold in seconds. If buffer length is longer, trimming sentence/segment is triggered.')
+    parser.add_argument('--commit-log', type=str, default=None, dest="commit_log", help='File where the commited transcript is stored, as JSON lines. Only the recent words are kept in memory. If not set, a temporary file is used and removed.')
+    parser.add_argument('--feature-cache', action="store_true", default=False, dest="feature_cache", help='Reuse the log-mel features of the audio that was already processed in the previous iterations. Only for faster-whisper backend.')
+    parser.add_argument('--audio-buffer-dtype', type=str, default="float32", choices=["float32", "int16"], help='Storage format of the audio buffer. int16 takes half of the memory, the float32 audio is then converted when it is passed to Whisper.')
+    parser.add_argument('--audio-cache-dir', type=str, default=None, dest="audio_cache_dir", help='Directory where the decoded audio files are cached as .npy files, and kept for the next runs. If not set, a temporary directory is used.')
+    parser.add_argument('--audio-cache-size', type=float, default=2048, dest="audio_cache_size", help='Size budget of the decoded audio cache in MB. The least recently used files are removed.')
+    parser.add_argument('--instrumentation', type=str, default=None, help='File where the duration of the process_iter stages (transcribe, hypothesis buffer, trimming, ...), the buffer length and the other numbers of each iteration are appended as JSON lines.')
+    parser.add_argument('--batch-size', type=int, default=1, dest="batch_size", help='Maximum number of audio buffers from concurrent sessions that are sent to the backend at once. 1 means no batching. Only for the backends that decode a batch in one model call (faster-whisper), ignored with the others.')
+    parser.add_argument('--batch-wait', type=float, default=0.05, dest="batch_wait", help='Maximum time in seconds that a transcription request waits for others to make a batch.')
     parser.add_argument("-l", "--log-level", dest="log_level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help="Set the log level", default='DEBUG')
 
-def asr_factory(args, logfile=sys.stderr):
+def asr_factory(args, logfile=sys.stderr, instrumentation=None):
     """
     Creates and configures an ASR and ASR Online instance based on the specified backend and arguments.
+    instrumentation: collector of the timing of process_iter stages, see online_factory
+    """
+    asr = create_asr(args)
+    online = online_factory(args, asr, logfile=logfile, instrumentation=instrumentation)
+    return asr, online
+
+def create_asr(args):
+    """
+    Creates and configures the ASR object based on the specified backend and arguments.
+    It can be shared by more OnlineASRProcessors, see online_factory.
     """
     backend = args.backend
     if backend == "openai-api":
         logger.debug("Using OpenAI API.")
         asr = OpenaiApiASR(lan=args.lan)
+    elif backend == "stub":
+        logger.debug("Using the stub ASR backend.")
+        asr = StubASR(lan=args.lan)
     else:
         if backend == "faster-whisper":
             asr_cls = FasterWhisperASR
@@ -808,12 +1187,38 @@ def asr_factory(args, logfile=sys.stderr):
         logger.info("Setting VAD filter")
         asr.use_vad()
 
-    language = args.lan
     if args.task == "translate":
         asr.set_translate_task()
+
+    # waiting for a batch only adds latency if the backend decodes the buffers one by one anyway
+    batch_size = args.batch_size
+    if batch_size > 1 and not asr.decodes_batches:
+        logger.warning(f"The {backend} backend doesn't decode batches, --batch-size is ignored")
+        batch_size = 1
+
+    # the server serves more clients at once, their requests always go through the scheduler
+    workers = getattr(args, 'inference_workers', None)
+    if batch_size > 1 or workers is not None:
+        from batch_scheduler import BatchScheduler
+        workers = workers or 1
+        if batch_size > 1:
+            logger.info(f"Batching transcription requests, up to {batch_size} in {args.batch_wait} seconds, {workers} inference worker(s)")
+        else:
+            logger.info(f"Transcription requests run in {workers} inference worker(s)")
+        asr = BatchScheduler(asr, max_batch_size=batch_size, max_wait=args.batch_wait, workers=workers)
+
+    return asr
+
+def online_factory(args, asr, logfile=sys.stderr, instrumentation=None):
+    """
+    Creates an OnlineASRProcessor (or VACOnlineASRProcessor) for one audio stream, with the ASR object from create_asr.
+    instrumentation: instrumentation.Instrumentation object that collects the timing of process_iter stages, or None.
+        It can be shared by all the processors, see create_instrumentation.
+    """
+    if args.task == "translate":
         tgt_language = "en"  # Whisper translates into English
     else:
-        tgt_language = language  # Whisper transcribes in this language
+        tgt_language = args.lan  # Whisper transcribes in this language
 
     # Create the tokenizer
     if args.buffer_trimming == "sentence":
@@ -822,13 +1227,98 @@ def asr_factory(args, logfile=sys.stderr):
         tokenizer = None
 
     # Create the OnlineASRProcessor
+    audio_dtype = np.dtype(args.audio_buffer_dtype)
     if args.vac:
         
-        online = VACOnlineASRProcessor(args.min_chunk_size, asr,tokenizer,logfile=logfile,buffer_trimming=(args.buffer_trimming, args.buffer_trimming_sec))
+        online = VACOnlineASRProcessor(args.min_chunk_size, asr,tokenizer,logfile=logfile,buffer_trimming=(args.buffer_trimming, args.buffer_trimming_sec),audio_dtype=audio_dtype,commit_log=args.commit_log,feature_cache=args.feature_cache,instrumentation=instrumentation,vac_model_path=args.vac_model)
     else:
-        online = OnlineASRProcessor(asr,tokenizer,logfile=logfile,buffer_trimming=(args.buffer_trimming, args.buffer_trimming_sec))
+        online = OnlineASRProcessor(asr,tokenizer,logfile=logfile,buffer_trimming=(args.buffer_trimming, args.buffer_trimming_sec),audio_dtype=audio_dtype,commit_log=args.commit_log,feature_cache=args.feature_cache,instrumentation=instrumentation)
+
+    return online
+
+def create_instrumentation(args):
+    """Returns the collector of process_iter timing that is set by --instrumentation, or None."""
+    if not getattr(args, "instrumentation", None):
+        return None
+    from instrumentation import JSONLCollector
+    return JSONLCollector(args.instrumentation)
+
+def simulate(online, source, min_chunk, start_at=0.0, mode="online", callback=None):
+    """Simulates live streaming of an audio file into the online processor.
+    source: the audio file, see open_audio_file
+    mode: "online" -- the chunks come in real time, as they would be recorded (simultaneous mode);
+        "comp_unaware" -- computationally unaware: the time is the end of the processed audio, as if the processing took no time;
+        "offline" -- the whole audio is processed at once
+    callback: called after each process_iter and after finish, as callback(o, now, end, compute_time):
+        o -- the output of process_iter or finish
+        now -- emission time in seconds from the beginning of processing
+        end -- the end of audio that was inserted by then, in seconds
+        compute_time -- duration of the process_iter or finish call in seconds
+    """
+    duration = source.duration
+    beg = start_at
+    start = time.time()-beg
 
-    return asr, online
+    def process(end, now=None):
+        t = time.time()
+        try:
+            o = online.process_iter()
+        except AssertionError as e:
+            logger.error(f"assertion error: {repr(e)}")
+            return
+        t = time.time()-t
+        if callback is not None:
+            callback(o, time.time()-start if now is None else now, end, t)
+
+    if mode == "offline": ## offline mode processing (for testing/debugging)
+        a = source.chunk(0, duration)
+        online.insert_audio_chunk(a)
+        process(duration)
+        now = None
+    elif mode == "comp_unaware":  # computational unaware mode 
+        end = beg + min_chunk
+        while True:
+            a = source.chunk(beg,end)
+            online.insert_audio_chunk(a)
+            process(end, now=end)
+
+            logger.debug(f"## last processed {end:.2f}s")
+
+            if end >= duration:
+                break
+            
+            beg = end
+            
+            if end + min_chunk > duration:
+                end = duration
+            else:
+                end += min_chunk
+        now = duration
+
+    else: # online = simultaneous mode
+        end = 0
+        while True:
+            now = time.time() - start
+            if now < end+min_chunk:
+                time.sleep(min_chunk+end-now)
+            end = time.time() - start
+            a = source.chunk(beg,end)
+            beg = end
+            online.insert_audio_chunk(a)
+
+            process(end)
+            now = time.time() - start
+            logger.debug(f"## last processed {end:.2f} s, now is {now:.2f}, the latency is {now-end:.2f}")
+
+            if end >= duration:
+                break
+        now = None
+
+    t = time.time()
+    o = online.finish()
+    t = time.time()-t
+    if callback is not None:
+        callback(o, time.time()-start if now is None else now, duration, t)
 
 def set_logging(args,logger,other="_server"):
     logging.basicConfig(#format='%(name)s 
@@ -848,8 +1338,12 @@ if __name__ == "__main__":
     parser.add_argument('--start_at', type=float, default=0.0, help='Start processing audio at this time.')
     parser.add_argument('--offline', action="store_true", default=False, help='Offline mode.')
     parser.add_argument('--comp_unaware', action="store_true", default=False, help='Computationally unaware simulation.')
+    parser.add_argument('--offline-workers', type=int, default=0, dest="offline_workers", help='In the offline mode, split the audio at the silences detected by VAD and transcribe the segments with this many worker processes, see parallel_transcribe.py. 0: the whole audio at once.')
+    parser.add_argument('--max-segment', type=float, default=30.0, dest="max_segment", help='Maximum segment length in seconds for --offline-workers.')
     
     args = parser.parse_args()
+    if args.offline_workers > 0 and args.max_segment <= 0:
+        parser.error("--max-segment must be positive")
 
     # reset to store stderr to different file stream, e.g. open(os.devnull,"w")
     logfile = sys.stderr
@@ -863,37 +1357,50 @@ if __name__ == "__main__":
 #                            level=getattr(logging, args.log_level))
 
     set_logging(args,logger)
+    set_audio_cache(args.audio_cache_dir, int(args.audio_cache_size*1024**2))
 
     audio_path = args.audio_path
 
     SAMPLING_RATE = 16000
-    duration = len(load_audio(audio_path))/SAMPLING_RATE
+
+    if args.offline and args.offline_workers > 0:
+        # the model is loaded only in the worker processes
+        from parallel_transcribe import transcribe_parallel
+        audio = load_audio(audio_path)[int(args.start_at*SAMPLING_RATE):]
+        start = time.time()
+
+        def output_segment(o):
+            beg, end = o[0] + args.start_at, o[1] + args.start_at
+            print("%1.4f %1.0f %1.0f %s" % ((time.time()-start)*1000, beg*1000, end*1000, o[2]), flush=True)
+
+        transcribe_parallel(args, audio, args.offline_workers, args.max_segment, callback=output_segment)
+        logger.info(f"Transcribed {len(audio)/SAMPLING_RATE:.1f} s of audio in {time.time()-start:.1f} s")
+        sys.exit(0)
+
+    source = open_audio_file(audio_path, start_at=args.start_at)
+    duration = source.duration
     logger.info("Audio duration is: %2.2f seconds" % duration)
 
-    asr, online = asr_factory(args, logfile=logfile)
+    instrumentation = create_instrumentation(args)
+    asr, online = asr_factory(args, logfile=logfile, instrumentation=instrumentation)
     if args.vac:
         min_chunk = args.vac_chunk_size
     else:
         min_chunk = args.min_chunk_size
 
-    # load the audio into the LRU cache before we start the timer
-    a = load_audio_chunk(audio_path,0,1)
+    # decode the first chunk before we start the timer
+    a = source.chunk(args.start_at, args.start_at+1)
 
     # warm up the ASR because the very first transcribe takes much more time than the other
     asr.transcribe(a)
 
-    beg = args.start_at
-    start = time.time()-beg
-
-    def output_transcript(o, now=None):
+    def output_transcript(o, now, end=None, compute_time=None):
         # output format in stdout is like:
         # 4186.3606 0 1720 Takhle to je
         # - the first three words are:
         #    - emission time from beginning of processing, in milliseconds
         #    - beg and end timestamp of the text segment, as estimated by Whisper model. The timestamps are not accurate, but they're useful anyway
         # - the next words: segment transcript
-        if now is None:
-            now = time.time()-start
         if o[0] is not None:
             print("%1.4f %1.0f %1.0f %s" % (now*1000, o[0]*1000,o[1]*1000,o[2]),file=logfile,flush=True)
             print("%1.4f %1.0f %1.0f %s" % (now*1000, o[0]*1000,o[1]*1000,o[2]),flush=True)
@@ -901,66 +1408,16 @@ if __name__ == "__main__":
             # No text, so no output
             pass
 
-    if args.offline: ## offline mode processing (for testing/debugging)
-        a = load_audio(audio_path)
-        online.insert_audio_chunk(a)
-        try:
-            o = online.process_iter()
-        except AssertionError as e:
-            logger.error(f"assertion error: {repr(e)}")
-        else:
-            output_transcript(o)
-        now = None
-    elif args.comp_unaware:  # computational unaware mode 
-        end = beg + min_chunk
-        while True:
-            a = load_audio_chunk(audio_path,beg,end)
-            online.insert_audio_chunk(a)
-            try:
-                o = online.process_iter()
-            except AssertionError as e:
-                logger.error(f"assertion error: {repr(e)}")
-                pass
-            else:
-                output_transcript(o, now=end)
-
-            logger.debug(f"## last processed {end:.2f}s")
-
-            if end >= duration:
-                break
-            
-            beg = end
-            
-            if end + min_chunk > duration:
-                end = duration
-            else:
-                end += min_chunk
-        now = duration
-
-    else: # online = simultaneous mode
-        end = 0
-        while True:
-            now = time.time() - start
-            if now < end+min_chunk:
-                time.sleep(min_chunk+end-now)
-            end = time.time() - start
-            a = load_audio_chunk(audio_path,beg,end)
-            beg = end
-            online.insert_audio_chunk(a)
-
-            try:
-                o = online.process_iter()
-            except AssertionError as e:
-                logger.error(f"assertion error: {e}")
-                pass
-            else:
-                output_transcript(o)
-            now = time.time() - start
-            logger.debug(f"## last processed {end:.2f} s, now is {now:.2f}, the latency is {now-end:.2f}")
-
-            if end >= duration:
-                break
-        now = None
-
-    o = online.finish()
-    output_transcript(o, now=now)
+    if args.offline:
+        mode = "offline"
+    elif args.comp_unaware:
+        mode = "comp_unaware"
+    else:
+        mode = "online"
+    try:
+        simulate(online, source, min_chunk, start_at=args.start_at, mode=mode, callback=output_transcript)
+    finally:
+        source.close()
+        online.close()
+        if instrumentation is not None:
+            instrumentation.close()
@@ -15,12 +15,27 @@ parser.add_argument("--host", type=str, default='localhost')
 parser.add_argument("--port", type=int, default=43007)
 parser.add_argument("--warmup-file", type=str, dest="warmup_file", 
         help="The path to a speech audio wav file to warm up Whisper so that the very first chunk processing is fast. It can be e.g. https://github.com/ggerganov/whisper.cpp/raw/master/samples/jfk.wav .")
+parser.add_argument("--max-connections", type=int, default=8, dest="max_connections",
+        help="Maximum number of clients served at once. The others are refused.")
+parser.add_argument("--inference-workers", type=int, default=1, dest="inference_workers",
+        help="Number of threads that run the shared Whisper model. More than 1 only if the backend can run concurrently.")
+parser.add_argument("--protocol", type=str, default="raw", choices=["raw", "framed"],
+        help="raw: the client sends raw audio bytes and receives line_packet lines (the original protocol). framed: messages in both directions are length-prefixed frames, see frame_protocol.py.")
+parser.add_argument("--pcm-format", type=str, default="s16le", dest="pcm_format", choices=["s16le", "f32le"],
+        help="Raw audio format that the clients send: signed 16-bit or 32-bit float, little endian.")
+parser.add_argument("--client-sample-rate", type=int, default=16000, dest="client_sample_rate",
+        help="Sampling rate of the audio that the clients send, e.g. 48000. It's resampled to 16000 on the server. In the framed protocol, the client can set it by MSG_CONFIG.")
+parser.add_argument("--client-channels", type=int, default=1, dest="client_channels",
+        help="Number of interleaved channels of the audio that the clients send. They are averaged to mono.")
+parser.add_argument("--idle-timeout", type=float, default=60, dest="idle_timeout",
+        help="Close the connection if the client doesn't send any audio for this many seconds.")
 
 # options from whisper_online
 add_shared_args(parser)
 args = parser.parse_args()
 
 set_logging(args,logger,other="")
+set_audio_cache(args.audio_cache_dir, int(args.audio_cache_size*1024**2))
 
 # setting whisper object by args 
 
@@ -28,7 +43,7 @@ SAMPLING_RATE = 16000
 
 size = args.model
 language = args.lan
-asr, online = asr_factory(args)
+asr = create_asr(args)
 min_chunk = args.min_chunk_size
 
 # warm up the ASR because the very first transcribe takes more time than the others. 
@@ -36,7 +51,8 @@ min_chunk = args.min_chunk_size
 msg = "Whisper is not warmed up. The first chunk processing may take longer."
 if args.warmup_file:
     if os.path.isfile(args.warmup_file):
-        a = load_audio_chunk(args.warmup_file,0,1)
+        with open_audio_file(args.warmup_file) as f:
+            a = f.chunk(0,1)
         asr.transcribe(a)
         logger.info("Whisper is warmed up.")
     else:
@@ -49,17 +65,23 @@ else:
 ######### Server objects
 
 import line_packet
+import frame_protocol
 import socket
+import selectors
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 class Connection:
     '''it wraps conn object'''
     PACKET_SIZE = 32000*5*60 # 5 minutes # was: 65536
 
-    def __init__(self, conn):
+    def __init__(self, conn, idle_timeout=None):
         self.conn = conn
         self.last_line = ""
+        self.ended = False  # whether the client announced the end of the stream
 
-        self.conn.setblocking(True)
+        self.conn.settimeout(idle_timeout)
 
     def send(self, line):
         '''it doesn't send the same line twice, because it was problematic in online-text-flow-events'''
@@ -68,29 +90,78 @@ class Connection:
         line_packet.send_one_line(self.conn, line)
         self.last_line = line
 
-    def receive_lines(self):
-        in_line = line_packet.receive_lines(self.conn)
-        return in_line
+    def _receive_audio_into(self, pcm):
+        # a small request, the buffer only grows when min_chunk of audio doesn't fit
+        n = self.conn.recv_into(pcm.writable())
+        pcm.commit(n)
+        return n > 0
 
-    def non_blocking_receive_audio(self):
+    def receive_audio_into(self, pcm):
+        """receives the audio bytes that are available into pcm (audio_ingest.PCMBuffer). Returns False if the connection is closed."""
         try:
-            r = self.conn.recv(self.PACKET_SIZE)
-            return r
+            return self._receive_audio_into(pcm)
         except ConnectionResetError:
-            return None
+            return False
+        except socket.timeout:
+            logger.info("client is idle, closing the connection")
+            return False
+        except OSError:  # the socket was shut down by the server
+            return False
+        except frame_protocol.ProtocolError as e:
+            logger.error(f"protocol error: {e}")
+            return False
+
+
+class FramedConnection(Connection):
+    '''it wraps conn object, messages in both directions are frames of frame_protocol'''
+
+    def __init__(self, conn, idle_timeout=None):
+        super().__init__(conn, idle_timeout)
+        self.reader = frame_protocol.FrameReader(conn)
+
+    def send(self, line):
+        if line == self.last_line:
+            return
+        frame_protocol.send_text(self.conn, line)
+        self.last_line = line
 
+    def send_end(self):
+        frame_protocol.send_frame(self.conn, frame_protocol.MSG_END)
 
-import io
-import soundfile
+    def _receive_audio_into(self, pcm):
+        # the payload of the next audio frame
+        while True:
+            frame = self.reader.read_frame()
+            if frame is None:
+                return False
+            msg_type, payload = frame
+            if msg_type == frame_protocol.MSG_AUDIO:
+                pcm.feed(payload)
+                return True
+            if msg_type == frame_protocol.MSG_END:
+                self.ended = True
+                return False
+            if msg_type == frame_protocol.MSG_CONFIG:
+                try:
+                    pcm.configure_json(payload)
+                except ValueError as e:
+                    raise frame_protocol.ProtocolError(f"invalid config: {e}")
+                logger.info(f"client audio: {pcm.sample_format}, {pcm.sample_rate} Hz, {pcm.channels} channels")
+                continue
+            logger.warning(f"ignoring unexpected message type {msg_type}")
+
+
+from audio_ingest import PCMStream
 
 # wraps socket and ASR object, and serves one client connection. 
 # next client should be served by a new instance of this object
 class ServerProcessor:
 
-    def __init__(self, c, online_asr_proc, min_chunk):
+    def __init__(self, c, online_asr_proc, min_chunk, pcm_format="s16le", sample_rate=SAMPLING_RATE, channels=1):
         self.connection = c
         self.online_asr_proc = online_asr_proc
         self.min_chunk = min_chunk
+        self.pcm = PCMStream(pcm_format, sample_rate, channels, out_rate=SAMPLING_RATE)
 
         self.last_end = None
 
@@ -100,23 +171,20 @@ class ServerProcessor:
         # receive all audio that is available by this time
         # blocks operation if less than self.min_chunk seconds is available
         # unblocks if connection is closed or a chunk is available
-        out = []
-        minlimit = self.min_chunk*SAMPLING_RATE
-        while sum(len(x) for x in out) < minlimit:
-            raw_bytes = self.connection.non_blocking_receive_audio()
-            if not raw_bytes:
+        # 16 kHz mono audio is returned as PCM16 or float32 view of the receive buffer, valid until the next call.
+        # OnlineASRProcessor converts it when it stores it. Other audio is resampled and downmixed by self.pcm.
+        # after the end of the stream, nothing more comes, the rest of the audio is returned even if it's short
+        while self.pcm.duration() < self.min_chunk and not self.connection.ended:
+            if not self.connection.receive_audio_into(self.pcm):
                 break
-#            print("received audio:",len(raw_bytes), "bytes", raw_bytes[:10])
-            sf = soundfile.SoundFile(io.BytesIO(raw_bytes), channels=1,endian="LITTLE",samplerate=SAMPLING_RATE, subtype="PCM_16",format="RAW")
-            audio, _ = librosa.load(sf,sr=SAMPLING_RATE,dtype=np.float32)
-            out.append(audio)
-        if not out:
+        short = self.pcm.duration() < self.min_chunk
+        audio = self.pcm.take()
+        if len(audio) == 0:
             return None
-        conc = np.concatenate(out)
-        if self.is_first and len(conc) < minlimit:
+        if self.is_first and short and not self.connection.ended:
             return None
         self.is_first = False
-        return np.concatenate(out)
+        return audio
 
     def format_output_transcript(self,o):
         # output format in stdout is like:
@@ -155,13 +223,19 @@ class ServerProcessor:
             if a is None:
                 break
             self.online_asr_proc.insert_audio_chunk(a)
-            o = online.process_iter()
+            o = self.online_asr_proc.process_iter()
             try:
                 self.send_result(o)
             except BrokenPipeError:
                 logger.info("broken pipe -- connection closed?")
                 break
 
+        if self.connection.ended:
+            # the client finished the stream and waits for the rest of the transcript
+            o = self.online_asr_proc.finish()
+            self.send_result(o)
+            self.connection.send_end()
+
 #        o = online.finish()  # this should be working
 #        self.send_result(o)
 
@@ -169,16 +243,90 @@ class ServerProcessor:
 
 # server loop
 
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.bind((args.host, args.port))
-    s.listen(1)
-    logger.info('Listening on'+str((args.host, args.port)))
-    while True:
-        conn, addr = s.accept()
-        logger.info('Connected to client on {}'.format(addr))
-        connection = Connection(conn)
-        proc = ServerProcessor(connection, online, args.min_chunk_size)
-        proc.process()
-        conn.close()
-        logger.info('Connection to client closed')
+class Server:
+    '''Accepts the clients and serves each of them in a thread of a pool, with its own OnlineASRProcessor.
+    All of them share the loaded model, the transcription requests go to the inference workers of asr (BatchScheduler).
+    '''
+
+    def __init__(self, args, asr):
+        self.args = args
+        self.asr = asr
+        self.instrumentation = create_instrumentation(args)
+        self.pool = ThreadPoolExecutor(max_workers=args.max_connections, thread_name_prefix="client")
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def handle(self, conn, addr):
+        online = None
+        try:
+            online = online_factory(self.args, self.asr, instrumentation=self.instrumentation)
+            if self.args.protocol == "framed":
+                connection = FramedConnection(conn, self.args.idle_timeout)
+            else:
+                connection = Connection(conn, self.args.idle_timeout)
+            proc = ServerProcessor(connection, online, self.args.min_chunk_size, self.args.pcm_format,
+                                   self.args.client_sample_rate, self.args.client_channels)
+            proc.process()
+        except Exception:
+            logger.exception(f"Error while serving {addr}")
+        finally:
+            if online is not None:
+                online.close()
+            with self.lock:
+                self.connections.discard(conn)
+            conn.close()
+            logger.info(f'Connection to client {addr} closed')
+
+    def serve(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind((self.args.host, self.args.port))
+            s.listen(self.args.max_connections)
+            s.setblocking(False)
+            logger.info('Listening on'+str((self.args.host, self.args.port)))
+            with selectors.DefaultSelector() as sel:
+                sel.register(s, selectors.EVENT_READ)
+                while not self.stopping.is_set():
+                    for _ in sel.select(timeout=0.5):
+                        try:
+                            conn, addr = s.accept()
+                        except BlockingIOError:
+                            continue
+                        with self.lock:
+                            full = len(self.connections) >= self.args.max_connections
+                            if not full:
+                                self.connections.add(conn)
+                        if full:
+                            logger.warning(f'Too many connections, refusing {addr}')
+                            conn.close()
+                            continue
+                        logger.info('Connected to client on {}'.format(addr))
+                        conn.setblocking(True)
+                        self.pool.submit(self.handle, conn, addr)
+        self.shutdown()
+
+    def stop(self, *_):
+        logger.info("Stopping the server")
+        self.stopping.set()
+
+    def shutdown(self):
+        # unblocks the clients waiting for audio, they finish and close
+        with self.lock:
+            for conn in self.connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.pool.shutdown(wait=True)
+        if hasattr(self.asr, "close"):
+            self.asr.close()
+        if self.instrumentation is not None:
+            self.instrumentation.close()
+
+
+server = Server(args, asr)
+signal.signal(signal.SIGINT, server.stop)
+signal.signal(signal.SIGTERM, server.stop)
+server.serve()
 logger.info('Connection closed, terminating.')